@@ -9,7 +9,6 @@
 #   some ideas taked from PyMongo interface http://api.mongodb.org/python/current/index.html
 #   kvlite2 tutorial http://code.google.com/p/kvlite/wiki/kvlite2
 #
-#   TODO autocommit for put()
 #   TODO synchronise documents between few datastores
 #   TODO add redis support
 #   TODO is it possible to merge hotqueue functionality with kvlite? Will it be useful?
@@ -41,24 +40,103 @@ ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 POSSIBILITY OF SUCH DAMAGE."""
 
 import os
+import re
+import abc
 import sys
 import json
+import math
 import zlib
+import heapq
+import struct
+import marshal
+import bisect
+import binascii
+import hashlib
+import itertools
 import uuid
 import time
+import Queue
+import random
 import logging
+import types
+import atexit
 import sqlite3
+import weakref
+import functools
+import threading
+import multiprocessing
+import urlparse
 import cPickle as pickle
 
+from collections import deque
+from collections import defaultdict
+from collections import OrderedDict
+
 __all__ = ['open', 'remove', ]
 
 try:
     import MySQLdb
+    import MySQLdb.cursors
 except ImportError:
     pass
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_MISSING = object()
+
 SUPPORTED_BACKENDS = ['mysql', 'sqlite', ]
 MAX_KEY_LENGTH = 255
+INDEXES_TABLE = 'kvlite__indexes'
+STATS_TABLE = 'kvlite__stats'
+SCHEMA_TABLE = 'kvlite__schema'
+RING_TABLE = 'kvlite__ring'
+# SQLite collection schema versions: 1 - rowid table with unique index on k,
+# 2 - WITHOUT ROWID table clustered by k, see SqliteCollectionManager.migrate().
+# New collections keep version 1 by default: the pages of items(), keys() and
+# checkpoints of background jobs are in rowid order only for version 1
+SQLITE_SCHEMA_VERSION = 1
+SQLITE_LATEST_SCHEMA_VERSION = 2
+# upper bounds of key length buckets in statistics
+KEY_LENGTH_BUCKETS = (8, 16, 32, 64, 128, 256)
+DEFAULT_CHUNK_SIZE = 500
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_PING_INTERVAL = 30
+DEFAULT_RECONNECT_DEADLINE = 3
+DEFAULT_REPLICAS = 160
+# seconds between checks of failed tasks while unordered parallel_items()
+# waits for the next page
+PARALLEL_CHECK_INTERVAL = 0.5
+
+# key column types: str - varchar, binary/varbinary - fixed/variable width
+# binary column, the keys of binary columns are hex strings of stored bytes
+KEY_TYPES = ('str', 'binary', 'varbinary')
+DEFAULT_BINARY_KEY_SIZE = 16
+
+# SQLite URI options, option: (pragma, allowed values or type)
+SQLITE_PRAGMAS = {
+    'journal': ('journal_mode', ('delete', 'truncate', 'persist', 'memory', 'wal', 'off')),
+    'synchronous': ('synchronous', ('off', 'normal', 'full', 'extra')),
+    'temp_store': ('temp_store', ('default', 'file', 'memory')),
+    'mmap_size': ('mmap_size', int),
+    'cache_size': ('cache_size', int),
+    'page_size': ('page_size', int),
+}
+
+# SQLite tuning profiles, can be selected by `profile` URI option
+SQLITE_PROFILES = {
+    'default': {},
+    'throughput': {
+        'journal': 'wal',
+        'synchronous': 'normal',
+        'temp_store': 'memory',
+        'cache_size': '-65536',
+        'mmap_size': '268435456',
+        'busy_timeout': '5000',
+    },
+}
 
 '''
 A collection is a group of documents stored in kvlite2,
@@ -114,6 +192,219 @@ class CompressedJsonSerializer(object):
         ''' loads value  '''
         return json.loads(zlib.decompress(v))
 
+# -----------------------------------------------------------------
+# BinaryPickleSerializer class
+# -----------------------------------------------------------------
+
+
+class BinaryPickleSerializer(object):
+
+    ''' pickle with the highest binary protocol '''
+
+    @staticmethod
+    def dumps(v):
+        ''' dumps value '''
+        return pickle.dumps(v, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def loads(v):
+        ''' loads value  '''
+        return pickle.loads(v)
+
+# -----------------------------------------------------------------
+# MarshalSerializer class
+# -----------------------------------------------------------------
+
+
+class MarshalSerializer(object):
+
+    ''' marshal, only for plain data: None, bool, numbers, strings, tuples,
+    lists, dicts and sets
+    '''
+
+    @staticmethod
+    def dumps(v):
+        ''' dumps value '''
+        return marshal.dumps(v, 2)
+
+    @staticmethod
+    def loads(v):
+        ''' loads value  '''
+        return marshal.loads(v)
+
+# -----------------------------------------------------------------
+# MsgpackSerializer class
+# -----------------------------------------------------------------
+
+
+def _pack_msgpack(v, out):
+    ''' append MessagePack encoding of v to the list out '''
+    if v is None:
+        out.append('\xc0')
+    elif v is True:
+        out.append('\xc3')
+    elif v is False:
+        out.append('\xc2')
+    elif isinstance(v, (int, long)):
+        if 0 <= v < 0x80:
+            out.append(chr(v))
+        elif -0x20 <= v < 0:
+            out.append(struct.pack('>b', v))
+        elif v >= 0:
+            for code, fmt, limit in (('\xcc', '>B', 1 << 8), ('\xcd', '>H', 1 << 16),
+                                     ('\xce', '>I', 1 << 32), ('\xcf', '>Q', 1 << 64)):
+                if v < limit:
+                    out.append(code + struct.pack(fmt, v))
+                    break
+            else:
+                raise ValueError('Integer is out of range: %s' % v)
+        else:
+            for code, fmt, limit in (('\xd0', '>b', 1 << 7), ('\xd1', '>h', 1 << 15),
+                                     ('\xd2', '>i', 1 << 31), ('\xd3', '>q', 1 << 63)):
+                if v >= -limit:
+                    out.append(code + struct.pack(fmt, v))
+                    break
+            else:
+                raise ValueError('Integer is out of range: %s' % v)
+    elif isinstance(v, float):
+        out.append('\xcb' + struct.pack('>d', v))
+    elif isinstance(v, unicode):
+        data = v.encode('utf-8')
+        n = len(data)
+        if n < 32:
+            out.append(chr(0xa0 | n))
+        elif n < 1 << 8:
+            out.append('\xd9' + struct.pack('>B', n))
+        elif n < 1 << 16:
+            out.append('\xda' + struct.pack('>H', n))
+        else:
+            out.append('\xdb' + struct.pack('>I', n))
+        out.append(data)
+    elif isinstance(v, str):
+        n = len(v)
+        if n < 1 << 8:
+            out.append('\xc4' + struct.pack('>B', n))
+        elif n < 1 << 16:
+            out.append('\xc5' + struct.pack('>H', n))
+        else:
+            out.append('\xc6' + struct.pack('>I', n))
+        out.append(v)
+    elif isinstance(v, (list, tuple)):
+        n = len(v)
+        if n < 16:
+            out.append(chr(0x90 | n))
+        elif n < 1 << 16:
+            out.append('\xdc' + struct.pack('>H', n))
+        else:
+            out.append('\xdd' + struct.pack('>I', n))
+        for item in v:
+            _pack_msgpack(item, out)
+    elif isinstance(v, dict):
+        n = len(v)
+        if n < 16:
+            out.append(chr(0x80 | n))
+        elif n < 1 << 16:
+            out.append('\xde' + struct.pack('>H', n))
+        else:
+            out.append('\xdf' + struct.pack('>I', n))
+        for key, value in v.iteritems():
+            _pack_msgpack(key, out)
+            _pack_msgpack(value, out)
+    else:
+        raise TypeError('Cannot serialize %r' % type(v))
+
+
+# MessagePack formats with fixed size: code: (struct format, size)
+_MSGPACK_FIXED = {
+    '\xca': ('>f', 4), '\xcb': ('>d', 8),
+    '\xcc': ('>B', 1), '\xcd': ('>H', 2), '\xce': ('>I', 4), '\xcf': ('>Q', 8),
+    '\xd0': ('>b', 1), '\xd1': ('>h', 2), '\xd2': ('>i', 4), '\xd3': ('>q', 8),
+}
+
+# MessagePack formats with length: code: (type, struct format of length, size of length)
+_MSGPACK_SIZED = {
+    '\xc4': ('bin', '>B', 1), '\xc5': ('bin', '>H', 2), '\xc6': ('bin', '>I', 4),
+    '\xd9': ('str', '>B', 1), '\xda': ('str', '>H', 2), '\xdb': ('str', '>I', 4),
+    '\xdc': ('array', '>H', 2), '\xdd': ('array', '>I', 4),
+    '\xde': ('map', '>H', 2), '\xdf': ('map', '>I', 4),
+}
+
+
+def _unpack_msgpack(data, pos=0):
+    ''' return (value, position after value) of MessagePack encoded data '''
+    code = data[pos]
+    pos += 1
+    byte = ord(code)
+    if byte < 0x80:
+        return byte, pos
+    if byte >= 0xe0:
+        return byte - 0x100, pos
+    if code in _MSGPACK_FIXED:
+        fmt, size = _MSGPACK_FIXED[code]
+        return struct.unpack_from(fmt, data, pos)[0], pos + size
+    if code == '\xc0':
+        return None, pos
+    if code == '\xc2':
+        return False, pos
+    if code == '\xc3':
+        return True, pos
+    if byte & 0xe0 == 0xa0:
+        kind, n = 'str', byte & 0x1f
+    elif byte & 0xf0 == 0x90:
+        kind, n = 'array', byte & 0x0f
+    elif byte & 0xf0 == 0x80:
+        kind, n = 'map', byte & 0x0f
+    elif code in _MSGPACK_SIZED:
+        kind, fmt, size = _MSGPACK_SIZED[code]
+        n = struct.unpack_from(fmt, data, pos)[0]
+        pos += size
+    else:
+        raise ValueError('Unsupported MessagePack type: 0x%02x' % byte)
+
+    if kind == 'bin':
+        return str(data[pos:pos + n]), pos + n
+    if kind == 'str':
+        return data[pos:pos + n].decode('utf-8'), pos + n
+    if kind == 'array':
+        result = list()
+        for _ in xrange(n):
+            item, pos = _unpack_msgpack(data, pos)
+            result.append(item)
+        return result, pos
+    result = dict()
+    for _ in xrange(n):
+        key, pos = _unpack_msgpack(data, pos)
+        result[key], pos = _unpack_msgpack(data, pos)
+    return result, pos
+
+
+class MsgpackSerializer(object):
+
+    ''' MessagePack, the msgpack package is used if it's installed, otherwise
+    pure-Python encoder. str is stored as bin type, unicode as str type,
+    tuples are loaded as lists
+    '''
+
+    @staticmethod
+    def dumps(v):
+        ''' dumps value '''
+        if msgpack is not None:
+            return msgpack.packb(v, use_bin_type=True)
+        out = list()
+        _pack_msgpack(v, out)
+        return ''.join(out)
+
+    @staticmethod
+    def loads(v):
+        ''' loads value  '''
+        if msgpack is not None:
+            return msgpack.unpackb(v, raw=False)
+        v = str(v)
+        value, pos = _unpack_msgpack(v)
+        if pos != len(v):
+            raise ValueError('Extra data after MessagePack value')
+        return value
+
 # -----------------------------------------------------------------
 # SERIALIZERS
 # -----------------------------------------------------------------
@@ -121,13 +412,196 @@ class CompressedJsonSerializer(object):
 SERIALIZERS = {
     'pickle': cPickleSerializer,
     'completed_json': CompressedJsonSerializer,
+    'pickle_binary': BinaryPickleSerializer,
+    'marshal': MarshalSerializer,
+    'msgpack': MsgpackSerializer,
 }
 
+# -----------------------------------------------------------------
+# FormatSerializer class
+# -----------------------------------------------------------------
+
+# the first byte of the format header
+FORMAT_MAGIC = '\xfe'
+
+# format ids of serializers in the format header, don't change them
+FORMATS = {
+    1: cPickleSerializer,
+    2: CompressedJsonSerializer,
+    3: BinaryPickleSerializer,
+    4: MarshalSerializer,
+    5: MsgpackSerializer,
+}
+
+
+class FormatSerializer(object):
+
+    ''' Serializer which prefixes values by the 2-byte header: FORMAT_MAGIC and
+    the format id from FORMATS. loads() chooses the serializer by the header,
+    values without the header are loaded by `legacy` serializer, so the
+    serializer can be changed without rewriting stored documents.
+
+    >>> collection = open(uri, serializer=FormatSerializer(MarshalSerializer, legacy=cPickleSerializer))
+    '''
+
+    def __init__(self, serializer=BinaryPickleSerializer, legacy=cPickleSerializer):
+
+        format_ids = dict((s, format_id) for format_id, s in FORMATS.items())
+        if serializer not in format_ids:
+            raise RuntimeError('Serializer has no format id: %s' % serializer)
+        self.serializer = serializer
+        self.legacy = legacy
+        self.header = FORMAT_MAGIC + chr(format_ids[serializer])
+
+    def dumps(self, v):
+        ''' dumps value with the header '''
+        return self.header + self.serializer.dumps(v)
+
+    def loads(self, v):
+        ''' loads value by the serializer of its header '''
+        if len(v) > 1 and v[0] == FORMAT_MAGIC:
+            format_id = ord(v[1])
+            if format_id not in FORMATS:
+                raise RuntimeError('Unknown format id: %s' % format_id)
+            return FORMATS[format_id].loads(v[2:])
+        if self.legacy is None:
+            raise RuntimeError('Value without format header')
+        return self.legacy.loads(v)
+
+    def is_current(self, v):
+        ''' return True if the value is stored in the current format '''
+        return v[:2] == self.header
+
+
+# -----------------------------------------------------------------
+# CompressedSerializer class
+# -----------------------------------------------------------------
+
+# the first byte of compressed value: stored as is, deflate, deflate with dictionary
+COMPRESSION_NONE = '\x00'
+COMPRESSION_ZLIB = '\x01'
+COMPRESSION_ZLIB_DICT = '\x02'
+
+# max size of preset dictionary, the deflate window
+MAX_DICTIONARY_SIZE = 32768
+
+
+def train_dictionary(samples, size=MAX_DICTIONARY_SIZE, segment=16, step=1):
+    ''' return preset dictionary for CompressedSerializer made of the most
+    frequent substrings of samples (serialized documents). The substrings
+    found in one sample only are skipped, the most frequent ones are placed
+    at the end of the dictionary, closer to compressed data.
+    '''
+    counts = defaultdict(int)
+    for sample in samples:
+        sample = str(sample)
+        for substring in set(sample[i:i + segment] for i in xrange(0, len(sample) - segment + 1, step)):
+            counts[substring] += 1
+    frequent = sorted((count, substring) for substring, count in counts.iteritems() if count > 1)
+    dictionary = list()
+    total = 0
+    for _, substring in reversed(frequent):
+        if total + len(substring) > min(size, MAX_DICTIONARY_SIZE):
+            break
+        dictionary.append(substring)
+        total += len(substring)
+    dictionary.reverse()
+    return ''.join(dictionary)
+
+
+class CompressedSerializer(object):
+
+    ''' Compress values of the serializer by zlib
+
+    threshold: values shorter than threshold bytes are not compressed
+    level: compression level, 1 - fastest, 9 - best
+    dictionary: preset dictionary, see train_dictionary(), the same dictionary
+    must be used for reading
+
+    The first byte of the value records the choice: COMPRESSION_NONE,
+    COMPRESSION_ZLIB or COMPRESSION_ZLIB_DICT followed by 4-byte id of the
+    dictionary. The value is stored as is if the compressed one is not smaller.
+
+    >>> serializer = CompressedSerializer(BinaryPickleSerializer, threshold=128, level=6)
+    '''
+
+    def __init__(self, serializer=BinaryPickleSerializer, threshold=128, level=6, dictionary=None):
+
+        if dictionary is not None and len(dictionary) > MAX_DICTIONARY_SIZE:
+            raise RuntimeError('Dictionary is longer than %s bytes' % MAX_DICTIONARY_SIZE)
+        self.serializer = serializer
+        self.threshold = threshold
+        self.level = level
+        self.dictionary = dictionary or None
+        self._prime()
+
+    def _prime(self):
+        ''' prepare (de)compressor objects with the dictionary in the window,
+        zlib of Python 2 doesn't support preset dictionaries, so raw deflate
+        streams are started by the dictionary and copied for every value
+        '''
+        self._compressor = None
+        self._decompressor = None
+        self._dictionary_header = None
+        if self.dictionary is None:
+            return
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        primer = compressor.compress(self.dictionary) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        decompressor.decompress(primer)
+        self._compressor = compressor
+        self._decompressor = decompressor
+        self._dictionary_header = COMPRESSION_ZLIB_DICT + struct.pack(
+            '>I', zlib.crc32(self.dictionary) & 0xffffffff)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('_compressor', '_decompressor', '_dictionary_header'):
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._prime()
+
+    def dumps(self, v):
+        ''' dumps and compress value '''
+        data = self.serializer.dumps(v)
+        if len(data) < self.threshold:
+            return COMPRESSION_NONE + data
+        if self._compressor is None:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -zlib.MAX_WBITS)
+            header = COMPRESSION_ZLIB
+        else:
+            compressor = self._compressor.copy()
+            header = self._dictionary_header
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(header) + len(compressed) >= len(data) + 1:
+            return COMPRESSION_NONE + data
+        return header + compressed
+
+    def loads(self, v):
+        ''' decompress and loads value '''
+        header = v[0]
+        if header == COMPRESSION_NONE:
+            data = v[1:]
+        elif header == COMPRESSION_ZLIB:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = decompressor.decompress(v[1:]) + decompressor.flush()
+        elif header == COMPRESSION_ZLIB_DICT:
+            if self._dictionary_header is None or v[:5] != self._dictionary_header:
+                raise RuntimeError('The value is compressed with another dictionary')
+            decompressor = self._decompressor.copy()
+            data = decompressor.decompress(v[5:]) + decompressor.flush()
+        else:
+            raise RuntimeError('Unknown compression: 0x%02x' % ord(header))
+        return self.serializer.loads(data)
+
 
 # -----------------------------------------------------------------
 # KVLite utils
 # -----------------------------------------------------------------
-def open(uri, serializer=cPickleSerializer):
+def open(uri, serializer=cPickleSerializer, pool=None, **options):
     '''
     open collection by URI,
     if collection does not exist kvlite will try to create it
@@ -135,19 +609,38 @@ def open(uri, serializer=cPickleSerializer):
     in case of successful opening or creation new collection
     return Collection object
 
+    uri can be the list of URIs or the shard map {shard name: URI}, in this
+    case ShardedCollection over collections opened by these URIs is returned,
+    for the list of URIs the shard names are URIs
+
     serializer: the class or module to serialize msgs with, must have
     methods or functions named ``dumps`` and ``loads``,
     `pickle <http://docs.python.org/library/pickle.html>`_ is the default,
     use ``None`` to store messages in plain text (suitable for strings,
     integers, etc)
+
+    pool: the dict of connection pool parameters (min_size, max_size, timeout),
+    if defined the collection uses PooledMysqlCollectionManager
+
+    options: the collection options, like commit_every or commit_interval,
+    see BaseCollection. key_type, key_size and schema_version options are
+    used to create new collection, see manager.create()
     '''
     # TODO save kvlite configuration in database
 
-    manager = CollectionManager(uri)
+    if isinstance(uri, (list, tuple, dict)):
+        shard_map = uri.items() if isinstance(uri, dict) else [(u, u) for u in uri]
+        return ShardedCollection(dict(
+            (name, open(shard_uri, serializer, pool, **options)) for name, shard_uri in shard_map))
+
+    key_type = options.pop('key_type', 'str')
+    key_size = options.pop('key_size', None)
+    schema_version = options.pop('schema_version', None)
+    manager = CollectionManager(uri, pool)
     params = manager.parse_uri(uri)
     if params['collection'] not in manager.collections():
-        manager.create(params['collection'])
-    return manager.collection_class(manager.backend_manager, params['collection'], serializer)
+        manager.create(params['collection'], key_type, key_size, schema_version)
+    return manager.collection_class(manager.backend_manager, params['collection'], serializer, **options)
 
 
 def remove(uri):
@@ -172,497 +665,4397 @@ def get_uuid(amount=100):
         uuids.append(("%040s" % u).replace(' ', '0'))
     return uuids
 
-# -----------------------------------------------------------------
-# CollectionManager class
-# -----------------------------------------------------------------
 
+# Crockford's base32 alphabet, in ascending order, so IDs are sorted as numbers
+ID_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+ID_LENGTH = 26
+# pairs of chars for 10-bit groups, halves the number of steps to encode ID
+_ID_PAIRS = [a + b for a in ID_ALPHABET for b in ID_ALPHABET]
 
-class CollectionManager(object):
 
-    ''' Collection Manager'''
+class IdGenerator(object):
 
-    def __init__(self, uri):
+    ''' Generator of monotonic time-ordered IDs in ULID format: 26 chars of
+    Crockford's base32 of 48-bit timestamp in milliseconds and 80-bit random
+    part. The random part of IDs generated in the same millisecond is
+    incremented, so every next ID is greater than previous one and inserts
+    go to the end of the key index. IDs are generated without database.
+    '''
 
-        self.backend_manager = None
+    def __init__(self):
 
-        if not uri or uri.find('://') <= 0:
-            raise RuntimeError('Incorrect URI definition: {}'.format(uri))
-        backend, rest_uri = uri.split('://')
-        if backend in SUPPORTED_BACKENDS:
-            if backend == 'mysql':
-                self.backend_manager = MysqlCollectionManager(uri)
-            elif backend == 'sqlite':
-                self.backend_manager = SqliteCollectionManager(uri)
-        else:
-            raise RuntimeError('Unknown backend: {}'.format(backend))
+        self._lock = threading.Lock()
+        self._reset()
 
-    def parse_uri(self, uri):
-        ''' parse_uri '''
-        return self.backend_manager.parse_uri(uri)
+    def _reset(self):
+        ''' seed random generator of the process, forget the last ID '''
+        self._pid = os.getpid()
+        self._random = random.Random(int(os.urandom(16).encode('hex'), 16))
+        self._last_time = 0
+        self._last_random = 0
 
-    def create(self, name):
-        ''' create collection '''
-        self.backend_manager.create(name)
+    def next(self):
+        ''' return new ID '''
+        with self._lock:
+            if self._pid != os.getpid():
+                # don't repeat random parts and IDs of the parent process after
+                # fork, the next ID of the child starts new random part
+                self._reset()
+            now = max(int(time.time() * 1000), self._last_time)
+            if now == self._last_time:
+                value = self._last_random + 1
+                if value >> 80:
+                    now += 1
+                    value = self._random.getrandbits(79)
+            else:
+                value = self._random.getrandbits(79)
+            self._last_time = now
+            self._last_random = value
+        value |= now << 80
+        chars = list()
+        for _ in xrange(ID_LENGTH / 2):
+            chars.append(_ID_PAIRS[value & 1023])
+            value >>= 10
+        chars.reverse()
+        return ''.join(chars)
 
-    @property
-    def collection_class(self):
-        ''' return object MysqlCollection or SqliteCollection '''
-        return self.backend_manager.collection_class
+    def many(self, amount=100):
+        ''' return list of new IDs '''
+        return [self.next() for _ in xrange(amount)]
 
-    @property
-    def connection(self):
-        ''' return reference to backend connection '''
-        return self.backend_manager.connection
 
-    def collections(self):
-        ''' return list of collections '''
-        return self.backend_manager.collections()
+_id_generator = IdGenerator()
 
-    def remove(self, name):
-        ''' remove collection '''
-        self.backend_manager.remove(name)
 
-# -----------------------------------------------------------------
-# BaseCollectionManager class
-# -----------------------------------------------------------------
+def get_id():
+    ''' return new time-ordered ID, see IdGenerator '''
+    return _id_generator.next()
 
 
-class BaseCollectionManager(object):
+def get_ids(amount=100):
+    ''' return list of new time-ordered IDs, see IdGenerator '''
+    return _id_generator.many(amount)
 
-    def __init__(self, uri):
-        ''' init '''
-        self.uri = uri
-        self.params = self.parse_uri(uri)
-        self.conn()
 
-    def cursor(self):
-        self._reconn()
-        return self._conn.cursor()
+def id_time(id):
+    ''' return the time of ID generation in seconds since epoch '''
+    value = 0
+    for c in id[:10].upper():
+        value = value * 32 + ID_ALPHABET.index(c)
+    return value / 1000.0
 
-    @property
-    def connection(self):
-        ''' return connection '''
-        self._reconn()
-        return self._conn
 
-    def _collections(self, sql):
-        ''' return collection list'''
-        cursor = self.cursor()
-        cursor.execute(sql)
-        return [t[0] for t in cursor.fetchall()]
+def chunks(iterable, size=DEFAULT_CHUNK_SIZE):
+    ''' split iterable on lists with `size` elements max '''
+    chunk = list()
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = list()
+    if chunk:
+        yield chunk
 
-    def _create(self, sql_create_table, name):
-        ''' create collection by name '''
-        cursor = self.cursor()
-        cursor.execute(sql_create_table % name)
-        self._conn.commit()
 
-    def remove(self, name):
-        ''' remove collection '''
-        cursor = self.cursor()
-        if name in self.collections():
-            cursor.execute('DROP TABLE %s;' % name)
-            self._conn.commit()
-        else:
-            raise RuntimeError('No collection with name: {}'.format(name))
+class _Descending(object):
+    ''' wrapper which reverses ordering of the value '''
 
-    def close(self):
-        ''' close connection to database '''
-        self._conn.close()
+    __slots__ = ('value',)
 
-# -----------------------------------------------------------------
-# MysqlCollectionManager class
-# -----------------------------------------------------------------
+    def __init__(self, value):
+        self.value = value
 
+    def __lt__(self, other):
+        return other.value < self.value
 
-class MysqlCollectionManager(BaseCollectionManager):
 
-    def _reconn(self, num=28800, stime=3):
-        _number = 0
-        _status = True
-        while _status and _number <= num:
-            try:
-                self._conn.ping()  # cping 校验连接是否异常
-                _status = False
-            except:
-                if self.conn() == True:  # 重新连接,成功退出
-                    _status = False
-                    break
-                _number += 1
-                logging.error('connection to mysql %s fail', self.uri)
-                time.sleep(stime)
+def merge_sorted(iterables, key=None, reverse=False):
+    ''' merge sorted iterables into one sorted iterator,
+    reverse: the iterables are sorted in descending order
+    '''
+    if key is None:
+        key = lambda item: item
+    order = (lambda item: _Descending(key(item))) if reverse else key
+    iterators = [iter(iterable) for iterable in iterables]
+    heap = list()
+    for i, iterator in enumerate(iterators):
+        for item in iterator:
+            heap.append((order(item), i, item))
+            break
+    heapq.heapify(heap)
+    while heap:
+        _, i, item = heap[0]
+        yield item
+        for item in iterators[i]:
+            heapq.heapreplace(heap, (order(item), i, item))
+            break
+        else:
+            heapq.heappop(heap)
 
-    def conn(self):
-        params = self.params
+
+def _loads_page(serializer, rows):
+    ''' return ((k, v) list, None) from (k, serialized v) rows or (None, error),
+    used by worker processes
+    '''
+    page = list()
+    for k, v in rows:
         try:
-            self._conn = MySQLdb.connect(
-                host=params['host'], port=params['port'],
-                user=params['username'], passwd=params[
-                    'password'],
-                db=params['db'])
-            return True
-        except MySQLdb.OperationalError, err:
-            pass
-        return False
+            page.append((k, serializer.loads(v)))
+        except Exception, err:
+            return None, 'key %s, %s' % (k, err)
+    return page, None
 
-    @staticmethod
-    def parse_uri(uri):
-        '''parse URI
 
-        return driver, user, password, host, port, database, table
-        '''
-        parsed_uri = dict()
-        parsed_uri['backend'], rest_uri = uri.split('://', 1)
-        parsed_uri['username'], rest_uri = rest_uri.split(':', 1)
-        parsed_uri['password'], rest_uri = rest_uri.split('@', 1)
+def _next_page(pending, done):
+    ''' return the next page: the page of the first result of pending deque,
+    or for unordered mode (done is the queue) the first page put in done by
+    the callback as (task id, result), pending is the dict {task id: result}.
+    The callback isn't called for failed tasks, so while waiting the failed
+    results are checked and their errors are raised
+    '''
+    if done is None:
+        page, error = pending.popleft().get()
+    else:
+        while True:
+            try:
+                task, (page, error) = done.get(timeout=PARALLEL_CHECK_INTERVAL)
+                break
+            except Queue.Empty:
+                for result in pending.values():
+                    if result.ready() and not result.successful():
+                        result.get()
+        del pending[task]
+    if error is not None:
+        raise RuntimeError(error)
+    return page
 
-        if ':' in rest_uri:
-            parsed_uri['host'], rest_uri = rest_uri.split(':', 1)
-            parsed_uri['port'], rest_uri = rest_uri.split('/', 1)
-            parsed_uri['port'] = int(parsed_uri['port'])
-        else:
-            parsed_uri['host'], rest_uri = rest_uri.split('/')
-            parsed_uri['port'] = 3306
 
-        if '.' in rest_uri:
-            parsed_uri['db'], parsed_uri['collection'] = rest_uri.split('.', 1)
-        else:
-            parsed_uri['db'] = rest_uri
-            parsed_uri['collection'] = None
-        return parsed_uri
+def _has_iterator(args, kwargs):
+    ''' return True if some of arguments is an iterator (generator, file...) '''
+    return any(hasattr(arg, '__iter__') and iter(arg) is arg
+               for arg in itertools.chain(args, kwargs.values()))
 
-    def create(self, name):
-        ''' create collection '''
 
-        SQL_CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS %%s (
-                                __rowid__ INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
-                                k varchar(%s) NOT NULL,
-                                v MEDIUMBLOB,
-                                UNIQUE KEY (k) ) ENGINE=InnoDB  DEFAULT CHARSET=utf8;;''' % MAX_KEY_LENGTH
+def synchronized(method):
+    ''' call collection method under the instance lock if the lock is defined,
+    with pooled manager the connection is bound to the thread during the call
+    and while there are not committed writes.
 
-        self._create(SQL_CREATE_TABLE, name)
+    If the connection was lost and there are no not committed writes of any
+    collection on the connection, the manager reconnects and the call is
+    retried once. The calls with iterator arguments are not retried, the items
+    consumed by the failed call would be missed
+    '''
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        lock = self._lock
+        manager = self._manager
+        if lock is not None:
+            lock.acquire()
+        if manager.pooled:
+            manager.acquire()
+        try:
+            try:
+                return method(self, *args, **kwargs)
+            except Exception, err:
+                if manager.pending_writes or _has_iterator(args, kwargs) or \
+                        not manager.lost_connection(err):
+                    raise
+                logging.warning('connection to %s lost, reconnect: %s', manager.uri, err)
+                manager.reconnect()
+                return method(self, *args, **kwargs)
+        finally:
+            if manager.pooled:
+                manager.release(keep=manager.pending_writes > 0)
+            if lock is not None:
+                lock.release()
+    return wrapper
 
-    @property
-    def collection_class(self):
-        ''' return MysqlCollection object'''
-        return MysqlCollection
 
-    def collections(self):
-        ''' return collection list'''
-        return self._collections('SHOW TABLES;')
+def parse_query(uri):
+    ''' split URI on URI without query string and dict of query options '''
+    if '?' not in uri:
+        return uri, dict()
+    uri, query = uri.split('?', 1)
+    return uri, dict(urlparse.parse_qsl(query, keep_blank_values=True))
 
-# -----------------------------------------------------------------
-# SqliteCollectionManager class
-# -----------------------------------------------------------------
 
+def prefix_end(prefix):
+    ''' return the least string which is greater than all strings with prefix,
+    None if there is no such string
+    '''
+    if isinstance(prefix, unicode):
+        prefix = prefix.encode('utf-8')
+    prefix = prefix.rstrip('\xff')
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
 
-class SqliteCollectionManager(BaseCollectionManager):
-    def _reconn(self):
-        return True
 
-    def conn(self):
-        self._conn = sqlite3.connect(self.params['db'])
-        self._conn.text_factory = str
-        return True
+def stats_dict(values):
+    ''' return statistics dict from the values of statistics columns: documents,
+    bytes and amount of keys in KEY_LENGTH_BUCKETS
+    '''
+    values = [int(v or 0) for v in values]
+    documents, size = values[:2]
+    return {
+        'documents': documents,
+        'bytes': size,
+        'avg_bytes': float(size) / documents if documents else 0.0,
+        'key_lengths': dict(zip(KEY_LENGTH_BUCKETS, values[2:])),
+    }
+
+
+def backoff(initial=0.05, maximum=1.0):
+    ''' generate exponential delays with full jitter '''
+    delay = initial
+    while True:
+        yield random.uniform(0, delay)
+        delay = min(delay * 2, maximum)
+
+# -----------------------------------------------------------------
+# PeriodicThread class
+# -----------------------------------------------------------------
+
+
+class PeriodicThread(threading.Thread):
+
+    ''' call function every `interval` seconds in background until stop() '''
+
+    def __init__(self, interval, func, name=None):
+        super(PeriodicThread, self).__init__(name=name)
+        self.daemon = True
+        self.interval = interval
+        self._func = func
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self._func()
+            except Exception, err:
+                logging.error('%s: %s', self.name, err)
+
+    def stop(self):
+        ''' stop thread and wait until it finished '''
+        self._stopped.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+# -----------------------------------------------------------------
+# CircuitBreaker class
+# -----------------------------------------------------------------
+
+
+class CircuitBreakerOpen(RuntimeError):
+
+    ''' the backend is known to be down, the call was rejected without trying '''
+
+    pass
+
+
+class CircuitBreaker(object):
+
+    ''' Circuit breaker for backend connections
+
+    closed: calls are allowed
+    open: after failure_threshold failures in a row calls are rejected by
+    CircuitBreakerOpen during reset_timeout seconds
+    half-open: after reset_timeout one call is allowed as a probe, its success
+    closes the breaker, its failure opens the breaker again
+    '''
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        ''' return breaker state: closed, open or half-open '''
+        opened_at = self.opened_at
+        if opened_at is None:
+            return self.CLOSED
+        if time.time() - opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def before_call(self):
+        ''' raise CircuitBreakerOpen if the call is not allowed '''
+        with self._lock:
+            state = self.state
+            if state == self.OPEN or (state == self.HALF_OPEN and self._probing):
+                raise CircuitBreakerOpen(
+                    'Backend is unavailable, retry after %.1f sec' %
+                    max(0, self.opened_at + self.reset_timeout - time.time()))
+            if state == self.HALF_OPEN:
+                self._probing = True
+
+    def success(self):
+        ''' register successful call '''
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def failure(self):
+        ''' register failed call '''
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.time()
+
+# -----------------------------------------------------------------
+# ConnectionPool class
+# -----------------------------------------------------------------
+
+
+class ConnectionPool(object):
+
+    ''' Thread-safe pool of database connections
+
+    connect: function which returns new connection
+    min_size: amount of connections opened on pool creation
+    max_size: max amount of opened connections
+    timeout: max time in seconds to wait for free connection in acquire()
+    check: function which returns False for broken connection, it's called
+    on checkout of connection which was idle more than check_interval seconds
+    '''
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=30, check=None,
+                 check_interval=0):
+
+        if min_size > max_size:
+            raise RuntimeError('Pool min_size is more than max_size')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+
+        self._connect = connect
+        self._check = check
+        self.check_interval = check_interval
+        self._idle = deque()
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+        for _ in xrange(min_size):
+            self._idle.append((connect(), time.time()))
+            self._size += 1
+
+    @property
+    def size(self):
+        ''' amount of opened connections '''
+        return self._size
+
+    @property
+    def idle(self):
+        ''' amount of connections available for checkout '''
+        return len(self._idle)
+
+    def acquire(self, timeout=None):
+        ''' checkout connection, wait for free one not more than timeout seconds '''
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.time() + timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError('Connection pool is closed')
+                if self._idle:
+                    conn, released = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise RuntimeError(
+                        'Timeout %s sec waiting for connection from pool' % timeout)
+                self._cond.wait(remaining)
+
+        if conn is not None and self._check is not None and \
+                time.time() - released >= self.check_interval and not self._check(conn):
+            self._close_connection(conn)
+            conn = None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        return conn
+
+    def release(self, conn):
+        ''' return connection to the pool '''
+        with self._cond:
+            if self._closed:
+                self._size -= 1
+                self._close_connection(conn)
+            else:
+                self._idle.append((conn, time.time()))
+            self._cond.notify()
+
+    def discard(self, conn):
+        ''' close broken connection instead of returning it to the pool '''
+        self._close_connection(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
 
     @staticmethod
-    def parse_uri(uri):
-        '''parse URI
+    def _close_connection(conn):
+        try:
+            conn.close()
+        except Exception, err:
+            logging.warning('closing connection: %s', err)
+
+    def close(self):
+        ''' close idle connections, connections in use are closed on release '''
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._size -= 1
+                self._close_connection(self._idle.pop()[0])
+            self._cond.notify_all()
+
+# -----------------------------------------------------------------
+# Index class
+# -----------------------------------------------------------------
+
+
+class Index(object):
+
+    ''' Secondary index on document attribute
+
+    The index is stored in separate table `<collection>__index__<attribute>`
+    with (v, k) rows, where v is the attribute value of the document with key k.
+    Documents which are not dicts or don't have the attribute are not indexed,
+    str values longer than MAX_KEY_LENGTH are rejected. New index is filled by
+    IndexBackfill and it's used by queries when ready.
+    '''
+
+    VALUE_TYPES = {'str': unicode, 'int': int}
+
+    def __init__(self, collection, attribute, value_type='str', ready=True, checkpoint=0):
+
+        if not re.match(r'^\w+$', attribute):
+            raise RuntimeError('Incorrect index attribute: {}'.format(attribute))
+        if value_type not in self.VALUE_TYPES:
+            raise RuntimeError('Unknown index value type: {}'.format(value_type))
+        self.collection = collection
+        self.attribute = attribute
+        self.value_type = value_type
+        self.table = '%s__index__%s' % (collection, attribute)
+
+        # the index is ready for queries when all documents are indexed,
+        # checkpoint is the last document rowid (the key for WITHOUT ROWID
+        # tables) processed by IndexBackfill
+        self.ready = bool(ready)
+        self.checkpoint = checkpoint
+
+    def convert(self, value):
+        ''' return value converted to the index value type '''
+        return self._check_length(self._cast(value))
+
+    def _cast(self, value):
+        if self.value_type == 'str' and isinstance(value, str):
+            return value
+        try:
+            return self.VALUE_TYPES[self.value_type](value)
+        except (TypeError, ValueError), err:
+            raise RuntimeError('Incorrect %s value for index %s: %r' % (
+                self.value_type, self.attribute, value))
+
+    def _check_length(self, value):
+        if self.value_type == 'str' and len(value) > MAX_KEY_LENGTH:
+            raise RuntimeError('The length of value for index %s is more than %s' % (
+                self.attribute, MAX_KEY_LENGTH))
+        return value
+
+    @staticmethod
+    def in_range(value, start, end, end_inclusive=True):
+        ''' return True if start <= value <= end (or < end), None is unlimited '''
+        if value is None or (start is not None and value < start):
+            return False
+        if end is not None and (value > end or (value == end and not end_inclusive)):
+            return False
+        return True
+
+    def value(self, document):
+        ''' return index value of the document or None '''
+        if not isinstance(document, dict):
+            return None
+        value = document.get(self.attribute)
+        if value is None:
+            return None
+        try:
+            value = self._cast(value)
+        except RuntimeError:
+            return None
+        return self._check_length(value)
+
+# -----------------------------------------------------------------
+# LazyValue class
+# -----------------------------------------------------------------
+class LazyValue(object):
+
+    ''' Serialized document which is deserialized on first access to value
+
+    raw: the stored serialized document
+    '''
+
+    __slots__ = ('key', 'raw', '_serializer', '_value')
+
+    def __init__(self, key, raw, serializer):
+
+        self.key = key
+        self.raw = raw
+        self._serializer = serializer
+        self._value = _MISSING
+
+    @property
+    def value(self):
+        ''' return deserialized document, it's deserialized once '''
+        if self._value is _MISSING:
+            try:
+                self._value = self._serializer.loads(self.raw)
+            except Exception, err:
+                raise RuntimeError('key %s, %s' % (self.key, err))
+        return self._value
+
+    @property
+    def loaded(self):
+        ''' return True if the document is deserialized '''
+        return self._value is not _MISSING
+
+    def __repr__(self):
+        return '<LazyValue key=%r loaded=%s>' % (self.key, self.loaded)
+
+
+# -----------------------------------------------------------------
+# CollectionManager class
+# -----------------------------------------------------------------
+
+
+class CollectionManager(object):
+
+    ''' Collection Manager'''
+
+    def __init__(self, uri, pool=None):
+        '''
+        pool: the dict of connection pool parameters (min_size, max_size, timeout)
+        '''
+        self.backend_manager = None
+
+        if not uri or uri.find('://') <= 0:
+            raise RuntimeError('Incorrect URI definition: {}'.format(uri))
+        backend, rest_uri = uri.split('://')
+        if backend in SUPPORTED_BACKENDS:
+            if backend == 'mysql' and pool is not None:
+                self.backend_manager = PooledMysqlCollectionManager(uri, **pool)
+            elif backend == 'mysql':
+                self.backend_manager = MysqlCollectionManager(uri)
+            elif pool is not None:
+                raise RuntimeError('Connection pool is not supported by {}'.format(backend))
+            elif backend == 'sqlite':
+                self.backend_manager = SqliteCollectionManager(uri)
+        else:
+            raise RuntimeError('Unknown backend: {}'.format(backend))
+
+    def parse_uri(self, uri):
+        ''' parse_uri '''
+        return self.backend_manager.parse_uri(uri)
+
+    def create(self, name, key_type='str', key_size=None, schema_version=None):
+        ''' create collection, see backend manager create(), schema_version
+        is supported only by SQLite backend
+        '''
+        if schema_version is None:
+            self.backend_manager.create(name, key_type, key_size)
+        else:
+            self._schema_method('create')(name, key_type, key_size, schema_version)
+
+    def schema_version(self, name):
+        ''' return schema version of collection, see backend manager schema_version() '''
+        return self._schema_method('schema_version')(name)
+
+    def migrate(self, name, *args, **kwargs):
+        ''' convert collection to schema version, see backend manager migrate() '''
+        return self._schema_method('migrate')(name, *args, **kwargs)
+
+    def _schema_method(self, name):
+        ''' return method of backend manager, RuntimeError if the backend has
+        no schema versions
+        '''
+        if not hasattr(self.backend_manager, 'migrate'):
+            raise RuntimeError('Schema versions are not supported by {}'.format(
+                self.backend_manager.__class__.__name__))
+        return getattr(self.backend_manager, name)
+
+    @property
+    def collection_class(self):
+        ''' return object MysqlCollection or SqliteCollection '''
+        return self.backend_manager.collection_class
+
+    @property
+    def connection(self):
+        ''' return reference to backend connection '''
+        return self.backend_manager.connection
+
+    def collections(self):
+        ''' return list of collections '''
+        return self.backend_manager.collections()
+
+    def remove(self, name):
+        ''' remove collection '''
+        self.backend_manager.remove(name)
+
+    def invalidate(self):
+        ''' drop cached catalog metadata '''
+        self.backend_manager.invalidate()
+
+# -----------------------------------------------------------------
+# BaseCollectionManager class
+# -----------------------------------------------------------------
+
+
+class BaseCollectionManager(object):
+
+    ''' The catalog metadata (tables, columns, statistics state, schema
+    versions) is cached by the manager and dropped by its DDL statements,
+    call invalidate() after schema changes by other managers or processes
+    '''
+
+    pooled = False
+
+    def __init__(self, uri):
+        ''' init '''
+        self.uri = uri
+        self.params = self.parse_uri(uri)
+        self._metadata = dict()
+        # not committed writes of all collections on the connection
+        self._state = _ThreadCollectionState() if self.pooled else _CollectionState()
+        self.conn()
+
+    @property
+    def pending_writes(self):
+        ''' amount of not committed writes on the connection (of the current
+        thread for pooled managers)
+        '''
+        return self._state.pending_writes
+
+    def cursor(self):
+        self._reconn()
+        return self._conn.cursor()
+
+    @property
+    def connection(self):
+        ''' return connection '''
+        self._reconn()
+        return self._conn
+
+    def acquire(self):
+        ''' bind connection to the current thread, used by pooled managers '''
+        pass
+
+    def release(self, keep=False):
+        ''' unbind connection from the current thread, used by pooled managers '''
+        pass
+
+    def lost_connection(self, err):
+        ''' return True if the error means the connection to database was lost '''
+        return False
+
+    def reconnect(self):
+        ''' reopen connection to database '''
+        self.conn()
+
+    def _cached(self, key, load):
+        ''' return cached metadata by key, load() it on the first call '''
+        try:
+            return self._metadata[key]
+        except KeyError:
+            value = self._metadata[key] = load()
+            return value
+
+    def invalidate(self):
+        ''' drop cached catalog metadata '''
+        self._metadata.clear()
+
+    def _tables(self, sql):
+        ''' return all tables '''
+        return list(self._cached(('tables',), lambda: self._load_tables(sql)))
+
+    def _load_tables(self, sql):
+        self.acquire()
+        try:
+            cursor = self.cursor()
+            cursor.execute(sql)
+            return [t[0] for t in cursor.fetchall()]
+        finally:
+            self.release()
+
+    def _collections(self, sql):
+        ''' return collection list, without index and service tables '''
+        return [t for t in self._tables(sql) if not self.service_table(t)]
+
+    @staticmethod
+    def service_table(name):
+        ''' return True for the index, migration and kvlite tables '''
+        return name.startswith('kvlite__') or '__index__' in name or name.endswith('__migrate')
+
+    def _execute(self, *statements):
+        ''' execute statements (sql, params) and commit '''
+        self.acquire()
+        try:
+            cursor = self.cursor()
+            for sql, params in statements:
+                cursor.execute(sql, params)
+            self._conn.commit()
+        finally:
+            self.invalidate()
+            self.release()
+
+    def indexes(self, collection):
+        ''' return list of collection indexes '''
+        if INDEXES_TABLE not in self.tables():
+            return list()
+        SQL = 'SELECT attribute, value_type, ready, checkpoint FROM %s ' \
+              'WHERE collection = %s ORDER BY attribute;'
+        self.acquire()
+        try:
+            cursor = self.cursor()
+            cursor.execute(SQL % (INDEXES_TABLE, self.placeholder), (collection,))
+            return [Index(collection, *r) for r in cursor.fetchall()]
+        finally:
+            self.release()
+
+    def index(self, collection, attribute):
+        ''' return Index object with actual state or None '''
+        for index in self.indexes(collection):
+            if index.attribute == attribute:
+                return index
+        return None
+
+    def create_index(self, collection, attribute, value_type='str'):
+        ''' create index table and register not ready index, return Index object,
+        if the index exists it's returned with its state
+        '''
+        index = Index(collection, attribute, value_type)
+        self._create(self.SQL_CREATE_INDEXES_TABLE, INDEXES_TABLE)
+        self._create(self._index_table_sql(collection, value_type), index.table)
+        SQL_INSERT = '%s INTO %s (collection, attribute, value_type, ready, checkpoint) ' \
+                     'VALUES (%s, 0, 0)' % (
+                         self.SQL_INSERT_IGNORE, INDEXES_TABLE, ','.join([self.placeholder] * 3))
+        self._execute((SQL_INSERT, (collection, attribute, value_type)))
+        return self.index(collection, attribute)
+
+    def _index_table_sql(self, collection, value_type):
+        ''' return SQL to create index table '''
+        return self.SQL_CREATE_INDEX_TABLE[value_type]
+
+    def drop_index(self, collection, attribute):
+        ''' drop index table and unregister index '''
+        index = Index(collection, attribute)
+        SQL_DELETE = 'DELETE FROM %s WHERE collection = %s AND attribute = %s;' % (
+            INDEXES_TABLE, self.placeholder, self.placeholder)
+        self._execute(
+            (SQL_DELETE, (collection, attribute)),
+            ('DROP TABLE IF EXISTS %s;' % index.table, ()))
+
+    # SQL types of key column by key type
+    KEY_COLUMNS = {
+        'str': 'varchar(%d)' % MAX_KEY_LENGTH,
+        'binary': 'BINARY(%d)',
+        'varbinary': 'VARBINARY(%d)',
+    }
+
+    # the driver type of binary parameters
+    binary = str
+
+    def key_column(self, key_type='str', key_size=None):
+        ''' return SQL type of key column
+
+        key_type: 'str', 'binary' or 'varbinary', see KEY_TYPES
+        key_size: max size of binary key in bytes, DEFAULT_BINARY_KEY_SIZE by default
+        '''
+        if key_type not in KEY_TYPES:
+            raise RuntimeError('Unknown key type: {}'.format(key_type))
+        if key_type == 'str':
+            return self.KEY_COLUMNS[key_type]
+        key_size = key_size or DEFAULT_BINARY_KEY_SIZE
+        # hex keys of binary columns are limited by MAX_KEY_LENGTH too
+        if not 0 < key_size <= MAX_KEY_LENGTH / 2:
+            raise RuntimeError('Incorrect key size: {}'.format(key_size))
+        return self.KEY_COLUMNS[key_type] % key_size
+
+    @staticmethod
+    def parse_key_column(column_type):
+        ''' return (key type, key size) by SQL type of key column '''
+        match = re.match(r'^(var)?binary\((\d+)\)$', column_type or '', re.IGNORECASE)
+        if match is None:
+            return 'str', None
+        return 'varbinary' if match.group(1) else 'binary', int(match.group(2))
+
+    def columns(self, collection):
+        ''' return dict {column name: SQL type} of collection table '''
+        return dict(self._cached(('columns', collection), lambda: self._load_columns(collection)))
+
+    def _load_columns(self, collection):
+        self.acquire()
+        try:
+            cursor = self.cursor()
+            cursor.execute(self.SQL_COLUMNS % collection)
+            return dict((row[self.COLUMN_NAME], row[self.COLUMN_TYPE]) for row in cursor.fetchall())
+        finally:
+            self.release()
+
+    def key_type(self, collection):
+        ''' return (key type, key size) of collection, see key_column() '''
+        return self.parse_key_column(self.columns(collection).get('k'))
+
+    def ttl_enabled(self, collection):
+        ''' return True if the collection has expiry column, see enable_ttl() '''
+        return 'e' in self.columns(collection)
+
+    def enable_ttl(self, collection):
+        ''' add indexed expiry column `e` to the collection table: the time in
+        seconds since epoch when the document expires, NULL - never
+        '''
+        if self.ttl_enabled(collection):
+            raise RuntimeError('TTL of {} is already enabled'.format(collection))
+        self._execute(*[(sql % {'collection': collection}, ()) for sql in self.SQL_ENABLE_TTL])
+
+    # amount of rows per collection in statistics table, the row is chosen
+    # by STATS_SLOT expression in triggers
+    STATS_SLOTS = 1
+    STATS_SLOT = '0'
+
+    # SQL expression of value length in bytes
+    SQL_LENGTH = 'LENGTH(%s)'
+
+    @staticmethod
+    def _stats_columns():
+        return ['documents', 'bytes'] + ['keys_%d' % upper for upper in KEY_LENGTH_BUCKETS]
+
+    def _stats_expressions(self, row):
+        ''' return SQL expressions of statistics columns for one document,
+        row: NEW, OLD or collection name
+        '''
+        v_length = 'IFNULL(%s, 0)' % (self.SQL_LENGTH % ('%s.v' % row))
+        k_length = self.SQL_LENGTH % ('%s.k' % row)
+        expressions = ['1', v_length]
+        lower = 0
+        for upper in KEY_LENGTH_BUCKETS:
+            expressions.append('(%s >= %d AND %s < %d)' % (k_length, lower, k_length, upper))
+            lower = upper
+        return expressions
+
+    def stats_enabled(self, collection):
+        ''' return True if the statistics of collection is maintained '''
+        return self._cached(('stats', collection), lambda: self._load_stats_enabled(collection))
+
+    def _load_stats_enabled(self, collection):
+        if STATS_TABLE not in self.tables():
+            return False
+        SQL = 'SELECT count(*) FROM %s WHERE collection = %s;' % (STATS_TABLE, self.placeholder)
+        self.acquire()
+        try:
+            cursor = self.cursor()
+            cursor.execute(SQL, (collection,))
+            return int(cursor.fetchone()[0]) > 0
+        finally:
+            self.release()
+
+    def enable_stats(self, collection):
+        ''' create triggers which maintain statistics of the collection in
+        STATS_TABLE in the same transaction as writes, the statistics is
+        initialized by existing documents. Call it when the collection is not
+        written, otherwise the initial statistics can be inaccurate
+        '''
+        if self.stats_enabled(collection):
+            raise RuntimeError('Statistics of {} is already enabled'.format(collection))
+        self._create(self.SQL_CREATE_STATS_TABLE, STATS_TABLE)
+        columns = self._stats_columns()
+        P = self.placeholder
+        SQL_INSERT = 'INSERT INTO %s (collection, slot, %s) VALUES (%s);' % (
+            STATS_TABLE, ','.join(columns), ','.join([P] * (len(columns) + 2)))
+        statements = [(SQL_INSERT, [collection, slot] + [0] * len(columns))
+                      for slot in range(self.STATS_SLOTS)]
+        statements.extend(self._stats_triggers(collection))
+        assignments = ', '.join('%s = %s + (SELECT IFNULL(SUM(%s), 0) FROM %s)' % (
+            column, column, expression, collection)
+            for column, expression in zip(columns, self._stats_expressions(collection)))
+        statements.append(('UPDATE %s SET %s WHERE collection = %s AND slot = 0;' % (
+            STATS_TABLE, assignments, P), (collection,)))
+        self._execute(*statements)
+
+    def _stats_triggers(self, collection):
+        ''' return statements (sql, params) to create statistics triggers '''
+        columns = self._stats_columns()
+        statements = list()
+        for event, rows in (('INSERT', (('+', 'NEW'),)),
+                            ('UPDATE', (('+', 'NEW'), ('-', 'OLD'))),
+                            ('DELETE', (('-', 'OLD'),))):
+            expressions = [(sign, self._stats_expressions(row)) for sign, row in rows]
+            assignments = ', '.join('%s = %s%s' % (
+                column, column, ''.join(' %s %s' % (sign, e[i]) for sign, e in expressions))
+                for i, column in enumerate(columns))
+            statements.append((self.SQL_CREATE_STATS_TRIGGER % {
+                'trigger': '%s__stats_%s' % (collection, event.lower()), 'event': event,
+                'collection': collection, 'table': STATS_TABLE, 'assignments': assignments,
+                'slot': self.STATS_SLOT}, ()))
+        return statements
+
+    def disable_stats(self, collection):
+        ''' drop statistics triggers and statistics of the collection '''
+        statements = [('DROP TRIGGER IF EXISTS %s__stats_%s;' % (collection, event), ())
+                      for event in ('insert', 'update', 'delete')]
+        if STATS_TABLE in self.tables():
+            statements.append(('DELETE FROM %s WHERE collection = %s;' % (
+                STATS_TABLE, self.placeholder), (collection,)))
+        self._execute(*statements)
+
+    def stats(self, collection):
+        ''' return maintained statistics of the collection or None, see stats_dict() '''
+        if STATS_TABLE not in self.tables():
+            return None
+        SQL = 'SELECT count(*), %s FROM %s WHERE collection = %s;' % (
+            ', '.join('SUM(%s)' % column for column in self._stats_columns()),
+            STATS_TABLE, self.placeholder)
+        self.acquire()
+        try:
+            cursor = self.cursor()
+            cursor.execute(SQL, (collection,))
+            row = cursor.fetchone()
+        finally:
+            self.release()
+        if not row[0]:
+            return None
+        return stats_dict(row[1:])
+
+    def compute_stats(self, collection):
+        ''' return statistics of the collection by full scan, see stats_dict() '''
+        SQL = 'SELECT %s FROM %s;' % (', '.join(
+            'SUM(%s)' % expression for expression in self._stats_expressions(collection)),
+            collection)
+        self.acquire()
+        try:
+            cursor = self.cursor()
+            cursor.execute(SQL)
+            return stats_dict(cursor.fetchone())
+        finally:
+            self.release()
+
+    def estimate_count(self, collection):
+        ''' return amount of documents estimated by table statistics or None '''
+        return None
+
+    def ring_state(self, collection):
+        ''' return the state of the hash ring saved by ShardedCollection for
+        the shard collection or None
+        '''
+        if RING_TABLE not in self.tables():
+            return None
+        SQL = 'SELECT state FROM %s WHERE collection = %s;' % (RING_TABLE, self.placeholder)
+        self.acquire()
+        try:
+            cursor = self.cursor()
+            cursor.execute(SQL, (collection,))
+            row = cursor.fetchone()
+        finally:
+            self.release()
+        return None if row is None else json.loads(row[0])
+
+    def save_ring_state(self, collection, state):
+        ''' save the state of the hash ring of ShardedCollection, the
+        connection is committed
+        '''
+        self._create(self.SQL_CREATE_RING_TABLE, RING_TABLE)
+        P = self.placeholder
+        self._execute(
+            ('DELETE FROM %s WHERE collection = %s;' % (RING_TABLE, P), (collection,)),
+            ('INSERT INTO %s (collection, state) VALUES (%s, %s);' % (RING_TABLE, P, P),
+             (collection, json.dumps(state))))
+
+    def _create(self, sql_create_table, name):
+        ''' create collection by name '''
+        self.acquire()
+        try:
+            cursor = self.cursor()
+            cursor.execute(sql_create_table % name)
+            self._conn.commit()
+        finally:
+            self.invalidate()
+            self.release()
+
+    def remove(self, name):
+        ''' remove collection, its indexes and statistics '''
+        self.acquire()
+        try:
+            if name not in self.collections():
+                raise RuntimeError('No collection with name: {}'.format(name))
+            for index in self.indexes(name):
+                self.drop_index(name, index.attribute)
+            self.disable_stats(name)
+            cursor = self.cursor()
+            if RING_TABLE in self.tables():
+                cursor.execute('DELETE FROM %s WHERE collection = %s;' % (
+                    RING_TABLE, self.placeholder), (name,))
+            cursor.execute('DROP TABLE %s;' % name)
+            self._conn.commit()
+        finally:
+            self.invalidate()
+            self.release()
+
+    def stream(self, sql, params=(), batch_size=DEFAULT_BATCH_SIZE):
+        ''' return rows of the query, the query is executed once and rows are
+        fetched by fetchmany() with batch_size rows
+        '''
+        cursor = self.cursor()
+        try:
+            for row in self._fetch_stream(cursor, sql, params, batch_size):
+                yield row
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _fetch_stream(cursor, sql, params, batch_size):
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+
+    def close(self):
+        ''' close connection to database '''
+        self._conn.close()
+
+# -----------------------------------------------------------------
+# MysqlCollectionManager class
+# -----------------------------------------------------------------
+
+
+class MysqlCollectionManager(BaseCollectionManager):
+
+    # MySQL client errors: server has gone away, lost connection during query
+    LOST_CONNECTION_ERRORS = (2006, 2013)
+
+    _conn = None
+
+    def __init__(self, uri, ping_interval=DEFAULT_PING_INTERVAL,
+                 reconnect_deadline=DEFAULT_RECONNECT_DEADLINE,
+                 backoff_initial=0.05, backoff_max=1.0,
+                 failure_threshold=3, reset_timeout=30):
+        '''
+        ping_interval: the connection is checked by ping() only if it was not
+        used more than ping_interval seconds, 0 - check before every statement
+
+        reconnect_deadline: max time in seconds for reconnection attempts in one
+        call, delays between attempts grow exponentially from backoff_initial
+        to backoff_max seconds with random jitter
+
+        failure_threshold, reset_timeout: after failure_threshold failed
+        reconnections in a row the circuit breaker rejects calls during
+        reset_timeout seconds, see CircuitBreaker
+        '''
+        self.ping_interval = ping_interval
+        self.reconnect_deadline = reconnect_deadline
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._last_used = time.time()
+        super(MysqlCollectionManager, self).__init__(uri)
+
+    @property
+    def available(self):
+        ''' return False if the backend is known to be down '''
+        return self.breaker.state != CircuitBreaker.OPEN
+
+    def lost_connection(self, err):
+        if isinstance(err, RuntimeError) and err.args and isinstance(err.args[0], Exception):
+            err = err.args[0]
+        return isinstance(err, MySQLdb.OperationalError) and \
+            bool(err.args) and err.args[0] in self.LOST_CONNECTION_ERRORS
+
+    def reconnect(self):
+        self._last_used = 0
+        self._reconn()
+
+    def _reconn(self):
+        now = time.time()
+        if self._conn is not None:
+            if now - self._last_used < self.ping_interval:
+                self._last_used = now
+                return
+            try:
+                self._conn.ping()  # cping 校验连接是否异常
+                self._last_used = now
+                return
+            except Exception:
+                # the broken connection is not reused if the reconnection fails
+                self._conn = None
+        self._conn = self._connect_with_retry()
+        self._last_used = time.time()
+
+    def _connect_with_retry(self):
+        ''' return new connection, retry with backoff until reconnect_deadline
+
+        raise CircuitBreakerOpen without connection attempts if the backend is
+        known to be down, RuntimeError if the deadline was exceeded
+        '''
+        self.breaker.before_call()
+        deadline = time.time() + self.reconnect_deadline
+        delays = backoff(self.backoff_initial, self.backoff_max)
+        conn = None
+        try:
+            while True:
+                try:
+                    conn = self._connect()
+                    return conn
+                except MySQLdb.OperationalError, err:
+                    logging.error('connection to mysql %s fail: %s', self.uri, err)
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise RuntimeError('Connection to %s failed during %s sec' % (
+                        self.uri, self.reconnect_deadline))
+                time.sleep(min(next(delays), remaining))
+        finally:
+            # any error ends the half-open probe
+            if conn is None:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+
+    def _connect(self):
+        ''' return new connection to database '''
+        params = self.params
+        return MySQLdb.connect(
+            host=params['host'], port=params['port'],
+            user=params['username'], passwd=params[
+                'password'],
+            db=params['db'], **params['options'])
+
+    def conn(self):
+        try:
+            self._conn = self._connect()
+            return True
+        except MySQLdb.OperationalError, err:
+            pass
+        return False
+
+    def stream(self, sql, params=(), batch_size=DEFAULT_BATCH_SIZE):
+        ''' return rows of the query by unbuffered server-side cursor (SSCursor),
+        rows are not buffered in client memory. The query is executed by the
+        separate connection, so the collection connection stays available,
+        but not committed writes are not visible
+        '''
+        conn = self._connect_with_retry()
+        try:
+            cursor = conn.cursor(MySQLdb.cursors.SSCursor)
+            for row in self._fetch_stream(cursor, sql, params, batch_size):
+                yield row
+        finally:
+            conn.close()
+
+    @staticmethod
+    def parse_uri(uri):
+        '''parse URI
+
+        return driver, user, password, host, port, database, table and
+        driver options from query string
+        '''
+        parsed_uri = dict()
+        parsed_uri['backend'], rest_uri = uri.split('://', 1)
+        parsed_uri['username'], rest_uri = rest_uri.split(':', 1)
+        parsed_uri['password'], rest_uri = rest_uri.split('@', 1)
+
+        # driver options, like ?charset=utf8mb4&connect_timeout=5
+        rest_uri, options = parse_query(rest_uri)
+        for name, value in options.items():
+            if value.isdigit():
+                options[name] = int(value)
+            elif value.lower() in ('true', 'false'):
+                options[name] = value.lower() == 'true'
+        parsed_uri['options'] = options
+
+        if ':' in rest_uri:
+            parsed_uri['host'], rest_uri = rest_uri.split(':', 1)
+            parsed_uri['port'], rest_uri = rest_uri.split('/', 1)
+            parsed_uri['port'] = int(parsed_uri['port'])
+        else:
+            parsed_uri['host'], rest_uri = rest_uri.split('/')
+            parsed_uri['port'] = 3306
+
+        if '.' in rest_uri:
+            parsed_uri['db'], parsed_uri['collection'] = rest_uri.split('.', 1)
+        else:
+            parsed_uri['db'] = rest_uri
+            parsed_uri['collection'] = None
+        return parsed_uri
+
+    def create(self, name, key_type='str', key_size=None):
+        ''' create collection
+
+        key_type: 'str' - varchar key, 'binary' or 'varbinary' - BINARY(key_size)
+        or VARBINARY(key_size) key, such keys are passed as hex strings
+        '''
+
+        SQL_CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS %%s (
+                                __rowid__ INT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+                                k %s NOT NULL,
+                                v MEDIUMBLOB,
+                                UNIQUE KEY (k) ) ENGINE=InnoDB  DEFAULT CHARSET=utf8;;''' % (
+            self.key_column(key_type, key_size))
+
+        self._create(SQL_CREATE_TABLE, name)
+
+    # SHOW COLUMNS rows: (Field, Type, ...)
+    SQL_COLUMNS = 'SHOW COLUMNS FROM %s;'
+    COLUMN_NAME = 0
+    COLUMN_TYPE = 1
+
+    SQL_ENABLE_TTL = ('ALTER TABLE %(collection)s ADD COLUMN e DOUBLE NULL, ADD INDEX expires (e);',)
+
+    def _index_table_sql(self, collection, value_type):
+        ''' return SQL to create index table, the key column has the type of
+        the collection key column
+        '''
+        return self.SQL_CREATE_INDEX_TABLE[value_type] % (
+            '%s', self.key_column(*self.key_type(collection)))
+
+    @property
+    def collection_class(self):
+        ''' return MysqlCollection object'''
+        return MysqlCollection
+
+    placeholder = '%s'
+
+    SQL_INSERT_IGNORE = 'INSERT IGNORE'
+
+    SQL_CREATE_INDEXES_TABLE = '''CREATE TABLE IF NOT EXISTS %s (
+                                collection varchar(64) NOT NULL,
+                                attribute varchar(64) NOT NULL,
+                                value_type varchar(8) NOT NULL,
+                                ready TINYINT NOT NULL DEFAULT 0,
+                                checkpoint BIGINT NOT NULL DEFAULT 0,
+                                PRIMARY KEY (collection, attribute) ) ENGINE=InnoDB DEFAULT CHARSET=utf8;'''
+
+    # the index on (v, k) exceeds InnoDB limit of 767 bytes for utf8 columns,
+    # so it's the index on v which includes the primary key k
+    SQL_CREATE_INDEX_TABLE = dict((value_type, '''CREATE TABLE IF NOT EXISTS %%s (
+                                k %%s NOT NULL,
+                                v %s NOT NULL,
+                                PRIMARY KEY (k),
+                                KEY value (v) ) ENGINE=InnoDB DEFAULT CHARSET=utf8;''' % (
+        column_type)) for value_type, column_type in (
+        ('str', 'varchar(%s)' % MAX_KEY_LENGTH), ('int', 'BIGINT')))
+
+    SQL_CREATE_RING_TABLE = '''CREATE TABLE IF NOT EXISTS %s (
+                                collection varchar(64) NOT NULL PRIMARY KEY,
+                                state TEXT NOT NULL ) ENGINE=InnoDB DEFAULT CHARSET=utf8;'''
+
+    SQL_CREATE_STATS_TABLE = '''CREATE TABLE IF NOT EXISTS %%s (
+                                collection varchar(64) NOT NULL,
+                                slot INT NOT NULL,
+                                documents BIGINT NOT NULL DEFAULT 0,
+                                bytes BIGINT NOT NULL DEFAULT 0,
+                                %s,
+                                PRIMARY KEY (collection, slot) ) ENGINE=InnoDB DEFAULT CHARSET=utf8;''' % (
+        ', '.join('keys_%d BIGINT NOT NULL DEFAULT 0' % upper for upper in KEY_LENGTH_BUCKETS))
+
+    SQL_CREATE_STATS_TRIGGER = '''CREATE TRIGGER %(trigger)s AFTER %(event)s ON %(collection)s
+                                FOR EACH ROW UPDATE %(table)s SET %(assignments)s
+                                WHERE collection = '%(collection)s' AND slot = %(slot)s;'''
+
+    # concurrent transactions update different rows of statistics
+    STATS_SLOTS = 16
+    STATS_SLOT = 'MOD(CONNECTION_ID(), 16)'
+
+    def estimate_count(self, collection):
+        ''' return amount of documents estimated by InnoDB table statistics '''
+        SQL = 'SELECT TABLE_ROWS FROM information_schema.TABLES ' \
+              'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s;'
+        self.acquire()
+        try:
+            cursor = self.cursor()
+            cursor.execute(SQL, (collection,))
+            row = cursor.fetchone()
+        finally:
+            self.release()
+        if row is None or row[0] is None:
+            return None
+        return int(row[0])
+
+    def collections(self):
+        ''' return collection list'''
+        return self._collections('SHOW TABLES;')
+
+    def tables(self):
+        ''' return all tables '''
+        return self._tables('SHOW TABLES;')
+
+# -----------------------------------------------------------------
+# PooledMysqlCollectionManager class
+# -----------------------------------------------------------------
+
+
+class _BoundConnection(object):
+
+    ''' pooled connection bound to the thread, it's returned to the pool when
+    the thread exits: not committed writes of the thread are rolled back
+    '''
+
+    def __init__(self, pool, conn):
+        self.pool = pool
+        self.conn = conn
+
+    def detach(self):
+        ''' unbind connection without returning it to the pool '''
+        conn, self.conn = self.conn, None
+        return conn
+
+    def __del__(self):
+        conn = self.detach()
+        if conn is None:
+            return
+        try:
+            conn.rollback()
+        except Exception, err:
+            logging.warning('rollback of connection of finished thread: %s', err)
+            self.pool.discard(conn)
+        else:
+            self.pool.release(conn)
+
+
+class PooledMysqlCollectionManager(MysqlCollectionManager):
+
+    ''' MySQL collection manager with connection pool
+
+    The connection is checked out from the pool for every collection operation
+    and returned back after it, if there are not committed writes the connection
+    stays bound to the thread until commit() or the thread exit (the writes are
+    rolled back then). The idle connection is checked by ping() on checkout if
+    it was not used more than ping_interval seconds.
+
+    cursor() and connection can be used between acquire() and release() only.
+    '''
+
+    pooled = True
+
+    def __init__(self, uri, min_size=1, max_size=10, timeout=30, **options):
+        '''
+        options: see MysqlCollectionManager
+        '''
+        self._pool_params = dict(min_size=min_size, max_size=max_size, timeout=timeout)
+        self._local = threading.local()
+        super(PooledMysqlCollectionManager, self).__init__(uri, **options)
+
+    def conn(self):
+        self.pool = ConnectionPool(
+            self._connect_with_retry, check=self._check,
+            check_interval=self.ping_interval, **self._pool_params)
+        return True
+
+    def reconnect(self):
+        ''' replace connection bound to the current thread by new one '''
+        conn = self._unbind()
+        if conn is not None:
+            self.pool.discard(conn)
+        return self._conn
+
+    @staticmethod
+    def _check(conn):
+        ''' return True if connection is alive '''
+        try:
+            conn.ping()
+            return True
+        except Exception:
+            return False
+
+    def _reconn(self):
+        ''' connections are checked by the pool on checkout '''
+        pass
+
+    @property
+    def _conn(self):
+        ''' return connection bound to the current thread '''
+        bound = getattr(self._local, 'bound', None)
+        if bound is None or bound.conn is None:
+            bound = self._local.bound = _BoundConnection(self.pool, self.pool.acquire())
+        return bound.conn
+
+    def _unbind(self):
+        ''' unbind and return connection of the current thread or None '''
+        bound = getattr(self._local, 'bound', None)
+        if bound is None:
+            return None
+        self._local.bound = None
+        return bound.detach()
+
+    def _check_acquired(self):
+        if getattr(self._local, 'depth', 0) <= 0:
+            raise RuntimeError('Pooled connection is used without acquire()')
+
+    def cursor(self):
+        self._check_acquired()
+        return self._conn.cursor()
+
+    @property
+    def connection(self):
+        ''' return connection bound to the current thread by acquire() '''
+        self._check_acquired()
+        return self._conn
+
+    def acquire(self):
+        local = self._local
+        local.depth = getattr(local, 'depth', 0) + 1
+        return self._conn
+
+    def release(self, keep=False):
+        local = self._local
+        local.depth = getattr(local, 'depth', 1) - 1
+        if local.depth <= 0 and not keep:
+            conn = self._unbind()
+            if conn is not None:
+                self.pool.release(conn)
+
+    def close(self):
+        ''' close all connections in the pool '''
+        conn = self._unbind()
+        if conn is not None:
+            self.pool.release(conn)
+        self.pool.close()
+
+# -----------------------------------------------------------------
+# SqliteCollectionManager class
+# -----------------------------------------------------------------
+
+
+class SqliteCollectionManager(BaseCollectionManager):
+    def _reconn(self):
+        return True
+
+    def conn(self):
+        self._conn = self._connect()
+        return True
+
+    def _connect(self):
+        ''' return new connection to database '''
+        options = self.params['options']
+        # the connection can be used by background threads, like commit timer
+        conn = sqlite3.connect(
+            self.params['db'], check_same_thread=False,
+            timeout=int(options.get('busy_timeout', 5000)) / 1000.0)
+        conn.text_factory = str
+        # INSERT OR REPLACE fires delete triggers of statistics
+        conn.execute('PRAGMA recursive_triggers=ON;')
+        for name, value in sorted(options.items()):
+            if name in SQLITE_PRAGMAS:
+                conn.execute('PRAGMA %s=%s;' % (SQLITE_PRAGMAS[name][0], value))
+        return conn
+
+    def stream(self, sql, params=(), batch_size=DEFAULT_BATCH_SIZE):
+        ''' return rows of the query fetched by fetchmany() with batch_size rows.
+        The query is executed by the separate connection, so the statements of
+        the collection connection don't change the running query, but not
+        committed writes are not visible. Without WAL journal (journal=wal)
+        the commits of other connections wait for the end of the stream.
+        In-memory databases are read by the collection connection
+        '''
+        if self.params['db'] == ':memory:':
+            for row in super(SqliteCollectionManager, self).stream(sql, params, batch_size):
+                yield row
+            return
+        conn = self._connect()
+        try:
+            for row in self._fetch_stream(conn.cursor(), sql, params, batch_size):
+                yield row
+        finally:
+            conn.close()
+
+    @staticmethod
+    def parse_options(options):
+        ''' return validated SQLite options, the profile options are used as defaults '''
+        profile = options.pop('profile', 'default')
+        if profile not in SQLITE_PROFILES:
+            raise RuntimeError('Unknown SQLite profile: {}'.format(profile))
+        result = dict(SQLITE_PROFILES[profile])
+        result.update(options)
+        for name, value in result.items():
+            if name == 'busy_timeout':
+                allowed = int
+            elif name in SQLITE_PRAGMAS:
+                allowed = SQLITE_PRAGMAS[name][1]
+            else:
+                raise RuntimeError('Unknown SQLite option: {}'.format(name))
+            if allowed is int:
+                try:
+                    int(value)
+                except ValueError:
+                    raise RuntimeError('Incorrect value of {}: {}'.format(name, value))
+            elif value.lower() not in allowed:
+                raise RuntimeError('Incorrect value of {}: {}'.format(name, value))
+            else:
+                result[name] = value.lower()
+        return result
+
+    @staticmethod
+    def parse_uri(uri):
+        '''parse URI
+
+        return driver, database, collection and options from query string,
+        like ?profile=throughput&journal=wal&synchronous=normal
+        '''
+        parsed_uri = dict()
+        parsed_uri['backend'], rest_uri = uri.split('://', 1)
+        rest_uri, options = parse_query(rest_uri)
+        parsed_uri['options'] = SqliteCollectionManager.parse_options(options)
+        if ':' in rest_uri:
+            parsed_uri['db'], parsed_uri['collection'] = rest_uri.split(':', 1)
+        else:
+            parsed_uri['db'] = rest_uri
+            parsed_uri['collection'] = None
+        if parsed_uri['db'] == 'memory':
+            parsed_uri['db'] = ':memory:'
+        return parsed_uri
+
+    @property
+    def collection_class(self):
+        ''' return SqliteCollection object'''
+        return SqliteCollection
+
+    placeholder = '?'
+
+    SQL_INSERT_IGNORE = 'INSERT OR IGNORE'
+
+    SQL_CREATE_INDEXES_TABLE = '''CREATE TABLE IF NOT EXISTS %s (
+                                collection NOT NULL, attribute NOT NULL, value_type NOT NULL,
+                                ready NOT NULL DEFAULT 0, checkpoint NOT NULL DEFAULT 0,
+                                PRIMARY KEY (collection, attribute) );'''
+
+    SQL_CREATE_INDEX_TABLE = {
+        'str': '''CREATE TABLE IF NOT EXISTS %s (
+                                v NOT NULL, k NOT NULL, PRIMARY KEY (v, k), UNIQUE (k) );''',
+        'int': '''CREATE TABLE IF NOT EXISTS %s (
+                                v INTEGER NOT NULL, k NOT NULL, PRIMARY KEY (v, k), UNIQUE (k) );''',
+    }
+
+    SQL_CREATE_RING_TABLE = '''CREATE TABLE IF NOT EXISTS %s (
+                                collection NOT NULL PRIMARY KEY, state NOT NULL );'''
+
+    SQL_CREATE_STATS_TABLE = '''CREATE TABLE IF NOT EXISTS %%s (
+                                collection NOT NULL, slot INTEGER NOT NULL,
+                                documents INTEGER NOT NULL DEFAULT 0, bytes INTEGER NOT NULL DEFAULT 0,
+                                %s,
+                                PRIMARY KEY (collection, slot) );''' % (
+        ', '.join('keys_%d INTEGER NOT NULL DEFAULT 0' % upper for upper in KEY_LENGTH_BUCKETS))
+
+    SQL_CREATE_STATS_TRIGGER = '''CREATE TRIGGER IF NOT EXISTS %(trigger)s AFTER %(event)s ON %(collection)s
+                                BEGIN UPDATE %(table)s SET %(assignments)s
+                                WHERE collection = '%(collection)s' AND slot = %(slot)s; END;'''
+
+    # values are stored as text, length() of text counts characters
+    SQL_LENGTH = 'LENGTH(CAST(%s AS BLOB))'
+
+    def collections(self):
+        ''' return collection list'''
+
+        return self._collections('SELECT name FROM sqlite_master WHERE type="table";')
+
+    def tables(self):
+        ''' return all tables '''
+        return self._tables('SELECT name FROM sqlite_master WHERE type="table";')
+
+    # str keys are stored in the column without type
+    KEY_COLUMNS = dict(BaseCollectionManager.KEY_COLUMNS, str='')
+
+    binary = sqlite3.Binary
+
+    # PRAGMA table_info rows: (cid, name, type, ...)
+    SQL_COLUMNS = 'PRAGMA table_info(%s);'
+    COLUMN_NAME = 1
+    COLUMN_TYPE = 2
+
+    SQL_ENABLE_TTL = ('ALTER TABLE %(collection)s ADD COLUMN e REAL;',
+                      'CREATE INDEX %(collection)s__expires ON %(collection)s (e);')
+
+    SQL_CREATE_TABLE = {
+        1: '''CREATE TABLE IF NOT EXISTS %%s (
+                                k %s NOT NULL, v, UNIQUE (k) );''',
+        2: '''CREATE TABLE IF NOT EXISTS %%s (
+                                k %s NOT NULL PRIMARY KEY, v ) WITHOUT ROWID;''',
+    }
+
+    SQL_CREATE_SCHEMA_TABLE = '''CREATE TABLE IF NOT EXISTS %s (
+                                collection NOT NULL PRIMARY KEY, version INTEGER NOT NULL );'''
+
+    def create(self, name, key_type='str', key_size=None, schema_version=SQLITE_SCHEMA_VERSION):
+        ''' create collection
+
+        key_type: 'str', 'binary' or 'varbinary' - hex string keys are stored as
+        blobs in the column of BINARY(key_size) or VARBINARY(key_size) type
+        schema_version: 1 - the documents are stored in rowid table with unique
+        index on key, 2 - in WITHOUT ROWID table clustered by key
+        '''
+        if schema_version not in self.SQL_CREATE_TABLE:
+            raise RuntimeError('Unknown schema version: {}'.format(schema_version))
+        if name in self.tables():
+            return
+        self._create(self.SQL_CREATE_TABLE[schema_version] % self.key_column(key_type, key_size), name)
+        self._create(self.SQL_CREATE_SCHEMA_TABLE, SCHEMA_TABLE)
+        self._execute(('INSERT OR REPLACE INTO %s (collection, version) VALUES (?, ?);' % SCHEMA_TABLE,
+                       (name, schema_version)))
+
+    def schema_version(self, name):
+        ''' return schema version of collection, collections created before
+        schema versions have version 1
+        '''
+        return self._cached(('schema', name), lambda: self._load_schema_version(name))
+
+    def _load_schema_version(self, name):
+        if SCHEMA_TABLE not in self.tables():
+            return 1
+        cursor = self.cursor()
+        cursor.execute('SELECT version FROM %s WHERE collection = ?;' % SCHEMA_TABLE, (name,))
+        row = cursor.fetchone()
+        return 1 if row is None else row[0]
+
+    def migrate(self, name, schema_version=SQLITE_LATEST_SCHEMA_VERSION):
+        ''' convert collection table to schema version in place and record the
+        version, return previous version. The documents are copied to the new
+        table which replaces the old one in one transaction. Statistics triggers
+        are recreated, the backfill of not ready indexes is restarted because
+        its checkpoints are positions in the old table. Collection objects
+        opened before migration must be reopened
+        '''
+        if schema_version not in self.SQL_CREATE_TABLE:
+            raise RuntimeError('Unknown schema version: {}'.format(schema_version))
+        if name not in self.collections():
+            raise RuntimeError('No collection with name: {}'.format(name))
+        previous = self.schema_version(name)
+        if previous == schema_version:
+            return previous
+        table = '%s__migrate' % name
+        ttl = self.ttl_enabled(name)
+        columns = 'k, v, e' if ttl else 'k, v'
+        statements = [
+            ('DROP TABLE IF EXISTS %s;' % table, ()),
+            (self.SQL_CREATE_TABLE[schema_version] % self.key_column(*self.key_type(name)) % table, ()),
+        ]
+        if ttl:
+            statements.append((self.SQL_ENABLE_TTL[0] % {'collection': table}, ()))
+        statements.extend([
+            ('INSERT INTO %s (%s) SELECT %s FROM %s ORDER BY k;' % (table, columns, columns, name), ()),
+            # triggers and indexes of the collection are dropped with the table
+            ('DROP TABLE %s;' % name, ()),
+            ('ALTER TABLE %s RENAME TO %s;' % (table, name), ()),
+            (self.SQL_CREATE_SCHEMA_TABLE % SCHEMA_TABLE, ()),
+            ('INSERT OR REPLACE INTO %s (collection, version) VALUES (?, ?);' % SCHEMA_TABLE,
+             (name, schema_version)),
+        ])
+        if ttl:
+            statements.extend((sql % {'collection': name}, ()) for sql in self.SQL_ENABLE_TTL[1:])
+        if self.stats_enabled(name):
+            statements.extend(self._stats_triggers(name))
+        if INDEXES_TABLE in self.tables():
+            statements.append(('UPDATE %s SET checkpoint = 0 WHERE collection = ? AND ready = 0;' % (
+                INDEXES_TABLE), (name,)))
+        self._execute_transaction(*statements)
+        return previous
+
+    def _execute_transaction(self, *statements):
+        ''' execute statements (sql, params) in one explicit transaction, sqlite3
+        module commits the transaction before DDL statements otherwise
+        '''
+        self._conn.commit()
+        isolation_level = self._conn.isolation_level
+        self._conn.isolation_level = None
+        try:
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE;')
+            try:
+                for sql, params in statements:
+                    cursor.execute(sql, params)
+            except Exception:
+                cursor.execute('ROLLBACK;')
+                raise
+            cursor.execute('COMMIT;')
+        finally:
+            self.invalidate()
+            self._conn.isolation_level = isolation_level
+
+    def remove(self, name):
+        ''' remove collection, its indexes, statistics and schema version '''
+        super(SqliteCollectionManager, self).remove(name)
+        if SCHEMA_TABLE in self.tables():
+            self._execute(('DELETE FROM %s WHERE collection = ?;' % SCHEMA_TABLE, (name,)))
+
+
+# -----------------------------------------------------------------
+# BaseCollection class
+# -----------------------------------------------------------------
+class _CollectionState(object):
+
+    ''' collection transaction state shared by threads '''
+
+    pending_writes = 0
+
+
+class _ThreadCollectionState(threading.local):
+
+    ''' collection transaction state per thread, for pooled connections '''
+
+    pending_writes = 0
+
+
+class BaseCollection(object):
+
+    def __init__(self, manager, collection_name, serializer=cPickleSerializer,
+                 chunk_size=DEFAULT_CHUNK_SIZE, commit_every=None, commit_interval=None):
+        '''
+        commit policy, by default changes are committed by explicit commit() only:
+
+        commit_every: commit after every N writes
+        commit_interval: commit pending writes every T seconds from background thread
+        '''
+        self._manager = manager
+        self._collection = collection_name
+        self._serializer = serializer
+        self._chunk_size = chunk_size
+
+        self._uuid_cache = list()
+
+        self._commit_every = commit_every
+        self._commit_interval = commit_interval
+        self._lock = None
+        self._commit_timer = None
+        if manager.pooled:
+            if commit_interval:
+                raise RuntimeError('commit_interval is not supported with connection pool')
+            self._state = _ThreadCollectionState()
+        else:
+            self._state = _CollectionState()
+        self._indexes = dict((index.attribute, index)
+                             for index in manager.indexes(collection_name))
+        self._stats = manager.stats_enabled(collection_name)
+        columns = manager.columns(collection_name)
+        self._key_type, self._key_size = manager.parse_key_column(columns.get('k'))
+        self._ttl = 'e' in columns
+        self._bloom = None
+        # the filter answers negatives only after keys() are added to it
+        self._bloom_ready = None
+        if commit_interval:
+            self._lock = threading.RLock()
+            self._commit_timer = PeriodicThread(
+                commit_interval, self._commit_pending, name='kvlite-commit-%s' % collection_name)
+            self._commit_timer.start()
+
+    def cursor(self):
+        return self._manager.cursor()
+
+    @staticmethod
+    def get_id():
+        ''' return new time-ordered ID generated locally, see IdGenerator '''
+        return get_id()
+
+    @property
+    def _conn(self):
+        return self._manager.connection
+
+    @property
+    def _placeholder(self):
+        return self._manager.placeholder
+
+    @property
+    @synchronized
+    def count(self):
+        ''' return amount of documents in collection, the maintained counter is
+        used if the statistics is enabled, see enable_stats()
+        '''
+        if self._stats:
+            stats = self._manager.stats(self._collection)
+            if stats is not None:
+                return stats['documents']
+        return self._exact_count()
+
+    def _exact_count(self):
+        cursor = self.cursor()
+        cursor.execute('SELECT count(*) FROM %s;' % self._collection)
+        return int(cursor.fetchone()[0])
+
+    @synchronized
+    def estimated_count(self, exact=False):
+        ''' return amount of documents without full index scan: the maintained
+        counter, the estimate by table statistics (MySQL) or count(*) if there
+        is no estimate
+
+        exact: count documents by SELECT count(*)
+        '''
+        if not exact:
+            if self._stats:
+                return self.count
+            estimate = self._manager.estimate_count(self._collection)
+            if estimate is not None:
+                return estimate
+        return self._exact_count()
+
+    @synchronized
+    def stats(self, exact=False):
+        ''' return statistics of collection: documents, bytes, avg_bytes and
+        key_lengths {upper bound: amount of keys} for KEY_LENGTH_BUCKETS. The
+        maintained statistics is used if it's enabled, otherwise it's computed
+        by full scan
+
+        exact: compute statistics by full scan
+        '''
+        if self._stats and not exact:
+            stats = self._manager.stats(self._collection)
+            if stats is not None:
+                return stats
+        return self._manager.compute_stats(self._collection)
+
+    def enable_stats(self):
+        ''' maintain statistics and counter of documents by triggers on every
+        write, see manager.enable_stats()
+        '''
+        self._manager.enable_stats(self._collection)
+        self._stats = True
+
+    def disable_stats(self):
+        self._manager.disable_stats(self._collection)
+        self._stats = False
+
+    def enable_ttl(self):
+        ''' add expiry column to the collection, so documents can be put with
+        ttl, see manager.enable_ttl()
+        '''
+        self._manager.enable_ttl(self._collection)
+        self._ttl = True
+
+    def _expires(self, ttl):
+        ''' return expiry time of document put with ttl seconds, None - never '''
+        if ttl is None:
+            return None
+        if not self._ttl:
+            raise RuntimeError('TTL is not enabled for collection {}'.format(self._collection))
+        return time.time() + ttl
+
+    def _alive(self, column='e'):
+        ''' return condition and params which skip expired documents, the
+        condition is None if TTL is not enabled
+        '''
+        if not self._ttl:
+            return None, ()
+        return '(%s IS NULL OR %s > %s)' % (column, column, self._placeholder), (time.time(),)
+
+    def _alive_suffix(self):
+        ''' return " AND condition" and params of _alive(), '' if TTL is not enabled '''
+        condition, params = self._alive()
+        if condition is None:
+            return '', ()
+        return ' AND ' + condition, params
+
+    @synchronized
+    def exists(self, k):
+        ''' return True if the document exists, the query stops on the first match.
+        If the Bloom filter is enabled, absent keys are usually answered
+        without the query
+        '''
+        bloom = self._bloom_ready
+        if bloom is not None and k not in bloom:
+            return False
+        cursor = self.cursor()
+        alive, params = self._alive_suffix()
+        SQL = 'SELECT 1 FROM %s WHERE k = %s%s LIMIT 1;' % (self._collection, self._placeholder, alive)
+        try:
+            cursor.execute(SQL, (self._encode_key(k),) + params)
+        except Exception, err:
+            raise RuntimeError(err)
+        return cursor.fetchone() is not None
+
+    __contains__ = exists
+
+    @synchronized
+    def exists_many(self, keys, chunk_size=None):
+        ''' return set of existing keys '''
+        bloom = self._bloom_ready
+        if bloom is not None:
+            keys = [k for k in keys if k in bloom]
+        result = set()
+        cursor = self.cursor()
+        for chunk in self._key_chunks(keys, chunk_size):
+            alive, params = self._alive_suffix()
+            SQL = 'SELECT k FROM %s WHERE k IN (%s)%s;' % (
+                self._collection, ','.join([self._placeholder] * len(chunk)), alive)
+            try:
+                cursor.execute(SQL, list(self._encode_keys(chunk)) + list(params))
+            except Exception, err:
+                raise RuntimeError(err)
+            result.update(self._decode_key(r[0]) for r in cursor.fetchall())
+        return result
+
+    def enable_bloom_filter(self, capacity=None, error_rate=0.01):
+        ''' build in-process Bloom filter from keys(), the filter is updated by
+        put() of this collection object, so exists() and exists_many() answer
+        definite negatives without queries. The filter knows nothing about the
+        writes of other collection objects and processes, use it only if all
+        writes go through this object. Deleted keys stay in the filter.
+
+        capacity: expected amount of keys, by default twice the amount of documents
+        '''
+        if capacity is None:
+            capacity = max(2 * self.count, 1024)
+        bloom = BloomFilter(capacity, error_rate)
+        # the filter is installed before the scan, so the keys put during
+        # the scan are added by put() even if keys() doesn't return them
+        self._bloom_ready = None
+        self._bloom = bloom
+        bloom.update(self.keys())
+        if self._bloom is bloom:
+            self._bloom_ready = bloom
+
+    def disable_bloom_filter(self):
+        self._bloom_ready = None
+        self._bloom = None
+
+    @staticmethod
+    def _check_key(k):
+        ''' raise RuntimeError if the key is too long '''
+        if len(k) > MAX_KEY_LENGTH:
+            raise RuntimeError(
+                'The key length is more than %s bytes' % MAX_KEY_LENGTH)
+
+    def _encode_key(self, k):
+        ''' return the key as it's stored: the bytes of hex key for binary key
+        types, see manager.create(). Only lower case hex keys are accepted, the
+        keys are returned, cached and sharded in lower case
+        '''
+        if self._key_type == 'str':
+            return k
+        try:
+            raw = binascii.unhexlify(k)
+        except (TypeError, binascii.Error), err:
+            raise RuntimeError('key %s, %s' % (k, err))
+        if binascii.hexlify(raw) != k:
+            raise RuntimeError('key %s, the key must be lower case hex' % k)
+        if len(raw) > self._key_size or (self._key_type == 'binary' and len(raw) != self._key_size):
+            raise RuntimeError('key %s, the key size must be %s%s bytes' % (
+                k, 'up to ' if self._key_type == 'varbinary' else '', self._key_size))
+        return self._manager.binary(raw)
+
+    def _encode_keys(self, keys):
+        if self._key_type == 'str':
+            return keys
+        return [self._encode_key(k) for k in keys]
+
+    def _encode_bound(self, k):
+        ''' return stored key for the range bound, odd hex bound is padded by 0 '''
+        if self._key_type == 'str':
+            return k
+        if len(k) % 2:
+            k += '0'
+        try:
+            return self._manager.binary(binascii.unhexlify(k))
+        except (TypeError, binascii.Error), err:
+            raise RuntimeError('key %s, %s' % (k, err))
+
+    def _decode_key(self, k):
+        ''' return the key by stored one, see _encode_key() '''
+        if self._key_type == 'str':
+            return k
+        return binascii.hexlify(k)
+
+    def _decode_rows(self, rows, i=0):
+        ''' return rows with decoded keys in i-th column '''
+        if self._key_type == 'str':
+            return rows
+        return [r[:i] + (binascii.hexlify(r[i]),) + r[i + 1:] for r in rows]
+
+    def _key_chunks(self, keys, chunk_size=None):
+        ''' return chunks of keys '''
+        keys = list(keys)
+        for k in keys:
+            self._check_key(k)
+        return chunks(keys, chunk_size or self._chunk_size)
+
+    def get(self, k, default=None):
+        '''
+        return document by key from collection
+        '''
+        self._check_key(k)
+        v = self._get_raw(k)
+        if v is None:
+            return default
+        try:
+            return self._serializer.loads(v)
+        except Exception, err:
+            raise RuntimeError('key %s, %s' % (k, err))
+
+    __getitem__ = get
+
+    def get_many(self, keys, chunk_size=None):
+        ''' return dict {k: v} for existing documents by keys '''
+        return self._loads_many(self._get_many_raw(keys, chunk_size))
+
+    @synchronized
+    def put_many(self, kvs, chunk_size=None, ttl=None):
+        ''' put documents in collection by chunks, one statement per chunk,
+        kvs is the dict or the iterable of (k, v) pairs, the iterable is
+        consumed chunk by chunk so the keys are checked per chunk too: the
+        chunks before the invalid key are written
+
+        ttl: the documents expire after ttl seconds, see enable_ttl()
+        '''
+        if hasattr(kvs, 'iteritems'):
+            kvs = kvs.iteritems()
+        expires = self._expires(ttl)
+        for chunk in chunks(kvs, chunk_size or self._chunk_size):
+            for k, _ in chunk:
+                self._check_key(k)
+            self._put_chunk([(k, v, self._serializer.dumps(v)) for k, v in chunk], expires)
+
+    @synchronized
+    def _put_serialized(self, rows, expires, chunk_size=None):
+        ''' put (k, v, serialized v) rows by chunks, the documents serialized
+        by the caller are not serialized again, see WriteBehindCollection
+        '''
+        for chunk in chunks(rows, chunk_size or self._chunk_size):
+            for k, _, _ in chunk:
+                self._check_key(k)
+            self._put_chunk(chunk, expires)
+
+    def _put_chunk(self, rows, expires):
+        ''' put (k, v, serialized v) rows by one statement, v is used by indexes '''
+        kvs = [(k, v) for k, v, _ in rows]
+        if self._indexes:
+            self._check_index_values(kvs)
+        self._put_rows([(k, blob) for k, _, blob in rows], expires)
+        if self._bloom is not None:
+            self._bloom.update(k for k, _ in kvs)
+        if self._indexes:
+            self._index_put(kvs)
+        self._written(len(rows))
+
+    @synchronized
+    def delete_many(self, keys, chunk_size=None):
+        ''' delete documents by keys '''
+        for chunk in self._key_chunks(keys, chunk_size):
+            self._delete_keys(chunk)
+            if self._indexes:
+                self._index_delete(chunk)
+            self._written(len(chunk))
+
+    def items(self, batch_size=DEFAULT_BATCH_SIZE, stream=False, lazy=False):
+        ''' return all docs in rowid order (in key order for SQLite collections
+        of schema version 2), the documents are read by pages with batch_size
+        documents
+
+        stream: read documents by one query with fetchmany(batch_size),
+        see manager.stream()
+        lazy: return (k, LazyValue) pairs, documents are deserialized on access
+        '''
+        for r in self._rows(batch_size, stream):
+            if lazy:
+                yield (r[1], LazyValue(r[1], r[2], self._serializer))
+                continue
+            try:
+                v = self._serializer.loads(r[2])
+            except Exception, err:
+                raise RuntimeError('key %s, %s' % (r[1], err))
+            yield (r[1], v)
+
+    __iter__ = items
+
+    def parallel_items(self, workers=None, prefetch=2, ordered=True,
+                       batch_size=DEFAULT_BATCH_SIZE, stream=False, pool=None):
+        ''' return all docs, pages of serialized documents are deserialized by
+        the pool of worker processes, see items()
+
+        workers: amount of worker processes, by default - amount of CPUs
+        prefetch: amount of pages per worker which are read ahead
+        ordered: return documents in rowid order, otherwise the pages are
+        returned as soon as they are deserialized
+        pool: multiprocessing.Pool with `workers` processes created by the
+        caller, it's not closed. By default the pool is created by the call,
+        the processes are forked with opened connections and running threads,
+        so create the pool before opening collections if it's possible
+
+        The serializer is passed to workers, so it must be picklable: the class
+        or the module defined on module level
+        '''
+        try:
+            pickle.dumps(self._serializer, pickle.HIGHEST_PROTOCOL)
+        except Exception, err:
+            raise RuntimeError('The serializer is not picklable: %s' % err)
+        workers = workers or multiprocessing.cpu_count()
+        own_pool = pool is None
+        if own_pool:
+            pool = multiprocessing.Pool(workers)
+        pages = chunks(((r[1], str(r[2])) for r in self._rows(batch_size, stream)), batch_size)
+        done = None if ordered else Queue.Queue()
+        try:
+            pending = deque() if ordered else dict()
+            for task, page in enumerate(pages):
+                if ordered:
+                    pending.append(pool.apply_async(_loads_page, (self._serializer, page)))
+                else:
+                    pending[task] = pool.apply_async(
+                        _loads_page, (self._serializer, page),
+                        callback=lambda result, task=task: done.put((task, result)))
+                if len(pending) >= workers * prefetch:
+                    for item in _next_page(pending, done):
+                        yield item
+            while pending:
+                for item in _next_page(pending, done):
+                    yield item
+            if own_pool:
+                pool.close()
+        finally:
+            if own_pool:
+                pool.terminate()
+                pool.join()
+
+    def keys(self, batch_size=DEFAULT_BATCH_SIZE, stream=False):
+        ''' return document keys in rowid order, see items() '''
+        for r in self._rows(batch_size, stream, keys_only=True):
+            yield r[1]
+
+    def _rows(self, batch_size, stream, keys_only=False):
+        ''' return (rowid, k, serialized v) or (rowid, k) rows ordered by rowid '''
+        if stream:
+            alive, params = self._alive()
+            SQL = 'SELECT %s, %s FROM %s %sORDER BY %s;' % (
+                self._rowid, 'k' if keys_only else 'k, v', self._collection,
+                'WHERE %s ' % alive if alive else '', self._rowid)
+            rows = self._manager.stream(SQL, params, batch_size=batch_size)
+            if self._key_type != 'str':
+                rows = (self._decode_rows([r], 1)[0] for r in rows)
+            return rows
+        return self._pages(batch_size, keys_only)
+
+    def _pages(self, batch_size, keys_only):
+        ''' return rows read by pages with keyset pagination on rowid '''
+        rowid = 0
+        while True:
+            result = self._rows_after(rowid, batch_size, keys_only)
+            for r in result:
+                yield r
+            if len(result) < batch_size:
+                break
+            rowid = result[-1][0]
+
+    @synchronized
+    def _replace_raw(self, rows):
+        ''' replace serialized documents by (k, old v, new v) rows if the stored
+        ones are not changed, return amount of replaced documents
+        '''
+        SQL_UPDATE = 'UPDATE %s SET v = %s WHERE k = %s AND v = %s;' % (
+            (self._collection,) + (self._placeholder,) * 3)
+        cursor = self.cursor()
+        replaced = 0
+        for k, old, new in rows:
+            cursor.execute(SQL_UPDATE, (new, self._encode_key(k), old))
+            replaced += cursor.rowcount
+        self._written(len(rows))
+        return replaced
+
+    @synchronized
+    def _delete_raw(self, rows):
+        ''' delete documents by (k, serialized v) or (k, serialized v, expiry)
+        rows if the stored ones are not changed, return set of deleted keys
+        '''
+        SQL_DELETE = 'DELETE FROM %s WHERE k = %s AND v = %s;' % (
+            (self._collection,) + (self._placeholder,) * 2)
+        cursor = self.cursor()
+        deleted = set()
+        for row in rows:
+            k, v = row[:2]
+            cursor.execute(SQL_DELETE, (self._encode_key(k), v))
+            if cursor.rowcount > 0:
+                deleted.add(k)
+        if self._indexes and deleted:
+            self._index_delete(list(deleted))
+        self._written(len(rows))
+        return deleted
+
+    @synchronized
+    def _put_rows_if_absent(self, rows):
+        ''' put (k, serialized v, expiry) rows, existing documents are not
+        changed, the expiry is kept if TTL is enabled, see _get_many_raw()
+        '''
+        P = self._placeholder
+        if self._ttl:
+            SQL_INSERT = '%s INTO %s (k,v,e) VALUES (%s,%s,%s);' % (
+                self._manager.SQL_INSERT_IGNORE, self._collection, P, P, P)
+            params = [(self._encode_key(k), v, e) for k, v, e in rows]
+        else:
+            SQL_INSERT = '%s INTO %s (k,v) VALUES (%s,%s);' % (
+                self._manager.SQL_INSERT_IGNORE, self._collection, P, P)
+            params = [(self._encode_key(k), v) for k, v, _ in rows]
+        self.cursor().executemany(SQL_INSERT, params)
+        keys = [row[0] for row in rows]
+        if self._bloom is not None:
+            self._bloom.update(keys)
+        if self._indexes:
+            self._index_put(self.get_many(keys).items())
+        self._written(len(rows))
+
+    def scan(self, start=None, end=None, prefix=None, reverse=False, limit=None,
+             keys_only=False, batch_size=DEFAULT_BATCH_SIZE):
+        '''
+        return documents (k, v) or keys ordered by key, start <= k < end,
+        the documents are read by pages with batch_size documents using
+        keyset pagination on the unique index by k
+
+        prefix: return only keys which start with prefix
+        reverse: return documents in descending order
+        limit: max amount of returned documents
+        keys_only: return keys only
+        '''
+        conditions = list()
+        params = list()
+        if start is not None:
+            conditions.append('k >= %s' % self._placeholder)
+            params.append(self._encode_bound(start))
+        if end is not None:
+            conditions.append('k < %s' % self._placeholder)
+            params.append(self._encode_bound(end))
+        if prefix is not None:
+            if self._key_type == 'str':
+                condition, prefix_params = self._prefix_condition(prefix)
+            else:
+                condition, prefix_params = self._binary_prefix_condition(prefix)
+            conditions.append(condition)
+            params.extend(prefix_params)
+        alive, alive_params = self._alive()
+        if alive is not None:
+            conditions.append(alive)
+            params.extend(alive_params)
+
+        SQL_SELECT = 'SELECT %s FROM %s ' % ('k' if keys_only else 'k,v', self._collection)
+        ORDER = 'ORDER BY k %s LIMIT %%d;' % ('DESC' if reverse else 'ASC')
+        NEXT_PAGE = 'k %s %s' % ('<' if reverse else '>', self._placeholder)
+
+        last_key = None
+        count = 0
+        while limit is None or count < limit:
+            page_size = batch_size if limit is None else min(batch_size, limit - count)
+            page_conditions = list(conditions)
+            page_params = list(params)
+            if count:
+                page_conditions.append(NEXT_PAGE)
+                page_params.append(last_key)
+            SQL = SQL_SELECT
+            if page_conditions:
+                SQL += 'WHERE %s ' % ' AND '.join(page_conditions)
+            SQL += ORDER % page_size
+            result = self._fetchall(SQL, page_params)
+            for r in result:
+                k = self._decode_key(r[0])
+                if keys_only:
+                    yield k
+                    continue
+                try:
+                    v = self._serializer.loads(r[1])
+                except Exception, err:
+                    raise RuntimeError('key %s, %s' % (k, err))
+                yield (k, v)
+            count += len(result)
+            if len(result) < page_size:
+                break
+            last_key = result[-1][0]
+
+    def _binary_prefix_condition(self, prefix):
+        ''' return condition and params for binary keys with hex prefix '''
+        start = self._encode_bound(prefix)
+        end = prefix_end(str(self._encode_bound(prefix + 'f' if len(prefix) % 2 else prefix)))
+        P = self._placeholder
+        if end is None:
+            return 'k >= %s' % P, [start]
+        return 'k >= %s AND k < %s' % (P, P), [start, self._manager.binary(end)]
+
+    def indexes(self):
+        ''' return list of indexed attributes '''
+        return sorted(self._indexes)
+
+    def create_index(self, attribute, value_type='str', background=False, **options):
+        ''' create index on document attribute and index existing documents,
+        value_type: 'str' or 'int'. Other collection objects use the index
+        after they are reopened, the list of indexes is loaded on creation
+
+        background: don't index existing documents, return IndexBackfill which
+        should be started for it. Until the index is ready find() and
+        find_range() scan the collection. options are passed to IndexBackfill
+        '''
+        index = self._manager.create_index(self._collection, attribute, value_type)
+        self._indexes[attribute] = index
+        backfill = IndexBackfill(self, attribute, **options)
+        if background:
+            return backfill
+        backfill.run()
+
+    def reencode(self, background=False, **options):
+        ''' re-encode documents stored in old formats by FormatSerializer of the
+        collection, see ReencodeJob
+
+        background: return ReencodeJob which should be started, options are
+        passed to ReencodeJob
+        '''
+        job = ReencodeJob(self, **options)
+        if background:
+            return job
+        job.run()
+        return job.reencoded
+
+    def sweep(self, background=False, **options):
+        ''' delete expired documents by batches, return amount of deleted
+        documents, see ExpirySweeper
+
+        background: return ExpirySweeper which should be started, options are
+        passed to ExpirySweeper
+        '''
+        job = ExpirySweeper(self, **options)
+        if background:
+            return job
+        job.run()
+        return job.deleted
+
+    @synchronized
+    def _delete_expired(self, batch_size):
+        ''' delete up to batch_size expired documents found by the index on
+        expiry time, return amount of deleted documents
+        '''
+        if not self._ttl:
+            raise RuntimeError('TTL is not enabled for collection {}'.format(self._collection))
+        P = self._placeholder
+        now = time.time()
+        SQL = 'SELECT k FROM %s WHERE e <= %s ORDER BY e LIMIT %d;' % (self._collection, P, batch_size)
+        keys = [r[0] for r in self._fetchall(SQL, (now,))]
+        if not keys:
+            return 0
+        # the document is not deleted if it was put again after the select
+        SQL_DELETE = 'DELETE FROM %s WHERE k IN (%s) AND e <= %s;' % (
+            self._collection, ','.join([P] * len(keys)), P)
+        cursor = self.cursor()
+        cursor.execute(SQL_DELETE, keys + [now])
+        deleted = cursor.rowcount
+        if self._indexes:
+            keys = [self._decode_key(k) for k in keys]
+            existing = self.exists_many(keys)
+            self._index_delete([k for k in keys if k not in existing])
+        self._written(deleted)
+        return deleted
+
+    @synchronized
+    def _rows_after(self, rowid, batch_size, keys_only=False):
+        ''' return (rowid, k, serialized v) or (rowid, k) rows ordered by rowid '''
+        alive, params = self._alive_suffix()
+        SQL = 'SELECT %s, %s FROM %s WHERE %s > %s%s ORDER BY %s LIMIT %d;' % (
+            self._rowid, 'k' if keys_only else 'k, v', self._collection,
+            self._rowid, self._placeholder, alive, self._rowid, batch_size)
+        return self._decode_rows(self._fetchall(SQL, (rowid,) + params), 1)
+
+    @synchronized
+    def _index_checkpoint(self, index, checkpoint, ready=False):
+        ''' save index backfill state '''
+        SQL = 'UPDATE %s SET checkpoint = %s, ready = %s WHERE collection = %s AND attribute = %s;'
+        SQL %= (INDEXES_TABLE,) + (self._placeholder,) * 4
+        self.cursor().execute(SQL, (checkpoint, int(ready), self._collection, index.attribute))
+        index.checkpoint = checkpoint
+        index.ready = ready
+
+    def _index_ready(self, index):
+        ''' return True if the index is ready, the state is updated from database '''
+        if not index.ready:
+            actual = self._manager.index(self._collection, index.attribute)
+            if actual is not None:
+                index.ready = actual.ready
+                index.checkpoint = actual.checkpoint
+        return index.ready
+
+    def drop_index(self, attribute):
+        ''' drop index on document attribute '''
+        self._get_index(attribute)
+        self._manager.drop_index(self._collection, attribute)
+        del self._indexes[attribute]
+
+    def _get_index(self, attribute):
+        if attribute not in self._indexes:
+            raise RuntimeError('No index on attribute: {}'.format(attribute))
+        return self._indexes[attribute]
+
+    def _check_index_values(self, kvs):
+        ''' raise RuntimeError if (k, v) documents can't be indexed, it's
+        checked before the documents are written
+        '''
+        for index in self._indexes.values():
+            for _, v in kvs:
+                index.value(v)
+
+    @synchronized
+    def _index_put(self, kvs, indexes=None, replace=True):
+        ''' update index tables for (k, v) documents
+
+        replace: False - only add missing index rows, existing rows are not
+        changed and rows of documents without the attribute are not deleted,
+        so the rows written by concurrent put() are kept
+        '''
+        if indexes is None:
+            indexes = self._indexes.values()
+        P = self._placeholder
+        SQL_INSERT = 'REPLACE' if replace else self._manager.SQL_INSERT_IGNORE
+        for index in indexes:
+            rows = list()
+            removed = list()
+            for k, v in kvs:
+                value = index.value(v)
+                if value is None:
+                    removed.append((self._encode_key(k),))
+                else:
+                    rows.append((value, self._encode_key(k)))
+            cursor = self.cursor()
+            if rows:
+                cursor.executemany(
+                    '%s INTO %s (v,k) VALUES (%s,%s)' % (SQL_INSERT, index.table, P, P), rows)
+            if removed and replace:
+                cursor.executemany('DELETE FROM %s WHERE k = %s' % (index.table, P), removed)
+
+    @synchronized
+    def _index_delete(self, keys):
+        ''' delete keys from index tables '''
+        for index in self._indexes.values():
+            self.cursor().executemany(
+                'DELETE FROM %s WHERE k = %s' % (index.table, self._placeholder),
+                [(k,) for k in self._encode_keys(keys)])
+
+    def find(self, attribute, value, limit=None, batch_size=DEFAULT_BATCH_SIZE):
+        ''' return documents (k, v) where attribute = value, ordered by key '''
+        index = self._get_index(attribute)
+        value = index.convert(value)
+        if not self._index_ready(index):
+            return self._find_by_scan(index, value, value, False, limit)
+        return self._find(index, value, value, False, limit, batch_size)
+
+    def find_range(self, attribute, start=None, end=None, reverse=False, limit=None,
+                   batch_size=DEFAULT_BATCH_SIZE):
+        ''' return documents (k, v) where start <= attribute < end,
+        ordered by attribute value and key
+        '''
+        index = self._get_index(attribute)
+        if start is not None:
+            start = index.convert(start)
+        if end is not None:
+            end = index.convert(end)
+        if not self._index_ready(index):
+            return self._find_by_scan(index, start, end, reverse, limit, end_inclusive=False)
+        return self._find(index, start, end, reverse, limit, batch_size, end_inclusive=False)
+
+    def _find_by_scan(self, index, start, end, reverse, limit, end_inclusive=True):
+        ''' return documents by attribute values range by full collection scan.
+        Documents with one value are returned as they are scanned in key order,
+        the range is sorted in memory, with limit only limit documents are kept
+        '''
+        found = self._scan_matches(index, start, end, reverse, end_inclusive)
+        if start is not None and start == end and end_inclusive:
+            for _, k, v in itertools.islice(found, limit):
+                yield (k, v)
+            return
+        if limit is None:
+            found = sorted(found, reverse=reverse)
+        elif reverse:
+            found = heapq.nlargest(limit, found)
+        else:
+            found = heapq.nsmallest(limit, found)
+        for _, k, v in found:
+            yield (k, v)
+
+    def _scan_matches(self, index, start, end, reverse, end_inclusive):
+        ''' return (value, k, v) for documents in attribute values range in key order '''
+        for k, v in self.scan(reverse=reverse):
+            try:
+                value = index.value(v)
+            except RuntimeError:
+                continue
+            if index.in_range(value, start, end, end_inclusive):
+                yield (value, k, v)
+
+    def _find(self, index, start, end, reverse, limit, batch_size, end_inclusive=True):
+        ''' return documents by index values range, the index table is joined
+        with collection, pages are read by keyset pagination on (v, k).
+        The query is re-applied to documents, stale index rows are skipped
+        '''
+        P = self._placeholder
+        conditions = list()
+        params = list()
+        if start is not None:
+            conditions.append('i.v >= %s' % P)
+            params.append(start)
+        if end is not None:
+            conditions.append('i.v %s %s' % ('<=' if end_inclusive else '<', P))
+            params.append(end)
+        alive, alive_params = self._alive('c.e')
+        if alive is not None:
+            conditions.append(alive)
+            params.extend(alive_params)
+
+        SQL_SELECT = 'SELECT i.v, c.k, c.v FROM %s i JOIN %s c ON c.k = i.k ' % (
+            index.table, self._collection)
+        ORDER = 'ORDER BY i.v %s, i.k %s LIMIT %%d;' % (('DESC',) * 2 if reverse else ('ASC',) * 2)
+        OP = '<' if reverse else '>'
+        NEXT_PAGE = '(i.v %s %s OR (i.v = %s AND i.k %s %s))' % (OP, P, P, OP, P)
+
+        last = None
+        count = 0
+        while limit is None or count < limit:
+            page_size = batch_size if limit is None else min(batch_size, limit - count)
+            page_conditions = list(conditions)
+            page_params = list(params)
+            if last is not None:
+                page_conditions.append(NEXT_PAGE)
+                page_params.extend((last[0], last[0], last[1]))
+            SQL = SQL_SELECT
+            if page_conditions:
+                SQL += 'WHERE %s ' % ' AND '.join(page_conditions)
+            SQL += ORDER % page_size
+            result = self._fetchall(SQL, page_params)
+            for r in result:
+                k = self._decode_key(r[1])
+                try:
+                    v = self._serializer.loads(r[2])
+                except Exception, err:
+                    raise RuntimeError('key %s, %s' % (k, err))
+                if index.in_range(index.value(v), start, end, end_inclusive):
+                    count += 1
+                    yield (k, v)
+            if len(result) < page_size:
+                break
+            last = result[-1][:2]
+
+    def _loads_many(self, rows):
+        ''' return dict {k: v} from (k, serialized v) rows '''
+        result = dict()
+        for k, v in rows:
+            try:
+                result[k] = self._serializer.loads(v)
+            except Exception, err:
+                raise RuntimeError('key %s, %s' % (k, err))
+        return result
+
+    @synchronized
+    def _fetchall(self, sql, params=None):
+        ''' execute sql and return all rows '''
+        cursor = self.cursor()
+        if params is None:
+            cursor.execute(sql)
+        else:
+            cursor.execute(sql, params)
+        return cursor.fetchall()
+
+    def _written(self, amount=1):
+        ''' count writes and commit them according to commit policy '''
+        self._state.pending_writes += amount
+        self._manager._state.pending_writes += amount
+        if self._commit_every and self._state.pending_writes >= self._commit_every:
+            self.commit()
+
+    @synchronized
+    def _commit_pending(self):
+        ''' commit if there are not committed writes '''
+        if self._state.pending_writes:
+            self.commit()
+
+    @synchronized
+    def commit(self):
+        self._conn.commit()
+        self._state.pending_writes = 0
+        self._manager._state.pending_writes = 0
+
+    def _stop_commit_timer(self):
+        ''' stop background commits '''
+        if self._commit_timer is not None:
+            self._commit_timer.stop()
+            self._commit_timer = None
+
+    def close(self):
+        ''' close connection to database '''
+        self._stop_commit_timer()
+        if self._manager.pooled:
+            # commit() checks out the connection of the thread itself
+            self.commit()
+            self._manager.close()
+        elif self._conn.open:
+            self.commit()
+            self._manager.close()
+
+
+# -----------------------------------------------------------------
+# MysqlCollection class
+# -----------------------------------------------------------------
+class MysqlCollection(BaseCollection):
+
+    ''' Mysql Connection '''
+
+    _rowid = '__rowid__'
+
+    @staticmethod
+    def _prefix_condition(prefix):
+        ''' return condition and params for keys with prefix '''
+        for c in ('\\', '%', '_'):
+            prefix = prefix.replace(c, '\\' + c)
+        return 'k LIKE %s', [prefix + '%']
+
+    @synchronized
+    def get_uuid(self):
+        """
+        if mysql connection is available more fast way to use this method
+        than global function - get_uuid()
+
+        return id based on uuid """
+
+        if not self._uuid_cache:
+            cursor = self.cursor()
+            cursor.execute('SELECT %s;' % ','.join(
+                ['uuid()' for _ in range(100)]))
+            for uuid in cursor.fetchone():
+                u = uuid.split('-')
+                u.reverse()
+                u = ("%040s" % ''.join(u)).replace(' ', '0')
+                self._uuid_cache.append(u)
+        return self._uuid_cache.pop()
+
+    @synchronized
+    def _get_raw(self, k):
+        ''' return serialized document by key or None '''
+        alive, params = self._alive_suffix()
+        SQL = 'SELECT v FROM %s WHERE k = %%s%s;' % (self._collection, alive)
+        cursor = self.cursor()
+        try:
+            cursor.execute(SQL, (self._encode_key(k),) + params)
+        except Exception, err:
+            raise RuntimeError(err)
+        result = cursor.fetchone()
+        if result:
+            return result[0]
+        return None
+
+    @synchronized
+    def put(self, k, v, ttl=None):
+        ''' put document in collection
+
+        ttl: the document expires after ttl seconds, see enable_ttl()
+        '''
+
+        if len(k) > MAX_KEY_LENGTH:
+            raise RuntimeError(
+                'The length of key is more than %s bytes' % MAX_KEY_LENGTH)
+        if self._indexes:
+            self._check_index_values([(k, v)])
+        expires = self._expires(ttl)
+        blob = self._serializer.dumps(v)
+        cursor = self.cursor()
+        if self._ttl:
+            SQL_INSERT = 'INSERT INTO %s (k,v,e) ' % self._collection
+            SQL_INSERT += 'VALUES (%s,%s,%s) ON DUPLICATE KEY UPDATE v=%s, e=%s;'
+            cursor.execute(SQL_INSERT, (self._encode_key(k), blob, expires, blob, expires))
+        else:
+            SQL_INSERT = 'INSERT INTO %s (k,v) ' % self._collection
+            SQL_INSERT += 'VALUES (%s,%s) ON DUPLICATE KEY UPDATE v=%s;;'
+            cursor.execute(SQL_INSERT, (self._encode_key(k), blob, blob))
+        if self._bloom is not None:
+            self._bloom.add(k)
+        if self._indexes:
+            self._index_put([(k, v)])
+        self._written()
+
+    @synchronized
+    def delete(self, k):
+        ''' delete document by k '''
+        if len(k) > MAX_KEY_LENGTH:
+            raise RuntimeError(
+                'The length of key is more than %s bytes' % MAX_KEY_LENGTH)
+
+        SQL_DELETE = '''DELETE FROM %s WHERE k = ''' % self._collection
+        cursor = self.cursor()
+        cursor.execute(SQL_DELETE + "%s;", (self._encode_key(k),))
+        if self._indexes:
+            self._index_delete([k])
+        self._written()
+
+    def _put_rows(self, rows, expires=None):
+        ''' put (k, serialized v) rows by one multi-row insert '''
+        if self._ttl:
+            SQL_INSERT = 'INSERT INTO %s (k,v,e) VALUES ' % self._collection
+            SQL_INSERT += ','.join(['(%s,%s,%s)'] * len(rows))
+            SQL_INSERT += ' ON DUPLICATE KEY UPDATE v=VALUES(v), e=VALUES(e);'
+        else:
+            SQL_INSERT = 'INSERT INTO %s (k,v) VALUES ' % self._collection
+            SQL_INSERT += ','.join(['(%s,%s)'] * len(rows))
+            SQL_INSERT += ' ON DUPLICATE KEY UPDATE v=VALUES(v);'
+        params = list()
+        for k, v in rows:
+            params.extend((self._encode_key(k), v))
+            if self._ttl:
+                params.append(expires)
+        self.cursor().execute(SQL_INSERT, params)
+
+    @synchronized
+    def _get_many_raw(self, keys, chunk_size=None, with_expiry=False):
+        ''' return list of (k, serialized v) for existing documents by keys
+
+        with_expiry: return (k, serialized v, expiry) rows, expiry is None if
+        TTL is not enabled
+        '''
+        result = list()
+        cursor = self.cursor()
+        columns = 'k,v,e' if with_expiry and self._ttl else 'k,v'
+        for chunk in self._key_chunks(keys, chunk_size):
+            alive, params = self._alive_suffix()
+            SQL = 'SELECT %s FROM %s WHERE k IN ' % (columns, self._collection)
+            SQL += '(%s)%s;' % (','.join(['%s'] * len(chunk)), alive)
+            try:
+                cursor.execute(SQL, list(self._encode_keys(chunk)) + list(params))
+            except Exception, err:
+                raise RuntimeError(err)
+            rows = self._decode_rows(cursor.fetchall())
+            if with_expiry and not self._ttl:
+                rows = [(k, v, None) for k, v in rows]
+            result.extend(rows)
+        return result
+
+    def _delete_keys(self, keys):
+        ''' delete documents by keys by one statement '''
+        SQL_DELETE = 'DELETE FROM %s WHERE k IN ' % self._collection
+        SQL_DELETE += '(%s);' % ','.join(['%s'] * len(keys))
+        self.cursor().execute(SQL_DELETE, self._encode_keys(keys))
+
+    __setitem__ = put
+    __delitem__ = delete
+
+
+# -----------------------------------------------------------------
+# SqliteCollection class
+# -----------------------------------------------------------------
+class SqliteCollection(BaseCollection):
+
+    ''' Sqlite Collection'''
+
+    _rowid = 'rowid'
+
+    def __init__(self, manager, collection_name, *args, **kwargs):
+
+        super(SqliteCollection, self).__init__(manager, collection_name, *args, **kwargs)
+        # WITHOUT ROWID tables are read by pages in key order
+        if manager.schema_version(collection_name) >= 2:
+            self._rowid = 'k'
+
+    @staticmethod
+    def _prefix_condition(prefix):
+        ''' return condition and params for keys with prefix '''
+        end = prefix_end(prefix)
+        if end is None:
+            return 'k >= ?', [prefix]
+        return 'k >= ? AND k < ?', [prefix, end]
+
+    @synchronized
+    def get_uuid(self):
+        """ return id based on uuid """
+
+        if not self._uuid_cache:
+            for uuid in get_uuid():
+                self._uuid_cache.append(uuid)
+        return self._uuid_cache.pop()
+
+    @synchronized
+    def put(self, k, v, ttl=None):
+        ''' put document in collection
+
+        ttl: the document expires after ttl seconds, see enable_ttl()
+        '''
+
+        if len(k) > MAX_KEY_LENGTH:
+            raise RuntimeError(
+                'The length of key is more than %s bytes', MAX_KEY_LENGTH)
+        if self._indexes:
+            self._check_index_values([(k, v)])
+        expires = self._expires(ttl)
+        cursor = self.cursor()
+        if self._ttl:
+            SQL_INSERT = 'INSERT OR REPLACE INTO %s (k,v,e) VALUES (?,?,?)' % self._collection
+            cursor.execute(SQL_INSERT, (self._encode_key(k), self._serializer.dumps(v), expires))
+        else:
+            SQL_INSERT = 'INSERT OR REPLACE INTO %s (k,v) ' % self._collection
+            SQL_INSERT += 'VALUES (?,?)'
+            cursor.execute(SQL_INSERT, (self._encode_key(k), self._serializer.dumps(v)))
+        if self._bloom is not None:
+            self._bloom.add(k)
+        if self._indexes:
+            self._index_put([(k, v)])
+        self._written()
+
+    @synchronized
+    def _get_raw(self, k):
+        ''' return serialized document by key or None '''
+        alive, params = self._alive_suffix()
+        SQL = 'SELECT v FROM %s WHERE k = ?%s;' % (self._collection, alive)
+        cursor = self.cursor()
+        try:
+            cursor.execute(SQL, (self._encode_key(k),) + params)
+        except Exception, err:
+            raise RuntimeError(err)
+        result = cursor.fetchone()
+        if result:
+            return result[0]
+        return None
+
+    @synchronized
+    def delete(self, k):
+        ''' delete document by k '''
+        if len(k) > MAX_KEY_LENGTH:
+            raise RuntimeError(
+                'The key length is more than %s bytes' % MAX_KEY_LENGTH)
+        SQL_DELETE = '''DELETE FROM %s WHERE k = ?;''' % self._collection
+        self.cursor().execute(SQL_DELETE, (self._encode_key(k),))
+        if self._indexes:
+            self._index_delete([k])
+        self._written()
+
+    def _put_rows(self, rows, expires=None):
+        ''' put (k, serialized v) rows by executemany() '''
+        if self._ttl:
+            SQL_INSERT = 'INSERT OR REPLACE INTO %s (k,v,e) VALUES (?,?,?)' % self._collection
+            rows = [(self._encode_key(k), v, expires) for k, v in rows]
+        else:
+            SQL_INSERT = 'INSERT OR REPLACE INTO %s (k,v) ' % self._collection
+            SQL_INSERT += 'VALUES (?,?)'
+            rows = [(self._encode_key(k), v) for k, v in rows]
+        self.cursor().executemany(SQL_INSERT, rows)
+
+    @synchronized
+    def _get_many_raw(self, keys, chunk_size=None, with_expiry=False):
+        ''' return list of (k, serialized v) for existing documents by keys
+
+        with_expiry: return (k, serialized v, expiry) rows, expiry is None if
+        TTL is not enabled
+        '''
+        result = list()
+        cursor = self.cursor()
+        columns = 'k,v,e' if with_expiry and self._ttl else 'k,v'
+        for chunk in self._key_chunks(keys, chunk_size):
+            alive, params = self._alive_suffix()
+            SQL = 'SELECT %s FROM %s WHERE k IN ' % (columns, self._collection)
+            SQL += '(%s)%s;' % (','.join(['?'] * len(chunk)), alive)
+            try:
+                cursor.execute(SQL, list(self._encode_keys(chunk)) + list(params))
+            except Exception, err:
+                raise RuntimeError(err)
+            rows = self._decode_rows(cursor.fetchall())
+            if with_expiry and not self._ttl:
+                rows = [(k, v, None) for k, v in rows]
+            result.extend(rows)
+        return result
+
+    def _delete_keys(self, keys):
+        ''' delete documents by keys by executemany() '''
+        SQL_DELETE = 'DELETE FROM %s WHERE k = ?;' % self._collection
+        self.cursor().executemany(SQL_DELETE, [(k,) for k in self._encode_keys(keys)])
+
+    def close(self):
+        self._stop_commit_timer()
+        if self._commit_every or self._commit_interval:
+            self._commit_pending()
+        self._conn.close()
+
+    __setitem__ = put
+    __delitem__ = delete
+
+
+# -----------------------------------------------------------------
+# BatchJob class
+# -----------------------------------------------------------------
+class BatchJob(object):
+
+    ''' Base class of jobs which process the collection by batches,
+    subclasses define step(), done and name
+
+    The job commits the collection transaction after every batch, so use
+    separate collection object (connection) for the job which runs in
+    background thread.
+
+    rows_per_second: max speed of processing, None - without limit
+    '''
+
+    __metaclass__ = abc.ABCMeta
+
+    name = 'kvlite-job'
+
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE, rows_per_second=None):
+
+        self.collection = collection
+        self.batch_size = batch_size
+        self.rows_per_second = rows_per_second
+
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @abc.abstractproperty
+    def done(self):
+        ''' return True if all batches are processed '''
+
+    @abc.abstractmethod
+    def step(self):
+        ''' process next batch, return amount of processed rows '''
+
+    def run(self):
+        ''' process batches until all of them are processed or stop() '''
+        while not self.done and not self._stopped.is_set():
+            started = time.time()
+            amount = self.step()
+            if self.rows_per_second and amount:
+                delay = float(amount) / self.rows_per_second - (time.time() - started)
+                if delay > 0:
+                    self._stopped.wait(delay)
+
+    def start(self):
+        ''' run the job in background thread '''
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        ''' stop background job, it can be resumed later '''
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def join(self, timeout=None):
+        ''' wait until background job is finished '''
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+# -----------------------------------------------------------------
+# IndexBackfill class
+# -----------------------------------------------------------------
+class IndexBackfill(BatchJob):
+
+    ''' Index existing documents of the collection, "The Cleaner"
+
+    Documents are read by batches in rowid order, every batch is indexed and
+    committed together with the checkpoint, so the backfill can be stopped
+    and resumed later from the checkpoint. When all documents are indexed
+    the index becomes ready for queries.
+
+    The backfill only adds missing index rows: the row written by concurrent
+    put() after the batch was read is not replaced by the stale value.
+    Documents which can't be indexed (str value is too long) are logged and
+    skipped.
+
+    rows_per_second: max speed of indexing, None - without limit
+    '''
+
+    def __init__(self, collection, attribute, batch_size=DEFAULT_BATCH_SIZE,
+                 rows_per_second=None):
+
+        super(IndexBackfill, self).__init__(collection, batch_size, rows_per_second)
+        self.index = collection._get_index(attribute)
+
+    @property
+    def name(self):
+        return 'kvlite-backfill-%s' % self.index.table
+
+    @property
+    def done(self):
+        return self.index.ready
+
+    def step(self):
+        ''' index next batch of documents, return amount of indexed documents '''
+        collection = self.collection
+        index = self.index
+        rows = collection._rows_after(index.checkpoint, self.batch_size)
+        kvs = list()
+        for _, k, v in rows:
+            try:
+                v = collection._serializer.loads(v)
+                index.value(v)
+            except Exception, err:
+                logging.error('index %s, key %s: %s', index.table, k, err)
+                continue
+            kvs.append((k, v))
+        if kvs:
+            collection._index_put(kvs, [index], replace=False)
+        checkpoint = rows[-1][0] if rows else index.checkpoint
+        collection._index_checkpoint(index, checkpoint, ready=len(rows) < self.batch_size)
+        collection.commit()
+        return len(rows)
+
+
+# -----------------------------------------------------------------
+# ReencodeJob class
+# -----------------------------------------------------------------
+class ReencodeJob(BatchJob):
+
+    ''' Re-encode documents stored in old formats by the current serializer
+    of the collection, FormatSerializer should be used by the collection
+
+    Documents are read by batches in rowid order, the document is replaced
+    only if it was not changed after reading, every batch is committed.
+    The stopped job continues from `rowid` by start(), the position is kept
+    in memory only: new job starts from the beginning (rowid=0) and skips
+    documents which are already in the current format.
+    '''
+
+    name = 'kvlite-reencode'
+
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE, rows_per_second=None, rowid=0):
+
+        super(ReencodeJob, self).__init__(collection, batch_size, rows_per_second)
+        if not isinstance(collection._serializer, FormatSerializer):
+            raise RuntimeError('Collection serializer is not FormatSerializer')
+        self.rowid = rowid
+        self.reencoded = 0
+        self._done = False
+
+    @property
+    def done(self):
+        return self._done
+
+    def step(self):
+        ''' re-encode next batch of documents, return amount of read documents '''
+        collection = self.collection
+        serializer = collection._serializer
+        rows = collection._rows_after(self.rowid, self.batch_size)
+        replaced = list()
+        for _, k, v in rows:
+            if serializer.is_current(v):
+                continue
+            try:
+                replaced.append((k, v, serializer.dumps(serializer.loads(v))))
+            except Exception, err:
+                logging.error('re-encode %s, key %s: %s', collection._collection, k, err)
+        if replaced:
+            self.reencoded += collection._replace_raw(replaced)
+        collection.commit()
+        if rows:
+            self.rowid = rows[-1][0]
+        self._done = len(rows) < self.batch_size
+        return len(rows)
+
+
+# -----------------------------------------------------------------
+# ExpirySweeper class
+# -----------------------------------------------------------------
+class ExpirySweeper(BatchJob):
+
+    ''' Delete expired documents of the collection by batches
+
+    Expired documents are found by the index on expiry time, so the sweeper
+    doesn't scan the collection. Every batch is committed. One pass deletes
+    documents which are expired when it's finished, with `interval` the
+    sweeper in background thread repeats passes every interval seconds
+    until stop().
+    '''
+
+    name = 'kvlite-sweeper'
+
+    def __init__(self, collection, batch_size=DEFAULT_BATCH_SIZE, rows_per_second=None, interval=None):
+
+        super(ExpirySweeper, self).__init__(collection, batch_size, rows_per_second)
+        self.interval = interval
+        self.deleted = 0
+        self._done = False
+
+    @property
+    def done(self):
+        return self._done
+
+    def step(self):
+        ''' delete next batch of expired documents, return amount of deleted documents '''
+        deleted = self.collection._delete_expired(self.batch_size)
+        self.collection.commit()
+        self.deleted += deleted
+        self._done = deleted < self.batch_size
+        return deleted
+
+    def run(self):
+        ''' delete expired documents, repeat every interval seconds if it's defined '''
+        while True:
+            self._done = False
+            super(ExpirySweeper, self).run()
+            if self.interval is None or self._stopped.wait(self.interval):
+                break
+
+
+# -----------------------------------------------------------------
+# BloomFilter class
+# -----------------------------------------------------------------
+class BloomFilter(object):
+
+    ''' Bloom filter of keys: `k in bloom` is False if the key was never added,
+    and True with error_rate probability for not added keys when the amount
+    of added keys is not more than capacity
+    '''
+
+    def __init__(self, capacity, error_rate=0.01):
+
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise RuntimeError('Incorrect Bloom filter parameters')
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, int(round(float(self.size) / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        h1, h2 = struct.unpack('>QQ', hashlib.md5(key).digest())
+        return [(h1 + i * h2) % self.size for i in xrange(self.hashes)]
+
+    def add(self, key):
+        positions = self._positions(key)
+        with self._lock:
+            for p in positions:
+                self._bits[p >> 3] |= 1 << (p & 7)
+
+    def update(self, keys):
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key):
+        bits = self._bits
+        for p in self._positions(key):
+            if not bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+
+# -----------------------------------------------------------------
+# LRUCache class
+# -----------------------------------------------------------------
+class LRUCache(object):
+
+    ''' LRU cache bounded by amount of entries and total size in bytes '''
+
+    def __init__(self, max_entries=None, max_bytes=None):
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size = 0
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, k):
+        return k in self._data
+
+    def get(self, k, default=None):
+        ''' return value by key and mark it as recently used '''
+        with self._lock:
+            item = self._data.pop(k, _MISSING)
+            if item is _MISSING:
+                self.misses += 1
+                return default
+            self._data[k] = item
+            self.hits += 1
+            return item[0]
+
+    def set(self, k, v, size=0):
+        ''' put value with size in bytes to the cache '''
+        if self.max_bytes is not None and size > self.max_bytes:
+            self.discard(k)
+            return
+        with self._lock:
+            item = self._data.pop(k, None)
+            if item is not None:
+                self.size -= item[1]
+            self._data[k] = (v, size)
+            self.size += size
+            while self._data and (
+                    (self.max_entries is not None and len(self._data) > self.max_entries) or
+                    (self.max_bytes is not None and self.size > self.max_bytes)):
+                _, item = self._data.popitem(last=False)
+                self.size -= item[1]
+                self.evictions += 1
+
+    def discard(self, k):
+        ''' remove key from the cache if exists '''
+        with self._lock:
+            item = self._data.pop(k, None)
+            if item is not None:
+                self.size -= item[1]
+
+    def clear(self):
+        ''' remove all entries '''
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def stats(self):
+        ''' return cache counters '''
+        return {
+            'entries': len(self._data),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+
+# -----------------------------------------------------------------
+# CachedCollection class
+# -----------------------------------------------------------------
+class CachedCollection(object):
+
+    ''' Read-through LRU cache in front of collection
+
+    Documents are cached deserialized, the size of cached document is the size
+    of serialized value. put() and delete() via this object invalidate cached
+    documents, the document loaded concurrently with the invalidation is not
+    cached. Cached documents are shared between callers, don't modify them.
+
+    Other wrappers (ShardedCollection, WriteBehindCollection) are read by their
+    get() and get_many(), the sizes of their documents are unknown, so max_bytes
+    is supported only for SqliteCollection and MysqlCollection.
+
+    >>> collection = CachedCollection(open('sqlite://memory:test'), max_entries=10000)
+    '''
+
+    def __init__(self, collection, max_entries=10000, max_bytes=None):
+
+        # cached documents don't know their expiry time
+        if getattr(collection, '_ttl', False):
+            raise RuntimeError('CachedCollection does not support collections with TTL')
+        # serialized documents are read only from BaseCollection
+        self._raw = isinstance(collection, BaseCollection)
+        if max_bytes is not None and not self._raw:
+            raise RuntimeError('max_bytes is not supported for {}'.format(collection.__class__.__name__))
+        self.collection = collection
+        self.cache = LRUCache(max_entries, max_bytes)
+        # key -> token of the load in progress, the invalidation drops it
+        self._loading = dict()
+        self._loading_lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    def _start_load(self, keys):
+        ''' register loads of keys, return token for _finish_load() '''
+        token = object()
+        with self._loading_lock:
+            for k in keys:
+                self._loading[k] = token
+        return token
+
+    def _finish_load(self, token, keys, loaded):
+        ''' cache loaded (k, v, size) items whose keys were not invalidated
+        after _start_load()
+        '''
+        with self._loading_lock:
+            valid = set()
+            for k in keys:
+                if self._loading.get(k) is token:
+                    del self._loading[k]
+                    valid.add(k)
+            for k, v, size in loaded:
+                if k in valid:
+                    self.cache.set(k, v, size)
+
+    def _invalidate(self, keys):
+        with self._loading_lock:
+            for k in keys:
+                self._loading.pop(k, None)
+                self.cache.discard(k)
+
+    def get(self, k, default=None):
+        ''' return document by key, from cache if possible '''
+        v = self.cache.get(k, _MISSING)
+        if v is not _MISSING:
+            return v
+        loaded = list()
+        token = self._start_load((k,))
+        try:
+            v, size = self._load(k)
+            if v is _MISSING:
+                return default
+            loaded.append((k, v, size))
+        finally:
+            self._finish_load(token, (k,), loaded)
+        return v
+
+    def _load(self, k):
+        ''' return (document, size) from collection, (_MISSING, 0) if it
+        doesn't exist
+        '''
+        collection = self.collection
+        if not self._raw:
+            return collection.get(k, _MISSING), 0
+        collection._check_key(k)
+        raw = collection._get_raw(k)
+        if raw is None:
+            return _MISSING, 0
+        try:
+            return collection._serializer.loads(raw), len(raw)
+        except Exception, err:
+            raise RuntimeError('key %s, %s' % (k, err))
+
+    def _load_many(self, keys, chunk_size):
+        ''' return list of (k, document, size) of existing documents '''
+        collection = self.collection
+        if not self._raw:
+            return [(k, v, 0) for k, v in collection.get_many(keys, chunk_size).items()]
+        rows = collection._get_many_raw(keys, chunk_size)
+        loaded = collection._loads_many(rows)
+        return [(k, loaded[k], len(raw)) for k, raw in rows]
+
+    def get_many(self, keys, chunk_size=None):
+        ''' return dict {k: v} for existing documents by keys '''
+        result = dict()
+        missed = list()
+        for k in keys:
+            v = self.cache.get(k, _MISSING)
+            if v is _MISSING:
+                missed.append(k)
+            else:
+                result[k] = v
+        if missed:
+            loaded = list()
+            token = self._start_load(missed)
+            try:
+                loaded.extend(self._load_many(missed, chunk_size))
+                result.update((k, v) for k, v, _ in loaded)
+            finally:
+                self._finish_load(token, missed, loaded)
+        return result
+
+    def put(self, k, v, ttl=None):
+        ''' put document in collection and invalidate cached one '''
+        self.collection.put(k, v, ttl=ttl)
+        self._invalidate((k,))
+
+    def put_many(self, kvs, chunk_size=None, ttl=None):
+        ''' put documents in collection and invalidate cached ones '''
+        if hasattr(kvs, 'items'):
+            kvs = kvs.items()
+        kvs = list(kvs)
+        self.collection.put_many(kvs, chunk_size, ttl)
+        self._invalidate(k for k, _ in kvs)
+
+    def delete(self, k):
+        ''' delete document and invalidate cached one '''
+        self.collection.delete(k)
+        self._invalidate((k,))
+
+    def delete_many(self, keys, chunk_size=None):
+        ''' delete documents and invalidate cached ones '''
+        keys = list(keys)
+        self.collection.delete_many(keys, chunk_size)
+        self._invalidate(keys)
+
+    def exists(self, k):
+        if k in self.cache:
+            return True
+        return bool(self.collection.exists(k))
+
+    def exists_many(self, keys, chunk_size=None):
+        ''' return set of existing keys, cached keys are not queried '''
+        keys = list(keys)
+        cached = set(k for k in keys if k in self.cache)
+        return cached | self.collection.exists_many([k for k in keys if k not in cached], chunk_size)
+
+    def cache_stats(self):
+        ''' return cache counters: entries, bytes, hits, misses, evictions '''
+        return self.cache.stats()
+
+    def close(self):
+        ''' drop cache and close collection '''
+        self.cache.clear()
+        self.collection.close()
+
+    def __iter__(self):
+        return iter(self.collection)
+
+    __getitem__ = get
+    __setitem__ = put
+    __delitem__ = delete
+    __contains__ = exists
+
+
+# -----------------------------------------------------------------
+# WriteBehindCollection class
+# -----------------------------------------------------------------
+class WriteBehindCollection(object):
+
+    ''' Write-behind buffer in front of collection
+
+    put() and delete() change the in-memory buffer only, repeated writes of
+    the key are coalesced. The background thread flushes the buffer to the
+    collection every flush_interval seconds or when it has flush_size keys,
+    by put_many() and delete_many() in one transaction. get(), get_many(),
+    exists() and exists_many() see buffered writes, other methods like
+    items(), scan() and count see flushed writes only, call flush() before
+    them if it's needed.
+
+    max_entries: max amount of buffered keys, when the buffer is full writes
+    wait for the flush (back-pressure) up to put_timeout seconds, None - without
+    timeout, RuntimeError is raised after timeout.
+
+    Documents of BaseCollection are serialized and checked (ttl, indexed
+    values) by put(), so the errors are raised to the caller, the flush writes
+    the serialized documents and indexes the buffered ones, don't modify them
+    after put(). Documents of other collections (like ShardedCollection) are
+    serialized by the flush. If the write of documents failed they are written
+    one by one, the documents which failed stay in the buffer and are retried
+    by the next flush, so the newer write of the key replaces them. ttl of
+    buffered document is counted from the flush.
+
+    Other attributes and methods of the collection are available through the
+    buffer, they are called under the same lock as the flush, the iterators
+    they return take it for every document. Call close() to flush buffered
+    writes, the buffers which are not closed are flushed at the interpreter
+    exit, writes are lost if the process dies.
+
+    >>> collection = WriteBehindCollection(open('sqlite://testdb.sqlite:events'), max_entries=100000)
+    '''
+
+    def __init__(self, collection, max_entries=10000, flush_size=1000, flush_interval=1.0,
+                 put_timeout=None):
+
+        self.collection = collection
+        self.max_entries = max_entries
+        self.flush_size = min(flush_size, max_entries)
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+
+        manager = getattr(collection, '_manager', None)
+        pooled = manager is not None and manager.pooled
+        # the collection is used by callers and the flusher thread
+        self._io_lock = None if pooled else threading.RLock()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._buffer = dict()
+        self._flushing = dict()
+        self._encode_key = getattr(collection, '_encode_key', None)
+        self._dumps = collection._serializer.dumps if isinstance(collection, BaseCollection) else None
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='kvlite-write-behind')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(_flush_at_exit, weakref.ref(self))
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        value = self._call(getattr, self.collection, name)
+        if callable(value):
+            return self._locked(value)
+        return value
+
+    def _call(self, func, *args, **kwargs):
+        if self._io_lock is None:
+            return func(*args, **kwargs)
+        with self._io_lock:
+            return func(*args, **kwargs)
+
+    def _locked(self, func):
+        ''' return func called by _call(), generators are iterated under the lock '''
+        def wrapper(*args, **kwargs):
+            result = self._call(func, *args, **kwargs)
+            if isinstance(result, types.GeneratorType):
+                return self._locked_iter(result)
+            return result
+        return wrapper
+
+    def _locked_iter(self, iterator):
+        ''' yield items of iterator, every next() is called by _call() '''
+        while True:
+            try:
+                item = self._call(next, iterator)
+            except StopIteration:
+                return
+            yield item
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception, err:
+                logging.error('write-behind flush: %s', err)
+
+    def _write(self, k, item):
+        ''' put (v, ttl, serialized v) or (_MISSING, None, None) for deleted key
+        in the buffer
+        '''
+        # incorrect keys are rejected now, otherwise they fail every flush
+        if len(k) > MAX_KEY_LENGTH:
+            BaseCollection._check_key(k)
+        if self._encode_key is not None:
+            self._encode_key(k)
+        deadline = None
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise RuntimeError('WriteBehindCollection is closed')
+                if k in self._buffer or len(self._buffer) + len(self._flushing) < self.max_entries:
+                    break
+                self._wakeup.set()
+                if deadline is None and self.put_timeout is not None:
+                    deadline = time.time() + self.put_timeout
+                timeout = None if deadline is None else deadline - time.time()
+                if timeout is not None and timeout <= 0:
+                    raise RuntimeError('Write-behind buffer is full')
+                self._not_full.wait(timeout)
+            self._buffer[k] = item
+            if len(self._buffer) >= self.flush_size:
+                self._wakeup.set()
+
+    def _item(self, k, v, ttl):
+        ''' return buffered item of document, serialized if the collection is
+        BaseCollection. ttl and indexed values are checked as by put() of the
+        collection, so incorrect documents are rejected now
+        '''
+        if self._dumps is None:
+            return (v, ttl, None)
+        collection = self.collection
+        collection._expires(ttl)
+        if collection._indexes:
+            collection._check_index_values([(k, v)])
+        return (v, ttl, self._dumps(v))
+
+    def put(self, k, v, ttl=None):
+        ''' put document in the buffer '''
+        self._write(k, self._item(k, v, ttl))
+
+    def put_many(self, kvs, chunk_size=None, ttl=None):
+        ''' put documents in the buffer '''
+        kvs = kvs.items() if hasattr(kvs, 'items') else kvs
+        for k, v in kvs:
+            self._write(k, self._item(k, v, ttl))
+
+    def delete(self, k):
+        ''' delete document, the deletion is buffered '''
+        self._write(k, (_MISSING, None, None))
+
+    def delete_many(self, keys, chunk_size=None):
+        for k in keys:
+            self._write(k, (_MISSING, None, None))
+
+    def _buffered(self, k):
+        ''' return buffered (v, ttl, serialized v) item or None, call it under
+        the lock
+        '''
+        item = self._buffer.get(k)
+        if item is None:
+            item = self._flushing.get(k)
+        return item
+
+    def get(self, k, default=None):
+        ''' return document by key, buffered writes are visible '''
+        with self._lock:
+            item = self._buffered(k)
+        if item is None:
+            return self._call(self.collection.get, k, default)
+        return default if item[0] is _MISSING else item[0]
+
+    def get_many(self, keys, chunk_size=None):
+        ''' return dict {k: v} for existing documents by keys '''
+        result = dict()
+        missed = list()
+        with self._lock:
+            for k in keys:
+                item = self._buffered(k)
+                if item is None:
+                    missed.append(k)
+                elif item[0] is not _MISSING:
+                    result[k] = item[0]
+        if missed:
+            result.update(self._call(self.collection.get_many, missed, chunk_size))
+        return result
+
+    def exists(self, k):
+        with self._lock:
+            item = self._buffered(k)
+        if item is None:
+            return self._call(self.collection.exists, k)
+        return item[0] is not _MISSING
+
+    def exists_many(self, keys, chunk_size=None):
+        ''' return set of existing keys '''
+        result = set()
+        missed = list()
+        with self._lock:
+            for k in keys:
+                item = self._buffered(k)
+                if item is None:
+                    missed.append(k)
+                elif item[0] is not _MISSING:
+                    result.add(k)
+        if missed:
+            result |= self._call(self.collection.exists_many, missed, chunk_size)
+        return result
+
+    def pending(self):
+        ''' return amount of not flushed keys '''
+        with self._lock:
+            return len(self._buffer) + len(self._flushing)
+
+    def flush(self):
+        ''' write buffered changes to the collection in one transaction, return
+        amount of written keys. If the flush failed the changes are returned
+        to the buffer, newer buffered writes of the same keys win
+        '''
+        with self._flush_lock:
+            with self._lock:
+                if not self._buffer:
+                    return 0
+                self._flushing = self._buffer
+                self._buffer = dict()
+            failed = self._flushing
+            try:
+                failed = self._call(self._flush, self._flushing)
+            finally:
+                with self._lock:
+                    merged = dict((k, self._flushing[k]) for k in failed)
+                    merged.update(self._buffer)
+                    self._buffer = merged
+                    flushed = len(self._flushing) - len(failed)
+                    self._flushing = dict()
+                    self._not_full.notify_all()
+            return flushed
+
+    def _flush(self, items):
+        ''' write items, return keys of documents which were not written '''
+        puts = defaultdict(list)
+        deletes = list()
+        for k, (v, ttl, blob) in items.items():
+            if v is _MISSING:
+                deletes.append(k)
+            else:
+                puts[ttl].append((k, v, blob))
+        collection = self.collection
+        failed = list()
+        for ttl, rows in puts.items():
+            failed.extend(self._put_many(rows, ttl))
+        if deletes:
+            collection.delete_many(deletes)
+        collection.commit()
+        return failed
+
+    def _put(self, rows, ttl):
+        ''' write (k, v, serialized v) rows, the documents of BaseCollection
+        are not serialized again
+        '''
+        collection = self.collection
+        if self._dumps is not None:
+            collection._put_serialized(rows, collection._expires(ttl))
+        else:
+            collection.put_many([(k, v) for k, v, _ in rows], ttl=ttl)
+
+    def _put_many(self, rows, ttl):
+        ''' write (k, v, serialized v) rows, if it failed the documents are
+        written one by one, return keys of documents which failed. If all
+        documents failed the first error is raised
+        '''
+        try:
+            self._put(rows, ttl)
+            return []
+        except Exception, err:
+            if len(rows) == 1:
+                raise
+            logging.warning('write-behind put_many: %s, documents are written one by one', err)
+        failed = list()
+        for row in rows:
+            try:
+                self._put([row], ttl)
+            except Exception, err:
+                failed.append((row[0], err))
+        if len(failed) == len(rows):
+            raise failed[0][1]
+        for k, err in failed:
+            logging.error('write-behind flush, document %s is kept in the buffer: %s', k, err)
+        return [k for k, _ in failed]
+
+    def commit(self):
+        ''' flush buffered changes '''
+        self.flush()
+
+    def close(self):
+        ''' stop the flusher thread, flush buffered changes and close collection '''
+        with self._lock:
+            self._closed = True
+            self._not_full.notify_all()
+        self._wakeup.set()
+        if self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self._thread.join()
+        self.flush()
+        self.collection.close()
+
+    def __iter__(self):
+        return self._locked_iter(self._call(iter, self.collection))
+
+    __getitem__ = get
+    __setitem__ = put
+    __delitem__ = delete
+    __contains__ = exists
+
+
+def _flush_at_exit(ref):
+    ''' flush write-behind buffer which was not closed, see WriteBehindCollection '''
+    collection = ref()
+    if collection is None or collection._closed:
+        return
+    try:
+        collection.flush()
+    except Exception, err:
+        logging.error('write-behind flush at exit: %s', err)
+
+
+# -----------------------------------------------------------------
+# HashRing class
+# -----------------------------------------------------------------
+class HashRing(object):
 
-        return driver, database, collection
-        '''
-        parsed_uri = dict()
-        parsed_uri['backend'], rest_uri = uri.split('://', 1)
-        if ':' in rest_uri:
-            parsed_uri['db'], parsed_uri['collection'] = rest_uri.split(':', 1)
-        else:
-            parsed_uri['db'] = rest_uri
-            parsed_uri['collection'] = None
-        if parsed_uri['db'] == 'memory':
-            parsed_uri['db'] = ':memory:'
-        return parsed_uri
+    ''' Consistent hashing ring
+
+    Every node is placed on the ring `replicas` times, the key belongs to the
+    first node point after the key hash. Adding or removing the node moves
+    only keys of its points, about 1/N of all keys.
+    '''
+
+    def __init__(self, nodes=(), replicas=DEFAULT_REPLICAS):
+
+        self.replicas = replicas
+        self._points = dict()
+        self._hashes = list()
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash(key):
+        ''' return 64-bit hash of the key '''
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return int(hashlib.md5(key).hexdigest()[:16], 16)
 
     @property
-    def collection_class(self):
-        ''' return SqliteCollection object'''
-        return SqliteCollection
+    def nodes(self):
+        return sorted(set(self._points.values()))
 
-    def collections(self):
-        ''' return collection list'''
+    def add(self, node):
+        ''' add node on the ring '''
+        if node in self.nodes:
+            raise RuntimeError('Node is already on the ring: %s' % node)
+        for i in range(self.replicas):
+            self._points[self.hash('%s#%d' % (node, i))] = node
+        self._hashes = sorted(self._points)
 
-        return self._collections('SELECT name FROM sqlite_master WHERE type="table";')
+    def remove(self, node):
+        ''' remove node from the ring '''
+        if node not in self.nodes:
+            raise RuntimeError('Node is not on the ring: %s' % node)
+        for point, point_node in self._points.items():
+            if point_node == node:
+                del self._points[point]
+        self._hashes = sorted(self._points)
 
-    def create(self, name):
-        ''' create collection '''
+    def node(self, key):
+        ''' return the node of the key '''
+        if not self._hashes:
+            raise RuntimeError('The ring is empty')
+        i = bisect.bisect(self._hashes, self.hash(key)) % len(self._hashes)
+        return self._points[self._hashes[i]]
 
-        SQL_CREATE_TABLE = '''CREATE TABLE IF NOT EXISTS %s (
-                                k NOT NULL, v, UNIQUE (k) );'''
-        self._create(SQL_CREATE_TABLE, name)
+    def copy(self):
+        ring = HashRing(replicas=self.replicas)
+        ring._points = dict(self._points)
+        ring._hashes = list(self._hashes)
+        return ring
 
 
 # -----------------------------------------------------------------
-# BaseCollection class
+# ShardedCollection class
 # -----------------------------------------------------------------
-class BaseCollection(object):
+class ShardedCollection(object):
 
-    def __init__(self, manager, collection_name, serializer=cPickleSerializer):
+    ''' Collection which spreads documents over shard collections by
+    consistent hashing of keys
 
-        self._manager = manager
-        self._collection = collection_name
-        self._serializer = serializer
+    After add_shard() or remove_shard() documents are routed by the new ring,
+    the documents which are not moved yet are read from the shards of the
+    previous ring until rebalance() is finished.
 
-        self._uuid_cache = list()
+    The ring state is saved in every shard database (RING_TABLE), so the
+    rebalancing continues after reopening: open the collection with the shards
+    of both rings. If the collection is opened with other shards than saved
+    ones, they are added and removed like by add_shard() and remove_shard().
+    Other processes see ring changes after refresh().
 
-    def cursor(self):
-        return self._manager.cursor()
+    >>> collection = open(['sqlite://shard1.sqlite:test', 'sqlite://shard2.sqlite:test'])
+    '''
+
+    def __init__(self, shards, replicas=DEFAULT_REPLICAS):
+        ''' shards: dict {shard name: collection} '''
+        if not shards:
+            raise RuntimeError('No shards')
+        self._shards = dict(shards)
+        self._replicas = replicas
+        self._ring = HashRing(self._shards, replicas)
+        self._previous_ring = None
+        self._load_ring(sorted(self._shards))
+
+    def _saved_ring(self):
+        ''' return the latest ring state saved in shards or None '''
+        states = [collection._manager.ring_state(collection._collection)
+                  for collection in self._shards.values()]
+        states = [state for state in states if state is not None]
+        return max(states, key=lambda state: state['changed']) if states else None
+
+    def _load_ring(self, nodes=None):
+        ''' restore the saved ring, nodes: the shards of the current ring if
+        they are defined by the caller
+        '''
+        state = self._saved_ring()
+        if state is None:
+            self._set_ring(nodes, None)
+        elif nodes is not None and state['previous'] is None and set(nodes) != set(state['nodes']):
+            # the shards were changed while the collection was closed
+            self._set_ring(nodes, state['nodes'])
+        else:
+            self._set_ring(state['nodes'], state['previous'])
+            return
+        self._save_ring()
+
+    def _set_ring(self, nodes, previous):
+        missing = (set(nodes) | set(previous or ())) - set(self._shards)
+        if missing:
+            raise RuntimeError('Shards of the ring are not opened: %s' % ', '.join(sorted(missing)))
+        self._ring = HashRing(nodes, self._replicas)
+        self._previous_ring = None if previous is None else HashRing(previous, self._replicas)
+
+    def _save_ring(self):
+        ''' save the ring state in all shards, their connections are committed '''
+        state = {
+            'nodes': self._ring.nodes,
+            'previous': None if self._previous_ring is None else self._previous_ring.nodes,
+            'changed': time.time(),
+        }
+        for collection in self._shards.values():
+            collection._manager.save_ring_state(collection._collection, state)
+
+    def refresh(self):
+        ''' reload the ring state saved by other process '''
+        self._load_ring()
 
     @property
-    def _conn(self):
-        return self._manager.connection
+    def shards(self):
+        ''' return dict {shard name: collection} of the ring '''
+        return dict((name, self._shards[name]) for name in self._ring.nodes)
+
+    def shard(self, k):
+        ''' return shard collection of the key '''
+        return self._shards[self._ring.node(k)]
+
+    def _previous_shard(self, k):
+        ''' return the shard of the key by previous ring if the key is not moved
+        to the shard of the current ring yet, otherwise None
+        '''
+        if self._previous_ring is None:
+            return None
+        name = self._previous_ring.node(k)
+        if name == self._ring.node(k):
+            return None
+        return self._shards[name]
+
+    def _group(self, keys, ring=None):
+        ''' return dict {shard name: keys} '''
+        ring = ring or self._ring
+        groups = dict()
+        for k in keys:
+            groups.setdefault(ring.node(k), list()).append(k)
+        return groups
+
+    def _owns(self, name, k):
+        ''' return True if the shard keeps actual version of the document '''
+        owner = self._ring.node(k)
+        if owner == name or self._previous_ring is None:
+            return True
+        return self._previous_ring.node(k) == name and self._shards[owner]._get_raw(k) is None
 
     @property
     def count(self):
-        ''' return amount of documents in collection'''
-        cursor = self.cursor()
-        cursor.execute('SELECT count(*) FROM %s;' % self._collection)
-        return int(cursor.fetchone()[0])
+        ''' return amount of documents in all shards, during rebalancing
+        the documents which are being moved can be counted twice
+        '''
+        return sum(collection.count for collection in self._shards.values())
+
+    def get(self, k, default=None):
+        ''' return document by key '''
+        v = self.shard(k).get(k, _MISSING)
+        if v is _MISSING:
+            previous = self._previous_shard(k)
+            return default if previous is None else previous.get(k, default)
+        return v
+
+    def get_many(self, keys, chunk_size=None):
+        ''' return dict {k: v} for existing documents by keys '''
+        keys = list(keys)
+        result = dict()
+        for name, shard_keys in self._group(keys).items():
+            result.update(self._shards[name].get_many(shard_keys, chunk_size))
+        if self._previous_ring is not None:
+            missed = [k for k in keys if k not in result]
+            for name, shard_keys in self._group(missed, self._previous_ring).items():
+                result.update(self._shards[name].get_many(shard_keys, chunk_size))
+        return result
 
     def exists(self, k):
-        cursor = self.cursor()
-        SQL = 'SELECT count(*) FROM %s WHERE k = ' % self._collection
-        try:
-            cursor.execute(SQL + "%s", k)
-        except Exception, err:
-            raise RuntimeError(err)
-        result = cursor.fetchone()
-        if result:
-            return int(result[0])
-        else:
-            return 0
+        if self.shard(k).exists(k):
+            return True
+        previous = self._previous_shard(k)
+        return previous is not None and previous.exists(k)
 
-    __contains__ = exists
+    def exists_many(self, keys, chunk_size=None):
+        ''' return set of existing keys '''
+        keys = list(keys)
+        result = set()
+        for name, shard_keys in self._group(keys).items():
+            result.update(self._shards[name].exists_many(shard_keys, chunk_size))
+        if self._previous_ring is not None:
+            missed = [k for k in keys if k not in result]
+            for name, shard_keys in self._group(missed, self._previous_ring).items():
+                result.update(self._shards[name].exists_many(shard_keys, chunk_size))
+        return result
+
+    def put(self, k, v, ttl=None):
+        ''' put document in its shard '''
+        self.shard(k).put(k, v, ttl=ttl)
+
+    def put_many(self, kvs, chunk_size=None, ttl=None):
+        ''' put documents in their shards '''
+        kvs = dict(kvs)
+        for name, shard_keys in self._group(kvs).items():
+            self._shards[name].put_many([(k, kvs[k]) for k in shard_keys], chunk_size, ttl)
+
+    def enable_ttl(self):
+        ''' add expiry column to the collections of all shards, see
+        BaseCollection.enable_ttl()
+        '''
+        for collection in self._shards.values():
+            collection.enable_ttl()
+
+    def sweep(self, background=False, **options):
+        ''' delete expired documents of all shards, return amount of deleted
+        documents
+
+        background: return the list of ExpirySweeper jobs of shards which
+        should be started, see BaseCollection.sweep()
+        '''
+        if background:
+            return [collection.sweep(background=True, **options)
+                    for collection in self._shards.values()]
+        return sum(collection.sweep(**options) for collection in self._shards.values())
+
+    def delete(self, k):
+        ''' delete document by key '''
+        self.shard(k).delete(k)
+        previous = self._previous_shard(k)
+        if previous is not None:
+            previous.delete(k)
+
+    def delete_many(self, keys, chunk_size=None):
+        ''' delete documents by keys '''
+        keys = list(keys)
+        rings = [self._ring] if self._previous_ring is None else [self._ring, self._previous_ring]
+        for ring in rings:
+            for name, shard_keys in self._group(keys, ring).items():
+                self._shards[name].delete_many(shard_keys, chunk_size)
+
+    def items(self):
+        ''' return all docs, shard by shard '''
+        for name in sorted(self._shards):
+            for k, v in self._shards[name].items():
+                if self._owns(name, k):
+                    yield (k, v)
+
+    def keys(self):
+        ''' return document keys, shard by shard '''
+        for name in sorted(self._shards):
+            for k in self._shards[name].keys():
+                if self._owns(name, k):
+                    yield k
+
+    def scan(self, start=None, end=None, prefix=None, reverse=False, limit=None,
+             keys_only=False, batch_size=DEFAULT_BATCH_SIZE):
+        ''' return documents (k, v) or keys ordered by key, the scans of shards
+        are merged, see BaseCollection.scan(). The limit is applied after the
+        documents which are owned by other shards during rebalancing are skipped,
+        so the shards are read by pages until the limit is reached
+        '''
+        if limit is not None:
+            batch_size = max(1, min(batch_size, limit))
+
+        def shard_scan(name):
+            for item in self._shards[name].scan(start, end, prefix, reverse, None,
+                                                keys_only, batch_size):
+                if self._owns(name, item if keys_only else item[0]):
+                    yield item
+
+        key = None if keys_only else (lambda item: item[0])
+        merged = merge_sorted([shard_scan(name) for name in sorted(self._shards)], key, reverse)
+        return itertools.islice(merged, limit)
+
+    def add_shard(self, name, collection):
+        ''' add shard, call rebalance() to move documents to it. The ring
+        state is saved, so the shards are committed
+        '''
+        self._change_ring()
+        self._ring.add(name)
+        self._shards[name] = collection
+        self._save_ring()
+
+    def remove_shard(self, name):
+        ''' remove shard from the ring, call rebalance() to move documents from it,
+        the shard collection is closed by rebalance(). The ring state is saved,
+        so the shards are committed
+        '''
+        if self._ring.nodes == [name]:
+            raise RuntimeError('Cannot remove the last shard')
+        self._change_ring()
+        self._ring.remove(name)
+        self._save_ring()
+
+    def _change_ring(self):
+        if self._previous_ring is not None:
+            raise RuntimeError('Previous rebalancing is not finished')
+        self._previous_ring = self._ring.copy()
+
+    def rebalance(self, batch_size=DEFAULT_CHUNK_SIZE):
+        ''' move documents to the shards of the current ring by batches, the
+        collection is available for reads and writes between batches. The batch
+        is copied to new shards where documents written after add_shard() or
+        remove_shard() are kept, committed and then deleted from old shard if
+        they were not changed. The copies of documents deleted after the batch
+        was read are deleted from new shards.
+
+        return amount of moved documents
+        '''
+        moved = 0
+        for name in sorted(self._shards):
+            source = self._shards[name]
+            moving = (k for k in source.scan(keys_only=True, batch_size=batch_size)
+                      if self._ring.node(k) != name)
+            for batch in chunks(moving, batch_size):
+                rows = source._get_many_raw(batch, with_expiry=True)
+                groups = self._group([row[0] for row in rows])
+                for target_name, target_keys in groups.items():
+                    target = self._shards[target_name]
+                    target_keys = set(target_keys)
+                    target._put_rows_if_absent([row for row in rows if row[0] in target_keys])
+                    target.commit()
+                deleted = source._delete_raw(rows)
+                source.commit()
+                for target_name, target_keys in groups.items():
+                    target_keys = set(k for k in target_keys if k not in deleted)
+                    if target_keys:
+                        target = self._shards[target_name]
+                        target._delete_raw([row for row in rows if row[0] in target_keys])
+                        target.commit()
+                moved += len(deleted)
+        for name in set(self._shards) - set(self._ring.nodes):
+            self._shards.pop(name).close()
+        self._previous_ring = None
+        self._save_ring()
+        return moved
+
+    def get_uuid(self):
+        return self._shards[self._ring.nodes[0]].get_uuid()
+
+    def get_id(self):
+        return get_id()
 
     def commit(self):
-        self._conn.commit()
+        for collection in self._shards.values():
+            collection.commit()
 
     def close(self):
-        ''' close connection to database '''
-        if self._conn.open:
-            self.commit()
-            self._conn.close()
+        for collection in self._shards.values():
+            collection.close()
+
+    __iter__ = items
+    __getitem__ = get
+    __setitem__ = put
+    __delitem__ = delete
+    __contains__ = exists
 
 
 # -----------------------------------------------------------------
-# MysqlCollection class
+# Executor class
 # -----------------------------------------------------------------
-class MysqlCollection(BaseCollection):
+class Future(object):
 
-    ''' Mysql Connection '''
+    ''' The result of the call executed by Executor '''
 
-    def get_uuid(self):
-        """
-        if mysql connection is available more fast way to use this method
-        than global function - get_uuid()
+    def __init__(self):
 
-        return id based on uuid """
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exception = None
+        self._callbacks = list()
 
-        if not self._uuid_cache:
-            cursor = self.cursor()
-            cursor.execute('SELECT %s;' % ','.join(
-                ['uuid()' for _ in range(100)]))
-            for uuid in cursor.fetchone():
-                u = uuid.split('-')
-                u.reverse()
-                u = ("%040s" % ''.join(u)).replace(' ', '0')
-                self._uuid_cache.append(u)
-        return self._uuid_cache.pop()
+    def done(self):
+        return self._done.is_set()
 
-    def items(self):
-        ''' return all docs '''
-        rowid = 0
-        cursor = self.cursor()
-        while True:
-            SQL_SELECT_MANY = 'SELECT __rowid__, k,v FROM %s WHERE __rowid__ > %d LIMIT 1000 ;'
-            SQL_SELECT_MANY %= (self._collection, rowid)
-            cursor.execute(SQL_SELECT_MANY)
-            result = cursor.fetchall()
-            if not result:
-                break
-            for r in result:
-                rowid = r[0]
-                k = r[1]
-                try:
-                    v = self._serializer.loads(r[2])
-                except Exception, err:
-                    raise RuntimeError('key %s, %s' % (k, err))
-                yield (k, v)
+    def set_result(self, result):
+        self._finish(result, None)
 
-    def get(self, k, default=None):
-        '''
-        return document by key from collection
-        '''
-        if len(k) > MAX_KEY_LENGTH:
-            raise RuntimeError(
-                'The key length is more than %s bytes' % MAX_KEY_LENGTH)
-        SQL = 'SELECT k,v FROM %s WHERE k = ' % self._collection
-        cursor = self.cursor()
+    def set_exception(self, exception):
+        self._finish(None, exception)
+
+    def _finish(self, result, exception):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, list()
+        for callback in callbacks:
+            self._run_callback(callback)
+
+    def _run_callback(self, callback):
         try:
-            cursor.execute(SQL + "%s", k)
+            callback(self)
         except Exception, err:
-            raise RuntimeError(err)
-        result = cursor.fetchone()
-        if result:
-            v = self._serializer.loads(result[1])
-            return v
-        else:
-            return default
+            logging.error('future callback %s: %s', callback, err)
 
-    def put(self, k, v):
-        ''' put document in collection '''
+    def add_done_callback(self, callback):
+        ''' call callback(future) when the future is done '''
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        self._run_callback(callback)
 
-        # TODO many k/v in put()
+    def exception(self, timeout=None):
+        ''' wait for the call and return its exception or None '''
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timeout waiting for the result')
+        return self._exception
 
-        if len(k) > MAX_KEY_LENGTH:
-            raise RuntimeError(
-                'The length of key is more than %s bytes' % MAX_KEY_LENGTH)
-        SQL_INSERT = 'INSERT INTO %s (k,v) ' % self._collection
-        SQL_INSERT += 'VALUES (%s,%s) ON DUPLICATE KEY UPDATE v=%s;;'
-        v = self._serializer.dumps(v)
-        cursor = self.cursor()
-        cursor.execute(SQL_INSERT, (k, v, v))
+    def result(self, timeout=None):
+        ''' wait for the call and return its result or raise its exception '''
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
 
-    def delete(self, k):
-        ''' delete document by k '''
-        if len(k) > MAX_KEY_LENGTH:
-            raise RuntimeError(
-                'The length of key is more than %s bytes' % MAX_KEY_LENGTH)
 
-        SQL_DELETE = '''DELETE FROM %s WHERE k = ''' % self._collection
-        cursor = self.cursor()
-        cursor.execute(SQL_DELETE + "%s;", k)
+class Executor(object):
 
-    def keys(self):
-        ''' return document keys in collection'''
-        rowid = 0
-        cursor = self.cursor()
+    ''' Pool of worker threads executing calls from the queue,
+    submit() blocks when `max_queue` calls are waiting
+    '''
+
+    def __init__(self, max_workers=4, max_queue=None, name='kvlite-executor'):
+
+        self._queue = Queue.Queue(max_queue or 0)
+        self._shutdown = False
+        self._workers = list()
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._work, name='%s-%d' % (name, i))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, func, *args, **kwargs):
+        ''' schedule func(*args, **kwargs), return Future '''
+        if self._shutdown:
+            raise RuntimeError('Executor is shut down')
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _work(self):
         while True:
-            SQL_SELECT_MANY = 'SELECT __rowid__, k FROM %s WHERE __rowid__ > %d LIMIT 1000 ;'
-            SQL_SELECT_MANY %= (self._collection, rowid)
-            cursor.execute(SQL_SELECT_MANY)
-            result = cursor.fetchall()
-            if not result:
+            task = self._queue.get()
+            if task is None:
                 break
-            for r in result:
-                rowid = r[0]
-                k = r[1]
-                yield k
+            future, func, args, kwargs = task
+            try:
+                result = func(*args, **kwargs)
+            except Exception, err:
+                future.set_exception(err)
+            else:
+                future.set_result(result)
 
-    __getitem__ = get
-    __iter__ = items
-    __setitem__ = put
-    __delitem__ = delete
+    def shutdown(self, wait=True):
+        ''' stop workers after already submitted calls '''
+        if self._shutdown:
+            return
+        self._shutdown = True
+        for _ in self._workers:
+            self._queue.put(None)
+        if wait:
+            for worker in self._workers:
+                worker.join()
 
 
 # -----------------------------------------------------------------
-# SqliteCollection class
+# AsyncCollection class
 # -----------------------------------------------------------------
-class SqliteCollection(BaseCollection):
+class AsyncCollection(object):
 
-    ''' Sqlite Collection'''
+    ''' Non-blocking API of collection
 
-    def get_uuid(self):
-        """ return id based on uuid """
+    Calls are executed by the bounded pool of worker threads and return Future
+    objects, so many lookups can be in flight at once.
 
-        if not self._uuid_cache:
-            for uuid in get_uuid():
-                self._uuid_cache.append(uuid)
-        return self._uuid_cache.pop()
+    Without connection pool the collection has one connection, so the calls
+    are executed one by one by one worker (max_workers is ignored), they
+    overlap with the caller only. Writes are in the collection transaction
+    until commit().
 
-    def put(self, k, v):
-        ''' put document in collection '''
+    With PooledMysqlCollectionManager every worker uses its own connection,
+    so every write call is committed by the worker as separate transaction:
+    writes of different calls are not atomic and commit() does nothing.
 
-        # TODO many k/v in put()
+    >>> collection = AsyncCollection(open('sqlite://testdb.sqlite:test'))
+    >>> future = collection.get('key')
+    >>> future.result()
+    '''
 
-        if len(k) > MAX_KEY_LENGTH:
-            raise RuntimeError(
-                'The length of key is more than %s bytes', MAX_KEY_LENGTH)
-        cursor = self.cursor()
-        SQL_INSERT = 'INSERT OR REPLACE INTO %s (k,v) ' % self._collection
-        SQL_INSERT += 'VALUES (?,?)'
-        v = self._serializer.dumps(v)
-        cursor.execute(SQL_INSERT, (k, v))
+    def __init__(self, collection, max_workers=4, max_queue=1000):
 
-    def items(self):
-        ''' return all docs '''
-        rowid = 0
-        cursor = self.cursor()
-        while True:
-            SQL_SELECT_MANY = 'SELECT rowid, k,v FROM %s WHERE rowid > %d LIMIT 1000 ;'
-            SQL_SELECT_MANY %= (self._collection, rowid)
-            cursor.execute(SQL_SELECT_MANY)
-            result = cursor.fetchall()
-            if not result:
-                break
-            for r in result:
-                rowid = r[0]
-                k = r[1]
-                try:
-                    v = self._serializer.loads(r[2])
-                except Exception, err:
-                    raise RuntimeError('key %s, %s' % (k, err))
-                yield (k, v)
+        self.collection = collection
+        manager = getattr(collection, '_manager', None)
+        self._pooled = manager is not None and manager.pooled
+        self._lock = None if self._pooled else threading.Lock()
+        if not self._pooled:
+            max_workers = 1
+        self._executor = Executor(max_workers, max_queue, name='kvlite-async')
 
-    def get(self, k):
-        '''
-        return document by key from collection
-        return documents if key is not defined
+    def _call(self, func, *args, **kwargs):
+        if self._lock is None:
+            return func(*args, **kwargs)
+        with self._lock:
+            return func(*args, **kwargs)
+
+    def _write(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+        if self._pooled:
+            self.collection.commit()
+
+    def submit(self, func, *args, **kwargs):
+        ''' execute func(*args, **kwargs) by the worker, func uses the collection '''
+        return self._executor.submit(self._call, func, *args, **kwargs)
+
+    def get(self, k, default=None):
+        return self.submit(self.collection.get, k, default)
+
+    def get_many(self, keys, chunk_size=None):
+        return self.submit(self.collection.get_many, list(keys), chunk_size)
+
+    def exists(self, k):
+        return self.submit(self.collection.exists, k)
+
+    def exists_many(self, keys, chunk_size=None):
+        return self.submit(self.collection.exists_many, list(keys), chunk_size)
+
+    def count(self):
+        return self.submit(lambda: self.collection.count)
+
+    def put(self, k, v, ttl=None):
+        return self.submit(self._write, self.collection.put, k, v, ttl)
+
+    def put_many(self, kvs, chunk_size=None, ttl=None):
+        kvs = kvs.items() if hasattr(kvs, 'items') else list(kvs)
+        return self.submit(self._write, self.collection.put_many, kvs, chunk_size, ttl)
+
+    def delete(self, k):
+        return self.submit(self._write, self.collection.delete, k)
+
+    def delete_many(self, keys, chunk_size=None):
+        return self.submit(self._write, self.collection.delete_many, list(keys), chunk_size)
+
+    def commit(self):
+        if self._pooled:
+            future = Future()
+            future.set_result(None)
+            return future
+        return self.submit(self.collection.commit)
+
+    def _page(self, rowid, batch_size, keys_only):
+        ''' return (rowid, k, v) or (rowid, k) rows of the page, documents are
+        deserialized by the worker
         '''
-        if len(k) > MAX_KEY_LENGTH:
-            raise RuntimeError(
-                'The key length is more than %s bytes', MAX_KEY_LENGTH)
-        SQL = 'SELECT k,v FROM %s WHERE k = ?;' % self._collection
-        cursor = self.cursor()
-        try:
-            cursor.execute(SQL, (k,))
-        except Exception, err:
-            raise RuntimeError(err)
-        result = cursor.fetchone()
-        if result:
+        rows = self.collection._rows_after(rowid, batch_size, keys_only)
+        if keys_only:
+            return rows
+        page = list()
+        for rowid, k, v in rows:
             try:
-                v = self._serializer.loads(result[1])
+                page.append((rowid, k, self.collection._serializer.loads(v)))
             except Exception, err:
                 raise RuntimeError('key %s, %s' % (k, err))
-            return v
-        else:
-            return None
+        return page
 
-    def keys(self):
-        ''' return document keys in collection'''
-        rowid = 0
-        cursor = self.cursor()
-        while True:
-            SQL_SELECT_MANY = 'SELECT rowid, k FROM %s WHERE rowid > %d LIMIT 1000 ;'
-            SQL_SELECT_MANY %= (self._collection, rowid)
-            cursor.execute(SQL_SELECT_MANY)
-            result = cursor.fetchall()
-            if not result:
-                break
-            for r in result:
-                rowid = r[0]
-                yield r[1]
+    def _pages(self, batch_size, keys_only):
+        ''' return pages in rowid order, the next page is requested before
+        the current one is returned
+        '''
+        future = self.submit(self._page, 0, batch_size, keys_only)
+        while future is not None:
+            page = future.result()
+            future = None
+            if len(page) == batch_size:
+                future = self.submit(self._page, page[-1][0], batch_size, keys_only)
+            yield page
 
-    def delete(self, k):
-        ''' delete document by k '''
-        if len(k) > MAX_KEY_LENGTH:
-            raise RuntimeError(
-                'The key length is more than %s bytes' % MAX_KEY_LENGTH)
-        SQL_DELETE = '''DELETE FROM %s WHERE k = ?;''' % self._collection
-        self.cursor().execute(SQL_DELETE, (k,))
+    def items(self, batch_size=DEFAULT_BATCH_SIZE):
+        ''' return all docs, the pages are read ahead by workers '''
+        for page in self._pages(batch_size, False):
+            for _, k, v in page:
+                yield (k, v)
+
+    def keys(self, batch_size=DEFAULT_BATCH_SIZE):
+        ''' return document keys, the pages are read ahead by workers '''
+        for page in self._pages(batch_size, True):
+            for _, k in page:
+                yield k
 
     def close(self):
-        self._conn.close()
+        ''' wait for submitted calls, stop workers and close collection '''
+        self._executor.shutdown()
+        self.collection.close()
 
-    __getitem__ = get
     __iter__ = items
-    __setitem__ = put
-    __delitem__ = delete
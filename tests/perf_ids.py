@@ -0,0 +1,63 @@
+''' compare ID generators: IDs per second and speed of bulk inserts with such keys
+
+usage: python tests/perf_ids.py [uri]
+
+uuid - kvlite.get_uuid(), collection.get_uuid() - UUIDs from the collection
+(uuid() from database in case of mysql), id - time-ordered kvlite.get_id()
+'''
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import time
+
+import kvlite
+
+URI = 'sqlite://memory:kvlite_perf'
+AMOUNT = 100000
+DOCUMENTS = 100000
+BATCH_SIZE = 1000
+
+
+def generate(uri):
+    ''' return dict of generator name: IDs per second '''
+    collection = kvlite.open(uri)
+    generators = {
+        'uuid': lambda: kvlite.get_uuid(AMOUNT),
+        'collection.get_uuid': lambda: [collection.get_uuid() for _ in xrange(AMOUNT)],
+        'id': lambda: kvlite.get_ids(AMOUNT),
+    }
+    results = dict()
+    for name, generator in generators.items():
+        started = time.time()
+        generator()
+        results[name] = AMOUNT / (time.time() - started)
+    collection.close()
+    return results
+
+
+def insert(uri, keys):
+    ''' return documents per second for bulk insert with keys '''
+    collection = kvlite.open(uri)
+    document = {'name': 'John Smith', 'score': 87.5, 'tags': ['a', 'b', 'c']}
+    started = time.time()
+    for batch in kvlite.chunks(keys, BATCH_SIZE):
+        collection.put_many((k, document) for k in batch)
+        collection.commit()
+    result = len(keys) / (time.time() - started)
+    collection.close()
+    kvlite.remove(uri)
+    return result
+
+
+if __name__ == '__main__':
+
+    uri = sys.argv[1] if len(sys.argv) > 1 else URI
+    print '%-20s %14s' % ('generator', 'ids/sec')
+    for name, speed in sorted(generate(uri).items()):
+        print '%-20s %14.0f' % (name, speed)
+    print
+    print '%-20s %14s' % ('keys', 'inserts/sec')
+    for name, keys in (('uuid', kvlite.get_uuid(DOCUMENTS)), ('id', kvlite.get_ids(DOCUMENTS))):
+        print '%-20s %14.0f' % (name, insert(uri, keys))
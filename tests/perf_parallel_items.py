@@ -0,0 +1,46 @@
+''' compare items() and parallel_items() scan time
+
+usage: python tests/perf_parallel_items.py [sqlite-uri]
+'''
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import time
+import multiprocessing
+
+import kvlite
+
+from kvlite import CompressedJsonSerializer
+
+URI = 'sqlite:///tmp/kvlite_perf.sqlite:kvlite_perf'
+DOCUMENTS = 100000
+
+
+def run(uri):
+
+    collection = kvlite.open(uri, serializer=CompressedJsonSerializer)
+    if not collection.count:
+        collection.put_many(('key_%08d' % i, {'id': i, 'name': 'name_%d' % i, 'tags': range(20)})
+                            for i in xrange(DOCUMENTS))
+        collection.commit()
+    results = list()
+    for name, scan in (
+            ('items', lambda: collection.items()),
+            ('parallel ordered', lambda: collection.parallel_items()),
+            ('parallel unordered', lambda: collection.parallel_items(ordered=False))):
+        started = time.time()
+        count = sum(1 for _ in scan())
+        results.append((name, count, time.time() - started))
+    collection.close()
+    return results
+
+
+if __name__ == '__main__':
+
+    uri = sys.argv[1] if len(sys.argv) > 1 else URI
+    print 'workers: %d' % multiprocessing.cpu_count()
+    print '%-20s %12s %12s %14s' % ('scan', 'documents', 'sec', 'docs/sec')
+    for name, count, elapsed in run(uri):
+        print '%-20s %12d %12.2f %14.0f' % (name, count, elapsed, count / elapsed)
@@ -0,0 +1,58 @@
+''' compare serializers: dumps/loads speed and size of serialized documents
+
+usage: python tests/perf_serializers.py
+'''
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import time
+
+import kvlite
+
+from kvlite import SERIALIZERS
+from kvlite import CompressedSerializer
+from kvlite import BinaryPickleSerializer
+
+ROUNDS = 2000
+
+DOCUMENTS = {
+    'small': {'id': 12345, 'name': 'John Smith', 'active': True},
+    'record': {
+        'id': 12345, 'name': u'John Smith', 'email': 'john@example.com', 'score': 87.5,
+        'tags': ['python', 'mysql', 'sqlite', 'kvlite'], 'created': 1388534400,
+        'address': {'city': 'London', 'street': 'Baker Street', 'house': 221},
+    },
+    'list': [{'id': i, 'value': 'value_%d' % i, 'weight': i * 0.1} for i in range(100)],
+    'text': 'lorem ipsum dolor sit amet ' * 200,
+}
+
+COMPRESSED = {
+    'zlib_pickle_bin': CompressedSerializer(BinaryPickleSerializer, threshold=128, level=6),
+}
+
+
+def measure(serializer, document):
+    ''' return (size in bytes, dumps usec, loads usec) '''
+    data = serializer.dumps(document)
+    started = time.time()
+    for _ in xrange(ROUNDS):
+        serializer.dumps(document)
+    dumps_usec = (time.time() - started) * 1000000 / ROUNDS
+    started = time.time()
+    for _ in xrange(ROUNDS):
+        serializer.loads(data)
+    loads_usec = (time.time() - started) * 1000000 / ROUNDS
+    return len(data), dumps_usec, loads_usec
+
+
+if __name__ == '__main__':
+
+    print 'msgpack: %s' % ('package' if kvlite.msgpack is not None else 'pure-Python')
+    print '%-10s %-16s %10s %12s %12s' % ('document', 'serializer', 'bytes', 'dumps usec', 'loads usec')
+    for doc_name in sorted(DOCUMENTS):
+        serializers = dict(SERIALIZERS, **COMPRESSED)
+        for name in sorted(serializers):
+            size, dumps_usec, loads_usec = measure(serializers[name], DOCUMENTS[doc_name])
+            print '%-10s %-16s %10d %12.1f %12.1f' % (doc_name, name, size, dumps_usec, loads_usec)
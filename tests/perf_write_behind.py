@@ -0,0 +1,61 @@
+''' compare put() latency and total ingestion time of the collection and
+WriteBehindCollection in front of it
+
+usage: python tests/perf_write_behind.py [uri]
+
+direct - put() and commit every BATCH_SIZE writes, direct, commit=1 - put()
+and commit of every write (on COMMIT_DOCUMENTS documents), write-behind -
+put() to the buffer flushed by the background thread, total time includes
+close(). With local SQLite and batched commits put() is already fast and the
+flusher competes with it for the same CPU (GIL), so the buffer gains only
+when every direct write waits for a commit or a network round trip (MySQL)
+'''
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import time
+
+import kvlite
+
+from kvlite import WriteBehindCollection
+
+URI = 'sqlite:///tmp/kvlite_perf.sqlite:kvlite_perf'
+DOCUMENTS = 100000
+BATCH_SIZE = 1000
+COMMIT_DOCUMENTS = 5000
+
+
+def ingest(collection, keys):
+    ''' return (avg put usec, p99 put usec, max put usec, total seconds) '''
+    document = {'event': 'click', 'url': '/index.html', 'ts': 1388534400}
+    latencies = list()
+    started = time.time()
+    for k in keys:
+        put_started = time.time()
+        collection.put(k, document)
+        latencies.append(time.time() - put_started)
+    collection.close()
+    total = time.time() - started
+    latencies.sort()
+    return (sum(latencies) * 1000000 / len(latencies), latencies[len(latencies) * 99 / 100] * 1000000,
+            latencies[-1] * 1000000, total)
+
+
+if __name__ == '__main__':
+
+    uri = sys.argv[1] if len(sys.argv) > 1 else URI
+    keys = kvlite.get_ids(DOCUMENTS)
+    print '%-16s %10s %10s %10s %10s' % ('mode', 'avg usec', 'p99 usec', 'max usec', 'total sec')
+    kvlite.remove(uri)
+    result = ingest(kvlite.open(uri, commit_every=BATCH_SIZE), keys)
+    print '%-16s %10.1f %10.1f %10.0f %10.2f' % (('direct',) + result)
+    kvlite.remove(uri)
+    result = ingest(kvlite.open(uri, commit_every=1), keys[:COMMIT_DOCUMENTS])
+    print '%-16s %10.1f %10.1f %10.0f %10.2f' % (('direct, commit=1',) + result)
+    kvlite.remove(uri)
+    result = ingest(WriteBehindCollection(kvlite.open(uri), max_entries=10 * BATCH_SIZE,
+                                          flush_size=BATCH_SIZE), keys)
+    print '%-16s %10.1f %10.1f %10.0f %10.2f' % (('write-behind',) + result)
+    kvlite.remove(uri)
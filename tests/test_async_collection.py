@@ -0,0 +1,103 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import time
+import threading
+import unittest
+
+import kvlite
+
+from kvlite import Future
+from kvlite import Executor
+from kvlite import AsyncCollection
+
+
+class KvliteExecutorTests(unittest.TestCase):
+
+    def test_submit(self):
+
+        executor = Executor(max_workers=2)
+        futures = [executor.submit(lambda x: x * 2, i) for i in range(10)]
+        self.assertEqual([f.result() for f in futures], [i * 2 for i in range(10)])
+        future = executor.submit(int, 'x')
+        self.assertTrue(isinstance(future.exception(), ValueError))
+        self.assertRaises(ValueError, future.result)
+        executor.shutdown()
+        self.assertRaises(RuntimeError, executor.submit, int, '1')
+
+    def test_bounded_queue(self):
+
+        executor = Executor(max_workers=1, max_queue=1)
+        event = threading.Event()
+        executor.submit(event.wait)
+        executor.submit(int, '1')
+        submitted = list()
+        thread = threading.Thread(target=lambda: submitted.append(executor.submit(int, '2')))
+        thread.start()
+        time.sleep(0.1)
+        self.assertEqual(submitted, [])
+        event.set()
+        thread.join()
+        self.assertEqual(submitted[0].result(), 2)
+        executor.shutdown()
+
+    def test_future(self):
+
+        future = Future()
+        results = list()
+        future.add_done_callback(lambda f: results.append(f.result()))
+        self.assertFalse(future.done())
+        self.assertRaises(RuntimeError, future.result, 0.01)
+        future.set_result(1)
+        future.add_done_callback(lambda f: results.append(f.result() + 1))
+        self.assertTrue(future.done())
+        self.assertEqual(results, [1, 2])
+
+
+class KvliteAsyncCollectionTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.collection = AsyncCollection(kvlite.open('sqlite://memory:test'), max_workers=4)
+
+    def tearDown(self):
+
+        self.collection.close()
+
+    def test_get_put_delete(self):
+
+        futures = [self.collection.put('key_%03d' % i, {'i': i}) for i in range(100)]
+        for future in futures:
+            self.assertEqual(future.result(), None)
+        self.assertEqual(self.collection.commit().result(), None)
+
+        futures = [self.collection.get('key_%03d' % i) for i in range(100)]
+        self.assertEqual([f.result() for f in futures], [{'i': i} for i in range(100)])
+        self.assertEqual(self.collection.count().result(), 100)
+        self.assertEqual(self.collection.get('missing', 'default').result(), 'default')
+
+        self.collection.delete('key_000').result()
+        self.assertEqual(self.collection.get('key_000').result(), None)
+        self.assertRaises(RuntimeError, self.collection.get('k' * 300).result)
+
+    def test_many(self):
+
+        data = dict(('key_%03d' % i, i) for i in range(100))
+        self.collection.put_many(data).result()
+        self.assertEqual(self.collection.get_many(data.keys()).result(), data)
+        self.collection.delete_many(['key_%03d' % i for i in range(50)]).result()
+        self.assertEqual(self.collection.count().result(), 50)
+
+    def test_items_keys(self):
+
+        keys = ['key_%03d' % i for i in range(25)]
+        self.collection.put_many((k, k.upper()) for k in keys).result()
+        self.assertEqual(list(self.collection.items(batch_size=10)), [(k, k.upper()) for k in keys])
+        self.assertEqual(list(self.collection.keys(batch_size=5)), keys)
+        self.assertEqual(list(self.collection), [(k, k.upper()) for k in keys])
+
+
+if __name__ == '__main__':
+    unittest.main()
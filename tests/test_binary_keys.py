@@ -0,0 +1,102 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import unittest
+
+import kvlite
+
+from kvlite import SqliteCollectionManager
+
+
+class KvliteBinaryKeysTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.manager = SqliteCollectionManager('sqlite://memory:test')
+        self.manager.create('test', key_type='binary')
+        self.collection = self.manager.collection_class(self.manager, 'test')
+        self.keys = sorted('%032x' % (i * 7919) for i in range(1, 51))
+
+    def tearDown(self):
+
+        self.manager.close()
+
+    def test_key_type(self):
+
+        self.assertEqual(self.manager.key_type('test'), ('binary', 16))
+        self.manager.create('var', key_type='varbinary', key_size=20)
+        self.assertEqual(self.manager.key_type('var'), ('varbinary', 20))
+        self.manager.create('text')
+        self.assertEqual(self.manager.key_type('text'), ('str', None))
+        self.assertRaises(RuntimeError, self.manager.create, 'bad', key_type='blob')
+        self.assertRaises(RuntimeError, self.manager.create, 'bad', key_type='binary', key_size=128)
+
+    def test_get_put_delete(self):
+
+        k = self.keys[0]
+        self.collection.put(k, {'a': 1})
+        self.assertEqual(self.collection.get(k), {'a': 1})
+        self.assertRaises(RuntimeError, self.collection.get, k.upper())
+        self.assertTrue(k in self.collection)
+        self.assertFalse(self.keys[1] in self.collection)
+        self.assertEqual(list(self.collection.keys()), [k])
+        raw = self.collection._fetchall('SELECT k FROM test;')[0][0]
+        self.assertEqual(len(raw), 16)
+        self.collection.delete(k)
+        self.assertEqual(self.collection.get(k), None)
+
+    def test_incorrect_keys(self):
+
+        self.assertRaises(RuntimeError, self.collection.put, 'key', 1)
+        self.assertRaises(RuntimeError, self.collection.put, 'abc', 1)
+        self.assertRaises(RuntimeError, self.collection.put, 'ab' * 15, 1)
+        self.assertRaises(RuntimeError, self.collection.get, 'ab' * 17)
+        self.assertRaises(RuntimeError, self.collection.put_many, [('ab', 1)])
+        self.assertRaises(RuntimeError, self.collection.put, ('ab' * 16).upper(), 1)
+
+    def test_varbinary(self):
+
+        self.manager.create('var', key_type='varbinary', key_size=20)
+        collection = self.manager.collection_class(self.manager, 'var')
+        collection.put_many([('ab', 1), ('ab' * 20, 2)])
+        self.assertEqual(collection.get_many(['ab', 'ab' * 20]), {'ab': 1, 'ab' * 20: 2})
+        self.assertRaises(RuntimeError, collection.put, 'ab' * 21, 3)
+
+    def test_many_and_scan(self):
+
+        self.collection.put_many((k, i) for i, k in enumerate(self.keys))
+        self.assertEqual(self.collection.count, 50)
+        self.assertEqual(self.collection.get_many(self.keys[:5]), dict((k, i) for i, k in enumerate(self.keys[:5])))
+        self.assertEqual(self.collection.exists_many([self.keys[0], 'ff' * 16]), set([self.keys[0]]))
+        self.assertEqual(list(self.collection.scan(keys_only=True, batch_size=7)), self.keys)
+        self.assertEqual(list(self.collection.scan(keys_only=True, reverse=True)), self.keys[::-1])
+        self.assertEqual(list(self.collection.scan(start=self.keys[10], end=self.keys[13], keys_only=True)),
+                         self.keys[10:13])
+        for prefix in (self.keys[20][:-4], self.keys[20][:-5], '', 'f'):
+            self.assertEqual(list(self.collection.scan(prefix=prefix, keys_only=True)),
+                             [k for k in self.keys if k.startswith(prefix)])
+        self.assertEqual(list(self.collection.items(stream=True)), [(k, i) for i, k in enumerate(self.keys)])
+        self.collection.delete_many(self.keys[:25])
+        self.assertEqual(list(self.collection.keys(batch_size=10)), self.keys[25:])
+
+    def test_indexes(self):
+
+        self.collection.put_many((k, {'i': i % 5}) for i, k in enumerate(self.keys))
+        self.collection.create_index('i', 'int')
+        self.assertEqual([k for k, _ in self.collection.find('i', 3)], self.keys[3::5])
+        self.collection.delete(self.keys[3])
+        self.assertEqual([k for k, _ in self.collection.find('i', 3)], self.keys[8::5])
+
+    def test_open(self):
+
+        collection = kvlite.open('sqlite://memory:test', key_type='varbinary', key_size=8)
+        collection.put('0102', 'value')
+        self.assertEqual(list(collection.items()), [('0102', 'value')])
+        self.assertEqual(collection._manager.key_type('test'), ('varbinary', 8))
+        collection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import unittest
+
+from kvlite import BloomFilter
+from kvlite import SqliteCollectionManager
+
+
+class KvliteBloomFilterTests(unittest.TestCase):
+
+    def test_bloom_filter(self):
+
+        bloom = BloomFilter(1000, 0.01)
+        keys = ['key_%d' % i for i in range(1000)]
+        bloom.update(keys)
+        for k in keys:
+            self.assertIn(k, bloom)
+        false_positives = sum(1 for i in range(10000) if 'absent_%d' % i in bloom)
+        self.assertTrue(false_positives < 300)
+        bloom.add(u'\u043a\u043b\u044e\u0447')
+        self.assertIn(u'\u043a\u043b\u044e\u0447', bloom)
+
+    def test_parameters(self):
+
+        self.assertRaises(RuntimeError, BloomFilter, 0)
+        self.assertRaises(RuntimeError, BloomFilter, 10, 1.5)
+        bloom = BloomFilter(1000, 0.01)
+        self.assertEqual(bloom.hashes, 7)
+        self.assertEqual(bloom.size, 9586)
+
+
+class KvliteCollectionBloomFilterTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.manager = SqliteCollectionManager('sqlite://memory:test')
+        self.manager.create('test')
+        self.collection = self.manager.collection_class(self.manager, 'test')
+        self.queries = 0
+        cursor = self.collection.cursor
+
+        def counting_cursor():
+            self.queries += 1
+            return cursor()
+        self.collection.cursor = counting_cursor
+
+    def tearDown(self):
+
+        self.manager.close()
+
+    def test_exists(self):
+
+        self.collection.put_many(('key_%d' % i, i) for i in range(100))
+        self.assertTrue(self.collection.exists('key_1'))
+        self.assertTrue('key_99' in self.collection)
+        self.assertFalse(self.collection.exists('absent'))
+        self.assertEqual(self.collection.exists_many(['key_1', 'absent', 'key_2']), set(['key_1', 'key_2']))
+        self.assertEqual(self.collection.exists_many([]), set())
+
+    def test_exists_with_bloom_filter(self):
+
+        self.collection.put_many(('key_%d' % i, i) for i in range(100))
+        self.collection.enable_bloom_filter()
+        self.collection.put('new_key', 1)
+        self.collection.put_many([('new_key_2', 2)])
+
+        self.queries = 0
+        absent = ['absent_%d' % i for i in range(100)]
+        self.assertEqual(sum(1 for k in absent if self.collection.exists(k)), 0)
+        self.assertTrue(self.queries < 10)
+        self.assertEqual(self.collection.exists_many(absent), set())
+        self.assertTrue(self.collection.exists('key_5'))
+        self.assertTrue(self.collection.exists('new_key'))
+        self.assertEqual(self.collection.exists_many(['new_key_2', 'key_7', 'absent']),
+                         set(['new_key_2', 'key_7']))
+
+        # deleted key is in the filter, but not in collection
+        self.collection.delete('key_5')
+        self.assertFalse(self.collection.exists('key_5'))
+
+        self.collection.disable_bloom_filter()
+        self.queries = 0
+        self.assertFalse(self.collection.exists('absent_1'))
+        self.assertEqual(self.queries, 1)
+
+    def test_put_during_bloom_filter_build(self):
+
+        self.collection.put_many(('key_%d' % i, i) for i in range(10))
+        keys = self.collection.keys
+
+        def keys_with_put():
+            for i, k in enumerate(keys()):
+                if i == 5:
+                    self.assertFalse(self.collection.exists('absent'))
+                    self.collection.put('concurrent_key', 1)
+                yield k
+
+        self.collection.keys = keys_with_put
+        self.collection.enable_bloom_filter()
+        del self.collection.keys
+        self.assertTrue(self.collection.exists('concurrent_key'))
+        self.assertTrue(self.collection.exists('key_9'))
+
+        self.queries = 0
+        self.assertFalse(self.collection.exists('absent_1'))
+        self.assertEqual(self.queries, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
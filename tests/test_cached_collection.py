@@ -0,0 +1,149 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import unittest
+
+import kvlite
+
+from kvlite import LRUCache
+from kvlite import CachedCollection
+from kvlite import ShardedCollection
+from kvlite import WriteBehindCollection
+from kvlite import SqliteCollectionManager
+
+
+class KvliteLRUCacheTests(unittest.TestCase):
+
+    def test_max_entries(self):
+
+        cache = LRUCache(max_entries=2)
+        cache.set('a', 1, 10)
+        cache.set('b', 2, 10)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3, 10)
+        self.assertNotIn('b', cache)
+        self.assertIn('a', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(cache.stats(),
+            {'entries': 2, 'bytes': 20, 'hits': 1, 'misses': 0, 'evictions': 1})
+
+    def test_max_bytes(self):
+
+        cache = LRUCache(max_bytes=100)
+        cache.set('a', 1, 60)
+        cache.set('b', 2, 60)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.size, 60)
+        cache.set('c', 3, 200)
+        self.assertNotIn('c', cache)
+        self.assertEqual(cache.get('a'), None)
+        self.assertEqual(cache.misses, 1)
+
+    def test_discard(self):
+
+        cache = LRUCache()
+        cache.set('a', 1, 10)
+        cache.discard('a')
+        cache.discard('b')
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.size, 0)
+
+
+class KvliteCachedCollectionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = SqliteCollectionManager('sqlite://memory')
+        self.manager.create('kvlite_test')
+        collection = self.manager.collection_class(self.manager, 'kvlite_test')
+        self.collection = CachedCollection(collection, max_entries=100)
+
+    def tearDown(self):
+        self.collection.close()
+
+    def test_get_put_delete(self):
+
+        self.collection.put('a', {'value': 1})
+        self.assertEqual(self.collection.get('a'), {'value': 1})
+        self.assertEqual(self.collection.get('a'), {'value': 1})
+        self.assertEqual(self.collection.cache_stats()['hits'], 1)
+        self.assertEqual(self.collection.cache_stats()['misses'], 1)
+
+        self.collection['a'] = {'value': 2}
+        self.assertEqual(self.collection['a'], {'value': 2})
+
+        del self.collection['a']
+        self.assertEqual(self.collection.get('a'), None)
+        self.assertEqual(self.collection.get('a', 'default'), 'default')
+
+    def test_many(self):
+
+        kvs = dict(('key_{0}'.format(i), i) for i in xrange(10))
+        self.collection.put_many(kvs)
+        self.assertEqual(self.collection.get('key_0'), 0)
+        self.assertEqual(self.collection.get_many(kvs.keys() + ['absent']), kvs)
+        self.assertEqual(self.collection.cache_stats()['entries'], 10)
+        self.assertEqual(self.collection.get_many(kvs.keys()), kvs)
+        self.assertEqual(self.collection.cache_stats()['hits'], 11)
+
+        self.collection.delete_many(kvs.keys())
+        self.assertEqual(self.collection.get_many(kvs.keys()), {})
+        self.assertEqual(self.collection.count, 0)
+
+    def test_put_during_load(self):
+
+        self.collection.put('a', 1)
+        collection = self.collection.collection
+        get_raw = collection._get_raw
+
+        def get_raw_with_put(k):
+            raw = get_raw(k)
+            self.collection.put(k, 2)
+            return raw
+
+        collection._get_raw = get_raw_with_put
+        self.assertEqual(self.collection.get('a'), 1)
+        del collection._get_raw
+        self.assertEqual(self.collection.get('a'), 2)
+        self.assertTrue(self.collection.exists('a') is True)
+        self.assertTrue(self.collection.exists('b') is False)
+
+
+
+class KvliteCachedWrappersTests(unittest.TestCase):
+
+    def test_sharded_collection(self):
+
+        sharded = ShardedCollection(dict(
+            (name, kvlite.open('sqlite://memory:%s' % name)) for name in ('a', 'b')))
+        collection = CachedCollection(sharded, max_entries=100)
+        collection.put_many(('key_%d' % i, i) for i in range(10))
+        self.assertEqual(collection.get('key_1'), 1)
+        self.assertEqual(collection.get('key_1'), 1)
+        self.assertEqual(collection.get('absent', 'default'), 'default')
+        self.assertEqual(collection.get_many(['key_2', 'key_3', 'absent']), {'key_2': 2, 'key_3': 3})
+        self.assertEqual(collection.cache_stats()['entries'], 3)
+        self.assertRaises(RuntimeError, CachedCollection, sharded, max_bytes=1000)
+        collection.close()
+
+    def test_write_behind_collection(self):
+
+        manager = SqliteCollectionManager('sqlite://memory')
+        manager.create('kvlite_test')
+        buffered = WriteBehindCollection(manager.collection_class(manager, 'kvlite_test'),
+                                         flush_interval=60)
+        collection = CachedCollection(buffered, max_entries=100)
+        collection.put('x', 42)
+        self.assertEqual(collection.get('x'), 42)
+        collection.put('y', 43)
+        self.assertEqual(collection.get_many(['y', 'absent']), {'y': 43})
+        collection.delete('x')
+        self.assertEqual(collection.get('x'), None)
+        buffered.flush()
+        self.assertEqual(collection.get_many(['x', 'y']), {'y': 43})
+        collection.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
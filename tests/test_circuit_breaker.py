@@ -0,0 +1,87 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import time
+import unittest
+
+from kvlite import backoff
+from kvlite import CircuitBreaker
+from kvlite import CircuitBreakerOpen
+from kvlite import MysqlCollectionManager
+
+
+class KvliteCircuitBreakerTests(unittest.TestCase):
+
+    def test_open_after_failures(self):
+
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.before_call()
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.before_call()
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertRaises(CircuitBreakerOpen, breaker.before_call)
+        self.assertRaises(RuntimeError, breaker.before_call)
+
+    def test_success_resets_failures(self):
+
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.failure()
+        breaker.success()
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open(self):
+
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        time.sleep(0.06)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+
+        # only one probe is allowed in half-open state
+        breaker.before_call()
+        self.assertRaises(CircuitBreakerOpen, breaker.before_call)
+        breaker.failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        time.sleep(0.06)
+        breaker.before_call()
+        breaker.success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.before_call()
+
+    def test_probe_error_ends_half_open(self):
+
+        # the manager without MySQL: only the reconnection logic
+        manager = MysqlCollectionManager.__new__(MysqlCollectionManager)
+        manager.uri = 'mysql://localhost/test'
+        manager.reconnect_deadline = 0
+        manager.backoff_initial = manager.backoff_max = 0
+        manager.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+
+        def connect():
+            raise ValueError('incorrect option')
+
+        manager._connect = connect
+        manager.breaker.failure()
+        self.assertEqual(manager.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertRaises(Exception, manager._connect_with_retry)
+        # the next probe is allowed
+        manager.breaker.before_call()
+
+    def test_backoff(self):
+
+        delays = backoff(0.1, 0.4)
+        limits = [0.1, 0.2, 0.4, 0.4, 0.4]
+        for limit in limits:
+            delay = next(delays)
+            self.assertTrue(0 <= delay <= limit)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import sqlite3
+import threading
+import time
+import unittest
+
+from kvlite import ConnectionPool, PooledMysqlCollectionManager
+
+
+def connect():
+    return sqlite3.connect(':memory:', check_same_thread=False)
+
+
+class KvliteConnectionPoolTests(unittest.TestCase):
+
+    def test_min_max_size(self):
+
+        pool = ConnectionPool(connect, min_size=2, max_size=3, timeout=0.1)
+        self.assertEqual(pool.size, 2)
+        self.assertEqual(pool.idle, 2)
+
+        conns = [pool.acquire() for _ in range(3)]
+        self.assertEqual(pool.size, 3)
+        self.assertEqual(len(set(conns)), 3)
+        self.assertRaises(RuntimeError, pool.acquire)
+
+        pool.release(conns.pop())
+        self.assertEqual(pool.idle, 1)
+        conns.append(pool.acquire())
+        self.assertEqual(pool.size, 3)
+        for conn in conns:
+            pool.release(conn)
+        pool.close()
+        self.assertEqual(pool.size, 0)
+        self.assertRaises(RuntimeError, pool.acquire)
+
+    def test_wrong_sizes(self):
+
+        self.assertRaises(RuntimeError, ConnectionPool, connect, 2, 1)
+
+    def test_wait_for_connection(self):
+
+        pool = ConnectionPool(connect, min_size=1, max_size=1, timeout=5)
+        conn = pool.acquire()
+        result = list()
+
+        def worker():
+            result.append(pool.acquire())
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        pool.release(conn)
+        thread.join()
+        self.assertEqual(result, [conn])
+
+    def test_health_check(self):
+
+        broken = list()
+
+        def check(conn):
+            return conn not in broken
+
+        pool = ConnectionPool(connect, min_size=1, max_size=1, check=check)
+        conn = pool.acquire()
+        pool.release(conn)
+        broken.append(conn)
+        new_conn = pool.acquire()
+        self.assertNotEqual(conn, new_conn)
+        self.assertEqual(pool.size, 1)
+
+        pool.discard(new_conn)
+        self.assertEqual(pool.size, 0)
+
+    def pooled_manager(self, pool):
+        # the manager without MySQL: only the binding of pooled connections
+        manager = PooledMysqlCollectionManager.__new__(PooledMysqlCollectionManager)
+        manager._local = threading.local()
+        manager.pool = pool
+        return manager
+
+    def test_release_on_thread_exit(self):
+
+        pool = ConnectionPool(connect, min_size=1, max_size=1, timeout=0.1)
+        manager = self.pooled_manager(pool)
+
+        def writer():
+            manager.acquire()
+            manager.cursor().execute('SELECT 1;')
+            manager.release(keep=True)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        thread.join()
+        # thread-local data is dropped right after join()
+        deadline = time.time() + 1
+        while not pool.idle and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(pool.idle, 1)
+
+    def test_cursor_without_acquire(self):
+
+        manager = self.pooled_manager(ConnectionPool(connect, min_size=1, max_size=1))
+        self.assertRaises(RuntimeError, manager.cursor)
+        manager.acquire()
+        manager.cursor()
+        manager.release()
+        self.assertEqual(manager.pool.idle, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
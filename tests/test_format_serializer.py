@@ -0,0 +1,99 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import unittest
+
+from kvlite import FORMAT_MAGIC
+from kvlite import ReencodeJob
+from kvlite import FormatSerializer
+from kvlite import MarshalSerializer
+from kvlite import cPickleSerializer
+from kvlite import BinaryPickleSerializer
+from kvlite import CompressedJsonSerializer
+from kvlite import SqliteCollectionManager
+
+
+class KvliteFormatSerializerTests(unittest.TestCase):
+
+    def test_dumps_loads(self):
+
+        serializer = FormatSerializer(MarshalSerializer)
+        data = serializer.dumps({'a': 1})
+        self.assertEqual(data[:2], FORMAT_MAGIC + '\x04')
+        self.assertEqual(serializer.loads(data), {'a': 1})
+        self.assertTrue(serializer.is_current(data))
+
+        # other formats and values without header
+        self.assertEqual(serializer.loads(FormatSerializer(BinaryPickleSerializer).dumps([1])), [1])
+        self.assertEqual(serializer.loads(cPickleSerializer.dumps((1, 2))), (1, 2))
+        self.assertFalse(serializer.is_current(cPickleSerializer.dumps((1, 2))))
+
+        serializer = FormatSerializer(MarshalSerializer, legacy=CompressedJsonSerializer)
+        self.assertEqual(serializer.loads(CompressedJsonSerializer.dumps([1])), [1])
+
+    def test_errors(self):
+
+        self.assertRaises(RuntimeError, FormatSerializer, object())
+        self.assertRaises(RuntimeError, FormatSerializer().loads, FORMAT_MAGIC + '\xff')
+        self.assertRaises(RuntimeError, FormatSerializer(legacy=None).loads, cPickleSerializer.dumps(1))
+
+
+class KvliteReencodeTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.manager = SqliteCollectionManager('sqlite://memory:test')
+        self.manager.create('test')
+        self.serializer = FormatSerializer(MarshalSerializer)
+
+    def tearDown(self):
+
+        self.manager.close()
+
+    def test_reencode(self):
+
+        old = self.manager.collection_class(self.manager, 'test', cPickleSerializer)
+        old.put_many(('key_%03d' % i, {'i': i}) for i in xrange(25))
+        old.commit()
+
+        collection = self.manager.collection_class(self.manager, 'test', self.serializer)
+        collection.put('key_000', {'i': 'new'})
+        self.assertEqual(collection.get('key_001'), {'i': 1})
+        self.assertEqual(collection.reencode(batch_size=7), 24)
+        self.assertEqual(collection.reencode(), 0)
+        for _, k, v in collection._rows_after(0, 100):
+            self.assertTrue(self.serializer.is_current(v))
+        self.assertEqual(collection.get('key_000'), {'i': 'new'})
+        self.assertEqual(dict(collection.items()), dict(
+            [('key_%03d' % i, {'i': i}) for i in xrange(1, 25)] + [('key_000', {'i': 'new'})]))
+        self.assertRaises(RuntimeError, old.reencode)
+
+    def test_reencode_step_and_resume(self):
+
+        old = self.manager.collection_class(self.manager, 'test', cPickleSerializer)
+        old.put_many(('key_%03d' % i, i) for i in xrange(10))
+        collection = self.manager.collection_class(self.manager, 'test', self.serializer)
+        job = collection.reencode(background=True, batch_size=4)
+        self.assertTrue(isinstance(job, ReencodeJob))
+        self.assertEqual(job.step(), 4)
+        self.assertFalse(job.done)
+
+        job = ReencodeJob(collection, batch_size=4, rowid=job.rowid)
+        job.start().join()
+        self.assertTrue(job.done)
+        self.assertEqual(job.reencoded, 6)
+
+    def test_changed_document_is_not_replaced(self):
+
+        old = self.manager.collection_class(self.manager, 'test', cPickleSerializer)
+        old.put('key', 1)
+        collection = self.manager.collection_class(self.manager, 'test', self.serializer)
+        stale = cPickleSerializer.dumps(0)
+        self.assertEqual(collection._replace_raw([('key', stale, self.serializer.dumps(0))]), 0)
+        self.assertEqual(collection.get('key'), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,188 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import time
+import unittest
+
+from kvlite import Index
+from kvlite import SqliteCollectionManager
+
+
+class KvliteIndexTests(unittest.TestCase):
+
+    def test_index(self):
+
+        index = Index('docs', 'user_id', 'int')
+        self.assertEqual(index.table, 'docs__index__user_id')
+        self.assertEqual(index.value({'user_id': '10'}), 10)
+        self.assertEqual(index.value({'user_id': 'abc'}), None)
+        self.assertEqual(index.value({'name': 'abc'}), None)
+        self.assertEqual(index.value('abc'), None)
+        self.assertRaises(RuntimeError, index.convert, 'abc')
+
+        index = Index('docs', 'name')
+        self.assertEqual(index.value({'name': 'a' * 255}), 'a' * 255)
+        self.assertRaises(RuntimeError, index.value, {'name': 'a' * 256})
+        self.assertRaises(RuntimeError, index.convert, 'a' * 256)
+
+    def test_incorrect_index(self):
+
+        self.assertRaises(RuntimeError, Index, 'docs', 'user id')
+        self.assertRaises(RuntimeError, Index, 'docs', 'user_id', 'float')
+
+
+class KvliteSqliteIndexesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = SqliteCollectionManager('sqlite://memory')
+        self.manager.create('docs')
+        self.collection = self.manager.collection_class(self.manager, 'docs')
+        self.collection.put_many(
+            ('doc_%02d' % i, {'user_id': i % 3, 'name': 'name_%02d' % i}) for i in xrange(30))
+        self.collection.put('no_user', {'name': 'nobody'})
+        self.collection.put('not_dict', 'string')
+        self.collection.commit()
+
+    def tearDown(self):
+        self.collection.close()
+
+    def test_create_index(self):
+
+        self.collection.create_index('user_id', 'int')
+        self.assertEqual(self.collection.indexes(), ['user_id'])
+        self.assertEqual(self.manager.collections(), ['docs'])
+        self.assertIn('docs__index__user_id', self.manager.tables())
+        self.manager.create('user__profiles')
+        self.assertEqual(self.manager.collections(), ['docs', 'user__profiles'])
+
+        found = list(self.collection.find('user_id', 1, batch_size=4))
+        self.assertEqual([k for k, _ in found], ['doc_%02d' % i for i in xrange(1, 30, 3)])
+        self.assertEqual(found[0][1], {'user_id': 1, 'name': 'name_01'})
+
+        collection = self.manager.collection_class(self.manager, 'docs')
+        self.assertEqual(collection.indexes(), ['user_id'])
+
+    def test_maintain_index(self):
+
+        self.collection.create_index('name')
+        self.collection.put('doc_00', {'name': 'new_name'})
+        self.collection.put_many([('doc_01', {'user_id': 1}), ('doc_02', {'name': 'new_name'})])
+        self.collection.delete('doc_03')
+        self.collection.delete_many(['doc_04', 'doc_05'])
+
+        self.assertEqual([k for k, _ in self.collection.find('name', 'new_name')], ['doc_00', 'doc_02'])
+        self.assertEqual(list(self.collection.find('name', 'name_01')), [])
+        self.assertEqual(list(self.collection.find('name', 'name_03')), [])
+        self.assertEqual(list(self.collection.find('name', 'name_05')), [])
+        self.assertEqual(list(self.collection.find('name', 'nobody')), [('no_user', {'name': 'nobody'})])
+
+        self.assertRaises(RuntimeError, self.collection.put, 'long', {'name': 'a' * 256})
+        self.assertRaises(RuntimeError, self.collection.put_many, [('long', {'name': 'a' * 256})])
+        self.assertFalse(self.collection.exists('long'))
+
+    def test_find_range(self):
+
+        self.collection.create_index('name')
+        found = list(self.collection.find_range('name', 'name_10', 'name_20', batch_size=3))
+        self.assertEqual([k for k, _ in found], ['doc_%02d' % i for i in xrange(10, 20)])
+
+        found = list(self.collection.find_range('name', 'name_25', 'nobody', reverse=True, limit=3))
+        self.assertEqual([k for k, _ in found], ['doc_29', 'doc_28', 'doc_27'])
+        found = self.collection.find('name', 'name_01')
+        self.assertEqual(next(found), ('doc_01', {'user_id': 1, 'name': 'name_01'}))
+        self.assertEqual(list(found), [])
+
+        self.collection.create_index('user_id', 'int')
+        found = list(self.collection.find_range('user_id', 1, batch_size=4))
+        self.assertEqual(len(found), 20)
+        self.assertEqual(found[0][0], 'doc_01')
+        self.assertEqual(found[-1][0], 'doc_29')
+
+    def test_background_backfill(self):
+
+        backfill = self.collection.create_index('user_id', 'int', background=True, batch_size=8)
+        self.assertFalse(backfill.done)
+        self.assertFalse(self.manager.index('docs', 'user_id').ready)
+
+        # not ready index is maintained by writes, queries scan the collection
+        self.collection.put('doc_new', {'user_id': 1})
+        found = [k for k, _ in self.collection.find('user_id', 1)]
+        self.assertEqual(found, ['doc_%02d' % i for i in xrange(1, 30, 3)] + ['doc_new'])
+
+        self.assertEqual(backfill.step(), 8)
+        self.assertEqual(self.manager.index('docs', 'user_id').checkpoint, 8)
+
+        # resume from saved checkpoint by new backfill
+        collection = self.manager.collection_class(self.manager, 'docs')
+        backfill = collection.create_index('user_id', 'int', background=True, batch_size=8)
+        self.assertEqual(backfill.index.checkpoint, 8)
+        backfill.start().join()
+        self.assertTrue(backfill.done)
+        self.assertTrue(self.manager.index('docs', 'user_id').ready)
+
+        found = [k for k, _ in self.collection.find('user_id', 1)]
+        self.assertEqual(found, ['doc_%02d' % i for i in xrange(1, 30, 3)] + ['doc_new'])
+        self.assertTrue(self.collection._indexes['user_id'].ready)
+
+    def test_backfill_keeps_concurrent_writes(self):
+
+        backfill = self.collection.create_index('user_id', 'int', background=True)
+        rows_after = self.collection._rows_after
+
+        def rows_after_with_put(*args):
+            rows = rows_after(*args)
+            self.collection.put('doc_00', {'user_id': 10})
+            return rows
+
+        self.collection._rows_after = rows_after_with_put
+        backfill.step()
+        del self.collection._rows_after
+        self.assertTrue(backfill.done)
+        self.assertEqual([k for k, _ in self.collection.find('user_id', 10)], ['doc_00'])
+        self.assertEqual([k for k, _ in self.collection.find('user_id', 0)],
+                         ['doc_%02d' % i for i in xrange(3, 30, 3)])
+
+    def test_find_range_by_scan(self):
+
+        self.collection.create_index('name', background=True)
+        found = list(self.collection.find_range('name', 'name_25', 'nobody', reverse=True, limit=3))
+        self.assertEqual([k for k, _ in found], ['doc_29', 'doc_28', 'doc_27'])
+
+    def test_backfill_throttling(self):
+
+        backfill = self.collection.create_index(
+            'name', background=True, batch_size=10, rows_per_second=100)
+        started = time.time()
+        backfill.run()
+        self.assertTrue(time.time() - started >= 0.3)
+        self.assertTrue(backfill.done)
+
+    def test_stale_index_rows_are_skipped(self):
+
+        self.collection.create_index('name')
+        cursor = self.collection.cursor()
+        cursor.execute("UPDATE docs__index__name SET v = 'stale' WHERE k = 'doc_01';")
+        self.assertEqual(list(self.collection.find('name', 'stale')), [])
+
+    def test_drop_index(self):
+
+        self.collection.create_index('name')
+        self.collection.drop_index('name')
+        self.assertEqual(self.collection.indexes(), [])
+        self.assertNotIn('docs__index__name', self.manager.tables())
+        self.assertRaises(RuntimeError, self.collection.find, 'name', 'name_01')
+        self.assertRaises(RuntimeError, self.collection.drop_index, 'name')
+        self.collection.put('doc_00', {'name': 'name_00'})
+
+    def test_remove_collection(self):
+
+        self.collection.create_index('name')
+        self.manager.remove('docs')
+        self.assertNotIn('docs__index__name', self.manager.tables())
+        self.assertEqual(self.manager.indexes('docs'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,7 @@ sys.path.append('..')
 
 import kvlite
 import unittest
+import threading
 
 from kvlite import MysqlCollection
 from kvlite import MysqlCollectionManager
@@ -72,12 +73,199 @@ class KvliteMysqlTests(unittest.TestCase):
         self.assertEqual(self.collection.count, 0)
         self.collection.commit()
 
+    def test_put_get_delete_many(self):
+
+        kvs = dict(('key_{}'.format(i), 'value_{}'.format(i)) for i in xrange(1200))
+        self.collection.put_many(kvs)
+        self.assertEqual(self.collection.count, 1200)
+
+        result = self.collection.get_many(kvs.keys() + ['absent_key'])
+        self.assertEqual(result, kvs)
+
+        self.collection.put_many([('key_0', 'new_value')], chunk_size=10)
+        self.assertEqual(self.collection.get('key_0'), 'new_value')
+
+        self.collection.delete_many(kvs.keys(), chunk_size=100)
+        self.assertEqual(self.collection.count, 0)
+        self.assertEqual(self.collection.get_many(['key_1']), {})
+        self.collection.commit()
+
+    def test_pooled_collection(self):
+
+        collection = kvlite.open(
+            URI + '.kvlite_test', pool={'min_size': 1, 'max_size': 4})
+        errors = list()
+
+        def worker(n):
+            try:
+                for i in xrange(50):
+                    k = 'key_{}_{}'.format(n, i)
+                    collection.put(k, i)
+                    collection.commit()
+                    self.assertEqual(collection.get(k), i)
+            except Exception, err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(collection.count, 400)
+        self.assertLessEqual(collection._manager.pool.size, 4)
+        collection.close()
+
+    def test_reconnect_after_lost_connection(self):
+
+        self.collection.put('key', 'value')
+        self.collection.commit()
+
+        manager = MysqlCollectionManager(URI)
+        manager.cursor().execute('KILL %d' % self.manager._conn.thread_id())
+        manager.close()
+
+        self.assertEqual(self.collection.get('key'), 'value')
+
+    def test_lost_connection_with_pending_writes(self):
+
+        self.collection.put('key', 'value')
+
+        manager = MysqlCollectionManager(URI)
+        manager.cursor().execute('KILL %d' % self.manager._conn.thread_id())
+        manager.close()
+
+        self.assertRaises(Exception, self.collection.get, 'key')
+
+    def test_lost_connection_with_pending_writes_of_other_collection(self):
+
+        if 'kvlite_other' not in self.manager.collections():
+            self.manager.create('kvlite_other')
+        other = self.manager.collection_class(self.manager, 'kvlite_other')
+        other.put('key', 'value')
+
+        manager = MysqlCollectionManager(URI)
+        manager.cursor().execute('KILL %d' % self.manager._conn.thread_id())
+        manager.close()
+
+        self.assertRaises(Exception, self.collection.get, 'key')
+        self.manager.reconnect()
+        self.manager.remove('kvlite_other')
+
+    def test_scan(self):
+
+        keys = ['a_%03d' % i for i in xrange(30)] + ['b_%03d' % i for i in xrange(30)]
+        self.collection.put_many((k, k) for k in keys)
+        self.collection.put('c', 'c')
+
+        self.assertEqual(list(self.collection.scan(keys_only=True, batch_size=7)), keys + ['c'])
+        self.assertEqual(list(self.collection.scan(prefix='a_', keys_only=True, batch_size=7)), keys[:30])
+        self.assertEqual(
+            list(self.collection.scan(prefix='b_', reverse=True, keys_only=True, batch_size=7)),
+            list(reversed(keys[30:])))
+        self.assertEqual(
+            list(self.collection.scan(start='a_010', end='a_020', batch_size=3)),
+            [(k, k) for k in keys[10:20]])
+        self.assertEqual(
+            list(self.collection.scan(start='a_025', limit=10, keys_only=True, batch_size=3)),
+            keys[25:35])
+        self.assertEqual(list(self.collection.scan(prefix='b_0', start='b_028', keys_only=True)), keys[58:])
+        self.assertEqual(list(self.collection.scan(prefix='d')), [])
+        self.assertEqual(list(self.collection.scan(limit=0)), [])
+
+    def test_items_batch_size_and_stream(self):
+
+        kvs = [('key_%03d' % i, {'i': i}) for i in xrange(25)]
+        self.collection.put_many(kvs)
+        self.collection.commit()
+        self.assertEqual(list(self.collection.items(batch_size=7)), kvs)
+        self.assertEqual(list(self.collection.items(batch_size=5)), kvs)
+        self.assertEqual(list(self.collection.keys(batch_size=7)), [k for k, _ in kvs])
+        self.assertEqual(list(self.collection.items(batch_size=7, stream=True)), kvs)
+        self.assertEqual(list(self.collection.keys(batch_size=4, stream=True)), [k for k, _ in kvs])
+
+        # the collection is available during streaming
+        stream = self.collection.items(batch_size=10, stream=True)
+        self.assertEqual(next(stream), kvs[0])
+        self.assertEqual(self.collection.get('key_024'), {'i': 24})
+        self.assertEqual(list(stream), kvs[1:])
+
+    def test_stats(self):
+
+        self.collection.put_many(('key_%03d' % i, 'value') for i in xrange(10))
+        self.collection.commit()
+        self.assertEqual(self.collection.estimated_count(exact=True), 10)
+        self.assertTrue(self.collection.estimated_count() >= 0)
+        stats = self.collection.stats()
+        self.assertEqual(stats['documents'], 10)
+        self.assertEqual(stats['key_lengths'][8], 10)
+
+        self.collection.enable_stats()
+        self.collection.put('key_000', 'another value')
+        self.collection.put('k' * 50, 'value')
+        self.collection.delete('key_001')
+        self.collection.commit()
+        self.assertEqual(self.collection.count, 10)
+        self.assertEqual(self.collection.stats(), self.collection.stats(exact=True))
+        self.collection.disable_stats()
+
+    def test_exists(self):
+
+        self.collection.put_many(('key_%d' % i, i) for i in xrange(10))
+        self.assertTrue(self.collection.exists('key_1'))
+        self.assertFalse(self.collection.exists('absent'))
+        self.assertEqual(self.collection.exists_many(['key_1', 'absent', 'key_2']), set(['key_1', 'key_2']))
+        self.collection.enable_bloom_filter()
+        self.assertFalse('absent' in self.collection)
+        self.assertTrue('key_9' in self.collection)
+
+    def test_binary_keys(self):
+
+        collection_name = 'kvlite_binary'
+        manager = MysqlCollectionManager(URI)
+        if collection_name in manager.collections():
+            manager.remove(collection_name)
+        manager.create(collection_name, key_type='binary')
+        self.assertEqual(manager.key_type(collection_name), ('binary', 16))
+        collection = manager.collection_class(manager, collection_name)
+        keys = sorted('%032x' % (i * 7919) for i in range(1, 21))
+        collection.put_many((k, i) for i, k in enumerate(keys))
+        self.assertEqual(collection.get(keys[0]), 0)
+        self.assertEqual(collection.get_many(keys[:3]), {keys[0]: 0, keys[1]: 1, keys[2]: 2})
+        self.assertEqual(list(collection.scan(keys_only=True)), keys)
+        self.assertEqual(list(collection.keys()), keys)
+        self.assertRaises(RuntimeError, collection.put, 'ab', 1)
+        collection.delete(keys[0])
+        self.assertFalse(keys[0] in collection)
+        collection.commit()
+        manager.remove(collection_name)
+        collection.close()
+
+    def test_ttl(self):
+
+        self.manager.enable_ttl(self.collection_name)
+        collection = self.manager.collection_class(self.manager, self.collection_name)
+        collection.put('a', 1, ttl=-1)
+        collection.put_many([('b', 2), ('c', 3)], ttl=3600)
+        collection.put('d', 4)
+        self.assertEqual(collection.get('a'), None)
+        self.assertFalse(collection.exists('a'))
+        self.assertEqual(collection.get_many(['a', 'b', 'd']), {'b': 2, 'd': 4})
+        self.assertEqual(sorted(collection.keys()), ['b', 'c', 'd'])
+        self.assertEqual(collection.sweep(), 1)
+        self.assertEqual(collection.count, 3)
+
     def test_long_key(self):
 
         self.assertRaises(RuntimeError, self.collection.get, '1' * 256)
         self.assertRaises(
             RuntimeError, self.collection.put, '1' * 256, 'long_key')
         self.assertRaises(RuntimeError, self.collection.delete, '1' * 256)
+        self.assertRaises(
+            RuntimeError, self.collection.put_many, [('1' * 256, 'long_key')])
+        self.assertRaises(RuntimeError, self.collection.get_many, ['1' * 256])
+        self.assertRaises(
+            RuntimeError, self.collection.delete_many, ['1' * 256])
 
     def test_absent_key(self):
 
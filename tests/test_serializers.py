@@ -2,10 +2,24 @@ import sys
 if '' not in sys.path:
     sys.path.append('')
 sys.path.append('..')
+import pickle
 import unittest
 
 from kvlite import cPickleSerializer as cps
 from kvlite import CompressedJsonSerializer as cjs
+from kvlite import BinaryPickleSerializer
+from kvlite import MarshalSerializer
+from kvlite import MsgpackSerializer
+from kvlite import CompressedSerializer
+from kvlite import train_dictionary
+from kvlite import SERIALIZERS
+from kvlite import _pack_msgpack
+from kvlite import _unpack_msgpack
+
+DOCUMENT = {
+    'id': 12345, 'name': u'n\xe4me', 'raw': '\x00\xff', 'score': 0.5, 'active': True,
+    'parent': None, 'tags': [u'a', u'b'], 'nested': {u'level': -3, u'big': 2 ** 40, u'neg': -2 ** 40},
+}
 
 class KvliteSerializersTests(unittest.TestCase):
 
@@ -44,7 +58,96 @@ class KvliteSerializersTests(unittest.TestCase):
         v = {'a':1, 'b':2, 'c':3}
         self.assertEqual(cjs.loads(cjs.dumps(v)), v)
 
-        
+
+    def test_binary_serializers(self):
+
+        for serializer in (BinaryPickleSerializer, MarshalSerializer):
+            self.assertEqual(serializer.loads(serializer.dumps(DOCUMENT)), DOCUMENT)
+            self.assertEqual(serializer.loads(serializer.dumps((1, 2, 3))), (1, 2, 3))
+        self.assertTrue(len(BinaryPickleSerializer.dumps(DOCUMENT)) < len(cps.dumps(DOCUMENT)))
+        self.assertRaises(ValueError, MarshalSerializer.dumps, object())
+        self.assertEqual(SERIALIZERS['msgpack'], MsgpackSerializer)
+
+    def test_msgpack_serializer(self):
+
+        self.assertEqual(MsgpackSerializer.loads(MsgpackSerializer.dumps(DOCUMENT)), DOCUMENT)
+        self.assertEqual(MsgpackSerializer.loads(MsgpackSerializer.dumps((1, 2, 3))), [1, 2, 3])
+
+    def test_pure_python_msgpack(self):
+
+        def dumps(v):
+            out = list()
+            _pack_msgpack(v, out)
+            return ''.join(out)
+
+        # encodings from MessagePack specification
+        self.assertEqual(dumps(None), '\xc0')
+        self.assertEqual(dumps(1), '\x01')
+        self.assertEqual(dumps(-1), '\xff')
+        self.assertEqual(dumps(200), '\xcc\xc8')
+        self.assertEqual(dumps(-200), '\xd1\xff\x38')
+        self.assertEqual(dumps(u'abc'), '\xa3abc')
+        self.assertEqual(dumps('abc'), '\xc4\x03abc')
+        self.assertEqual(dumps([1, 2]), '\x92\x01\x02')
+        self.assertEqual(dumps({u'a': 1}), '\x81\xa1a\x01')
+
+        values = [
+            DOCUMENT, 0, 127, 128, 2 ** 16, 2 ** 32, 2 ** 64 - 1, -32, -33, -2 ** 15, -2 ** 63,
+            u'x' * 31, u'x' * 300, u'x' * 70000, 'y' * 300, 'y' * 70000,
+            range(20), range(70000), dict((unicode(i), i) for i in range(20)), 1.5, False,
+        ]
+        for v in values:
+            self.assertEqual(_unpack_msgpack(dumps(v)), (v, len(dumps(v))))
+        self.assertRaises(ValueError, dumps, 2 ** 64)
+        self.assertRaises(TypeError, dumps, object())
+        self.assertRaises(ValueError, _unpack_msgpack, '\xc1')
+
+
+class KvliteCompressedSerializerTests(unittest.TestCase):
+
+    def test_threshold(self):
+
+        serializer = CompressedSerializer(MarshalSerializer, threshold=100)
+        small = serializer.dumps('x' * 20)
+        self.assertEqual(small, '\x00' + MarshalSerializer.dumps('x' * 20))
+        self.assertEqual(serializer.loads(small), 'x' * 20)
+        big = serializer.dumps('x' * 1000)
+        self.assertEqual(big[0], '\x01')
+        self.assertTrue(len(big) < 100)
+        self.assertEqual(serializer.loads(big), 'x' * 1000)
+        self.assertEqual(serializer.loads(serializer.dumps(DOCUMENT)), DOCUMENT)
+
+        # not compressible value is stored as is
+        data = MarshalSerializer.dumps(''.join(chr(i) for i in range(256)))
+        self.assertEqual(serializer.dumps(''.join(chr(i) for i in range(256))), '\x00' + data)
+
+    def test_dictionary(self):
+
+        documents = [{'name': 'user_%d' % i, 'email': 'user_%d@example.com' % i, 'active': True}
+                     for i in range(200)]
+        dictionary = train_dictionary(BinaryPickleSerializer.dumps(d) for d in documents[:100])
+        self.assertTrue(0 < len(dictionary) <= 32768)
+
+        plain = CompressedSerializer(threshold=0, level=9)
+        trained = CompressedSerializer(threshold=0, level=9, dictionary=dictionary)
+        plain_size = sum(len(plain.dumps(d)) for d in documents[100:])
+        trained_size = sum(len(trained.dumps(d)) for d in documents[100:])
+        self.assertTrue(trained_size < plain_size * 0.7)
+        for d in documents[100:]:
+            data = trained.dumps(d)
+            self.assertEqual(data[0], '\x02')
+            self.assertEqual(trained.loads(data), d)
+            self.assertEqual(trained.loads(plain.dumps(d)), d)
+
+        self.assertRaises(RuntimeError, plain.loads, trained.dumps(documents[0]))
+        other = CompressedSerializer(threshold=0, dictionary=dictionary[1:])
+        self.assertRaises(RuntimeError, other.loads, trained.dumps(documents[0]))
+        self.assertRaises(RuntimeError, CompressedSerializer, dictionary='x' * 40000)
+
+        restored = pickle.loads(pickle.dumps(trained))
+        self.assertEqual(restored.loads(trained.dumps(documents[0])), documents[0])
+
+
 if __name__ == '__main__':
     unittest.main()        
 
@@ -0,0 +1,286 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import time
+import unittest
+
+import kvlite
+
+from kvlite import HashRing
+from kvlite import ShardedCollection
+from kvlite import merge_sorted
+
+
+def shard(name):
+    return kvlite.open('sqlite://memory:%s' % name)
+
+
+class KvliteHashRingTests(unittest.TestCase):
+
+    def test_node(self):
+
+        ring = HashRing(['a', 'b', 'c'])
+        self.assertEqual(ring.nodes, ['a', 'b', 'c'])
+        keys = ['key_%d' % i for i in range(3000)]
+        nodes = [ring.node(k) for k in keys]
+        other = HashRing(['c', 'b', 'a'])
+        self.assertEqual(nodes, [other.node(k) for k in keys])
+        for node in ring.nodes:
+            self.assertTrue(nodes.count(node) > 600)
+
+    def test_add_moves_minimal_keys(self):
+
+        ring = HashRing(['a', 'b', 'c'])
+        keys = ['key_%d' % i for i in range(3000)]
+        before = dict((k, ring.node(k)) for k in keys)
+        ring.add('d')
+        moved = [k for k in keys if ring.node(k) != before[k]]
+        self.assertTrue(len(moved) < len(keys) * 0.35)
+        for k in moved:
+            self.assertEqual(ring.node(k), 'd')
+        ring.remove('d')
+        self.assertEqual(dict((k, ring.node(k)) for k in keys), before)
+
+    def test_errors(self):
+
+        ring = HashRing(['a'])
+        self.assertRaises(RuntimeError, ring.add, 'a')
+        self.assertRaises(RuntimeError, ring.remove, 'b')
+        ring.remove('a')
+        self.assertRaises(RuntimeError, ring.node, 'key')
+
+
+class KvliteShardedCollectionTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.collection = ShardedCollection(dict((name, shard(name)) for name in ('a', 'b', 'c')))
+
+    def tearDown(self):
+
+        self.collection.close()
+
+    def test_routing(self):
+
+        data = dict(('key_%03d' % i, {'i': i}) for i in range(100))
+        for k, v in data.items():
+            self.collection.put(k, v)
+        for k, v in data.items():
+            self.assertEqual(self.collection.get(k), v)
+            self.assertTrue(self.collection.exists(k))
+        self.assertEqual(self.collection.count, 100)
+        for name, collection in self.collection.shards.items():
+            self.assertTrue(collection.count > 0)
+            for k in collection.keys():
+                self.assertEqual(self.collection.shard(k), collection)
+        self.assertEqual(dict(self.collection.items()), data)
+        self.assertEqual(sorted(self.collection.keys()), sorted(data))
+
+        self.collection.delete('key_000')
+        self.assertEqual(self.collection.get('key_000'), None)
+        self.assertFalse('key_000' in self.collection)
+        self.assertEqual(self.collection.count, 99)
+
+    def test_many(self):
+
+        data = dict(('key_%03d' % i, i) for i in range(100))
+        self.collection.put_many(data)
+        self.assertEqual(self.collection.get_many(data.keys()), data)
+        self.collection.delete_many(['key_%03d' % i for i in range(50)])
+        self.assertEqual(self.collection.count, 50)
+        self.assertEqual(self.collection.get_many(['key_000', 'key_050']), {'key_050': 50})
+
+    def test_scan(self):
+
+        keys = ['key_%03d' % i for i in range(100)]
+        self.collection.put_many((k, k) for k in keys)
+        self.assertEqual(list(self.collection.scan(keys_only=True)), keys)
+        self.assertEqual(list(self.collection.scan(reverse=True, keys_only=True)), keys[::-1])
+        self.assertEqual(list(self.collection.scan(start='key_010', limit=3)),
+                         [('key_010', 'key_010'), ('key_011', 'key_011'), ('key_012', 'key_012')])
+        self.assertEqual(list(self.collection.scan(prefix='key_09', keys_only=True, batch_size=3)),
+                         keys[90:])
+
+    def test_scan_limit_after_skipped_documents(self):
+
+        keys = ['key_%03d' % i for i in range(100)]
+        self.collection.put_many((k, k) for k in keys)
+        # the documents of other shards are skipped, like old copies during rebalancing
+        self.collection._owns = lambda name, k: int(k[4:]) % 10 == 0
+        owned = keys[::10]
+        for limit in (1, 5, 10):
+            self.assertEqual(list(self.collection.scan(keys_only=True, limit=limit)), owned[:limit])
+        self.assertEqual(list(self.collection.scan(keys_only=True, reverse=True, limit=3)),
+                         owned[::-1][:3])
+        self.assertEqual(list(self.collection.scan(start='key_001', keys_only=True, limit=4)),
+                         owned[1:5])
+
+    def test_add_shard_and_rebalance(self):
+
+        data = dict(('key_%03d' % i, i) for i in range(300))
+        self.collection.put_many(data)
+        self.collection.add_shard('d', shard('d'))
+
+        # not moved documents are available from previous shards
+        self.assertEqual(self.collection.get_many(data.keys()), data)
+        self.assertEqual(dict(self.collection.items()), data)
+        moving = [k for k in data if self.collection.shard(k) is self.collection.shards['d']]
+        self.assertTrue(0 < len(moving) < 150)
+        self.assertEqual(self.collection.get(moving[0]), data[moving[0]])
+
+        # writes during rebalancing are not overwritten by old versions
+        self.collection.put(moving[0], 'new')
+        self.collection.delete(moving[1])
+        self.assertEqual(dict(self.collection.items())[moving[0]], 'new')
+        self.assertRaises(RuntimeError, self.collection.add_shard, 'e', shard('e'))
+
+        self.assertEqual(self.collection.rebalance(batch_size=7), len(moving) - 1)
+        data[moving[0]] = 'new'
+        del data[moving[1]]
+        self.assertEqual(self.collection.count, len(data))
+        self.assertEqual(dict(self.collection.items()), data)
+        self.assertEqual(sorted(self.collection.shards['d'].keys()), sorted(moving[:1] + moving[2:]))
+        self.assertEqual(self.collection.rebalance(), 0)
+
+    def test_delete_during_rebalance(self):
+
+        data = dict(('key_%03d' % i, i) for i in range(100))
+        self.collection.put_many(data)
+        self.collection.add_shard('d', shard('d'))
+        moving = sorted(k for k in data if self.collection.shard(k) is self.collection.shards['d'])
+        source = self.collection._shards[self.collection._previous_ring.node(moving[0])]
+        get_many_raw = source._get_many_raw
+
+        def get_many_raw_with_delete(keys, **kwargs):
+            rows = get_many_raw(keys, **kwargs)
+            if moving[0] in keys:
+                self.collection.delete(moving[0])
+            return rows
+
+        source._get_many_raw = get_many_raw_with_delete
+        self.collection.rebalance()
+        del data[moving[0]]
+        self.assertEqual(self.collection.get(moving[0]), None)
+        self.assertEqual(dict(self.collection.items()), data)
+
+    def test_rebalance_keeps_expiry(self):
+
+        self.collection.enable_ttl()
+        self.collection.put_many([('key_%03d' % i, i) for i in range(100)], ttl=3600)
+        self.collection.put('permanent', 1)
+        self.collection.add_shard('d', shard('d'))
+        self.collection.shards['d'].enable_ttl()
+        self.collection.rebalance()
+        target = self.collection.shards['d']
+        rows = target._get_many_raw(list(target.keys()), with_expiry=True)
+        self.assertTrue(rows)
+        for k, _, e in rows:
+            if k == 'permanent':
+                self.assertEqual(e, None)
+            else:
+                self.assertTrue(e > time.time() + 3500)
+
+    def test_sweep(self):
+
+        self.collection.enable_ttl()
+        self.collection.put_many([('key_%03d' % i, i) for i in range(30)], ttl=-1)
+        jobs = self.collection.sweep(background=True)
+        self.assertEqual(len(jobs), 3)
+        for job in jobs:
+            job.run()
+        self.assertEqual(sum(job.deleted for job in jobs), 30)
+        self.assertEqual(self.collection.sweep(), 0)
+
+    def test_remove_shard(self):
+
+        data = dict(('key_%03d' % i, i) for i in range(100))
+        self.collection.put_many(data)
+        self.collection.remove_shard('a')
+        self.assertEqual(self.collection.get_many(data.keys()), data)
+        self.collection.rebalance()
+        self.assertEqual(sorted(self.collection.shards), ['b', 'c'])
+        self.assertEqual(dict(self.collection.items()), data)
+        self.collection.remove_shard('b')
+        self.collection.rebalance()
+        self.assertRaises(RuntimeError, self.collection.remove_shard, 'c')
+        self.assertEqual(self.collection.shards['c'].count, 100)
+
+    def test_open_shards(self):
+
+        collection = kvlite.open(['sqlite://memory:test', 'sqlite://memory:test2'])
+        self.assertTrue(isinstance(collection, ShardedCollection))
+        self.assertEqual(sorted(collection.shards), ['sqlite://memory:test', 'sqlite://memory:test2'])
+        collection.put('key', 'value')
+        self.assertEqual(collection['key'], 'value')
+        collection.close()
+
+        collection = kvlite.open({'s1': 'sqlite://memory:test', 's2': 'sqlite://memory:test'})
+        self.assertEqual(sorted(collection.shards), ['s1', 's2'])
+        collection.close()
+
+
+class KvliteShardedRingStateTests(unittest.TestCase):
+
+    def open(self, names):
+        return ShardedCollection(dict(
+            (name, kvlite.open('sqlite:///tmp/testdb.sqlite.%s:test' % name)) for name in names))
+
+    def tearDown(self):
+
+        for name in 'abcd':
+            kvlite.remove('sqlite:///tmp/testdb.sqlite.%s:test' % name)
+
+    def test_rebalance_after_reopen(self):
+
+        collection = self.open('abc')
+        data = dict(('key_%03d' % i, i) for i in range(100))
+        collection.put_many(data)
+        collection.add_shard('d', kvlite.open('sqlite:///tmp/testdb.sqlite.d:test'))
+        collection.close()
+
+        self.assertRaises(RuntimeError, self.open, 'abd')
+        collection = self.open('abcd')
+        self.assertEqual(collection._previous_ring.nodes, ['a', 'b', 'c'])
+        self.assertEqual(collection.get_many(data), data)
+        self.assertTrue(collection.rebalance() > 0)
+        collection.close()
+
+        collection = self.open('abcd')
+        self.assertEqual(collection._previous_ring, None)
+        self.assertEqual(dict(collection.items()), data)
+        collection.close()
+
+    def test_shards_changed_while_closed(self):
+
+        collection = self.open('abc')
+        data = dict(('key_%03d' % i, i) for i in range(100))
+        collection.put_many(data)
+        collection.commit()
+        collection.close()
+
+        collection = self.open('abcd')
+        other = self.open('abcd')
+        self.assertEqual(collection._previous_ring.nodes, ['a', 'b', 'c'])
+        self.assertEqual(collection.get_many(data), data)
+        collection.rebalance()
+        other.refresh()
+        self.assertEqual(other._previous_ring, None)
+        self.assertEqual(other.get_many(data), data)
+        other.close()
+        collection.close()
+
+
+class KvliteMergeSortedTests(unittest.TestCase):
+
+    def test_merge_sorted(self):
+
+        self.assertEqual(list(merge_sorted([[1, 4, 7], [], [2, 3, 9]])), [1, 2, 3, 4, 7, 9])
+        self.assertEqual(list(merge_sorted([[7, 4, 1], [9, 3, 2]], reverse=True)), [9, 7, 4, 3, 2, 1])
+        self.assertEqual(list(merge_sorted([[('b', 1)], [('a', 2)]], key=lambda item: item[0])),
+                         [('a', 2), ('b', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,7 +3,11 @@ if '' not in sys.path:
     sys.path.append('')
 sys.path.append('..')
 
+import json
+import time
 import unittest
+import threading
+import multiprocessing
 
 import kvlite 
 from kvlite import SqliteCollection
@@ -12,6 +16,18 @@ from kvlite import SqliteCollectionManager
 from kvlite import cPickleSerializer
 from kvlite import CompressedJsonSerializer
 
+
+class LockSerializer(object):
+
+    ''' serializer whose documents can't be returned by worker processes '''
+
+    dumps = staticmethod(cPickleSerializer.dumps)
+
+    @staticmethod
+    def loads(v):
+        return threading.Lock()
+
+
 class KvliteSqliteTests(unittest.TestCase):
 
     def setUp(self):
@@ -64,11 +80,167 @@ class KvliteSqliteTests(unittest.TestCase):
         self.assertEqual(self.collection.count, 0)
         self.collection.commit()
 
+    def test_put_get_delete_many(self):
+
+        kvs = dict(('key_{0}'.format(i), 'value_{0}'.format(i)) for i in xrange(1200))
+        self.collection.put_many(kvs)
+        self.assertEqual(self.collection.count, 1200)
+
+        result = self.collection.get_many(kvs.keys() + ['absent_key'])
+        self.assertEqual(result, kvs)
+
+        self.collection.put_many([('key_0', 'new_value')], chunk_size=10)
+        self.assertEqual(self.collection.get('key_0'), 'new_value')
+
+        self.collection.delete_many(kvs.keys(), chunk_size=100)
+        self.assertEqual(self.collection.count, 0)
+        self.assertEqual(self.collection.get_many(['key_1']), {})
+        self.collection.commit()
+
+    def _committed_count(self):
+        ''' return amount of documents visible for another connection '''
+        manager = SqliteCollectionManager('sqlite:///tmp/testdb.sqlite')
+        collection = manager.collection_class(manager, self.collection_name)
+        count = collection.count
+        collection.close()
+        return count
+
+    def test_commit_every(self):
+
+        collection = self.manager.collection_class(
+            self.manager, self.collection_name, commit_every=10)
+        for i in xrange(15):
+            collection.put('key_{0}'.format(i), i)
+        self.assertEqual(self._committed_count(), 10)
+        collection.put_many([('key_{0}'.format(i), i) for i in xrange(15, 20)])
+        self.assertEqual(self._committed_count(), 20)
+
+    def test_commit_interval(self):
+
+        manager = SqliteCollectionManager('sqlite:///tmp/testdb.sqlite')
+        collection = manager.collection_class(
+            manager, self.collection_name, commit_interval=0.05)
+        collection.put('key', 'value')
+        for _ in xrange(40):
+            if self._committed_count() == 1:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self._committed_count(), 1)
+        collection.put('key2', 'value')
+        collection.close()
+        self.assertEqual(self._committed_count(), 2)
+
+    def test_scan(self):
+
+        keys = ['a_%03d' % i for i in xrange(30)] + ['b_%03d' % i for i in xrange(30)]
+        self.collection.put_many((k, k) for k in keys)
+        self.collection.put('c', 'c')
+
+        self.assertEqual(list(self.collection.scan(keys_only=True, batch_size=7)), keys + ['c'])
+        self.assertEqual(list(self.collection.scan(prefix='a_', keys_only=True, batch_size=7)), keys[:30])
+        self.assertEqual(
+            list(self.collection.scan(prefix='b_', reverse=True, keys_only=True, batch_size=7)),
+            list(reversed(keys[30:])))
+        self.assertEqual(
+            list(self.collection.scan(start='a_010', end='a_020', batch_size=3)),
+            [(k, k) for k in keys[10:20]])
+        self.assertEqual(
+            list(self.collection.scan(start='a_025', limit=10, keys_only=True, batch_size=3)),
+            keys[25:35])
+        self.assertEqual(list(self.collection.scan(prefix='b_0', start='b_028', keys_only=True)), keys[58:])
+        self.assertEqual(list(self.collection.scan(prefix='d')), [])
+        self.assertEqual(list(self.collection.scan(limit=0)), [])
+
+    def test_items_batch_size_and_stream(self):
+
+        kvs = [('key_%03d' % i, {'i': i}) for i in xrange(25)]
+        self.collection.put_many(kvs)
+        self.collection.commit()
+        self.assertEqual(list(self.collection.items(batch_size=7)), kvs)
+        self.assertEqual(list(self.collection.items(batch_size=5)), kvs)
+        self.assertEqual(list(self.collection.keys(batch_size=7)), [k for k, _ in kvs])
+        self.assertEqual(list(self.collection.items(batch_size=7, stream=True)), kvs)
+        self.assertEqual(list(self.collection.keys(batch_size=4, stream=True)), [k for k, _ in kvs])
+
+        # the collection is available during streaming
+        stream = self.collection.items(batch_size=10, stream=True)
+        self.assertEqual(next(stream), kvs[0])
+        self.assertEqual(self.collection.get('key_024'), {'i': 24})
+        self.assertEqual(list(stream), kvs[1:])
+
+        # not committed writes are not visible for the stream
+        self.collection.put('key_025', {'i': 25})
+        self.assertEqual(list(self.collection.keys(stream=True)), [k for k, _ in kvs])
+
+    def test_items_lazy(self):
+
+        class CountingSerializer(object):
+            loads_calls = 0
+
+            @classmethod
+            def dumps(cls, v):
+                return cPickleSerializer.dumps(v)
+
+            @classmethod
+            def loads(cls, v):
+                cls.loads_calls += 1
+                return cPickleSerializer.loads(v)
+
+        collection = SqliteCollection(self.manager, self.collection_name, CountingSerializer)
+        collection.put_many(('key_%03d' % i, {'i': i}) for i in xrange(20))
+        values = [v for k, v in collection.items(lazy=True) if k.endswith('5')]
+        self.assertEqual(CountingSerializer.loads_calls, 0)
+        self.assertEqual([v.key for v in values], ['key_005', 'key_015'])
+        self.assertFalse(values[0].loaded)
+        self.assertEqual(values[0].value, {'i': 5})
+        self.assertEqual(values[0].value, {'i': 5})
+        self.assertTrue(values[0].loaded)
+        self.assertEqual(CountingSerializer.loads_calls, 1)
+        self.assertEqual(str(values[1].raw), cPickleSerializer.dumps({'i': 15}))
+
+    def test_parallel_items(self):
+
+        kvs = [('key_%03d' % i, {'i': i}) for i in xrange(50)]
+        self.collection.put_many(kvs)
+        self.collection.commit()
+        self.assertEqual(list(self.collection.parallel_items(workers=2, batch_size=7)), kvs)
+        self.assertEqual(list(self.collection.parallel_items(workers=2, prefetch=1, stream=True)), kvs)
+        self.assertEqual(
+            sorted(self.collection.parallel_items(workers=3, ordered=False, batch_size=4)), kvs)
+
+        collection = SqliteCollection(self.manager, self.collection_name, CompressedJsonSerializer)
+        self.assertRaises(RuntimeError, list, collection.parallel_items(workers=2))
+        self.assertRaises(RuntimeError, list, collection.parallel_items(workers=2, ordered=False))
+
+        # not picklable serializer and not picklable documents
+        collection = SqliteCollection(self.manager, self.collection_name, json)
+        self.assertRaises(RuntimeError, list, collection.parallel_items(workers=2, ordered=False))
+        collection = SqliteCollection(self.manager, self.collection_name, LockSerializer)
+        self.assertRaises(Exception, list, collection.parallel_items(workers=2, ordered=False))
+
+        pool = multiprocessing.Pool(2)
+        self.assertEqual(list(self.collection.parallel_items(workers=2, pool=pool)), kvs)
+        self.assertEqual(list(self.collection.parallel_items(workers=2, pool=pool)), kvs)
+        pool.terminate()
+
     def test_long_key(self):
         
         self.assertRaises(RuntimeError, self.collection.get, '1'*256)
         self.assertRaises(RuntimeError, self.collection.put, '1'*256, 'long_key')
         self.assertRaises(RuntimeError, self.collection.delete, '1'*256)
+        self.assertRaises(RuntimeError, self.collection.put_many, [('1'*256, 'long_key')])
+        self.assertRaises(RuntimeError, self.collection.get_many, ['1'*256])
+        self.assertRaises(RuntimeError, self.collection.delete_many, ['1'*256])
+
+    def test_binary_serializers(self):
+
+        document = {'id': 1, 'raw': '\x00\xff\x00', 'name': u'n\xe4me', 'tags': [1, 2]}
+        for name in ('pickle_binary', 'marshal', 'msgpack'):
+            collection = SqliteCollection(self.manager, self.collection_name, kvlite.SERIALIZERS[name])
+            collection.put(name, document)
+            collection.put_many([(name + '_many', document)])
+            self.assertEqual(collection.get(name), document)
+            self.assertEqual(collection.get_many([name + '_many']), {name + '_many': document})
 
     def test_use_different_serializators(self):
         URI = 'sqlite:///tmp/testdb.sqlite'
@@ -142,6 +314,45 @@ class KvliteSqliteTests(unittest.TestCase):
     def test_incorrect_key(self):
         
         self.assertRaises(RuntimeError, self.collection.get, (1,2,3))        
+
+    def test_pending_writes_of_manager(self):
+
+        self.manager.create('kvlite_other')
+        other = self.manager.collection_class(self.manager, 'kvlite_other')
+        other.put('a', 1)
+        self.collection.put('b', 2)
+        self.assertEqual(self.manager.pending_writes, 2)
+        self.collection.commit()
+        self.assertEqual(self.manager.pending_writes, 0)
+        self.manager.remove('kvlite_other')
+
+    def test_lost_connection_retry(self):
+
+        put_rows = self.collection._put_rows
+        failures = list()
+
+        def put_rows_once_failing(rows, expires=None):
+            if not failures:
+                failures.append(rows)
+                raise RuntimeError('connection lost')
+            return put_rows(rows, expires)
+
+        self.collection._put_rows = put_rows_once_failing
+        self.manager.lost_connection = lambda err: True
+        self.manager.reconnect = lambda: None
+
+        # the list is written again by the retried call
+        data = [('k%02d' % i, i) for i in range(30)]
+        self.collection.put_many(data, chunk_size=10)
+        self.assertEqual(self.collection.count, 30)
+        self.collection.delete_many([k for k, _ in data])
+
+        # the generator is not retried, its first chunk is consumed
+        del failures[:]
+        self.assertRaises(RuntimeError, self.collection.put_many,
+                          (('k%02d' % i, i) for i in range(30)), 10)
+        self.assertEqual(self.collection.count, 0)
+
         
 if __name__ == '__main__':
     unittest.main()        
@@ -5,6 +5,7 @@ if '' not in sys.path:
 
 import unittest
 
+import kvlite
 from kvlite import SqliteCollectionManager
 
 class KvliteSqliteCollectionManagerTests(unittest.TestCase):
@@ -21,6 +22,42 @@ class KvliteSqliteCollectionManagerTests(unittest.TestCase):
         self.assertEqual(params['db'], 'tests/db/testdb.sqlite')
         self.assertEqual(params['collection'], None)
 
+    def test_parse_uri_with_options(self):
+        params = SqliteCollectionManager.parse_uri(
+            'sqlite://tests/db/testdb.sqlite:kvlite_test?journal=WAL&synchronous=normal&cache_size=-2000')
+        self.assertEqual(params['db'], 'tests/db/testdb.sqlite')
+        self.assertEqual(params['collection'], 'kvlite_test')
+        self.assertEqual(params['options'],
+            {'journal': 'wal', 'synchronous': 'normal', 'cache_size': '-2000'})
+
+    def test_parse_uri_with_profile(self):
+        params = SqliteCollectionManager.parse_uri(
+            'sqlite://tests/db/testdb.sqlite?profile=throughput&synchronous=full')
+        self.assertEqual(params['collection'], None)
+        self.assertEqual(params['options']['journal'], 'wal')
+        self.assertEqual(params['options']['synchronous'], 'full')
+        self.assertNotIn('profile', params['options'])
+
+    def test_parse_uri_incorrect_options(self):
+        parse_uri = SqliteCollectionManager.parse_uri
+        self.assertRaises(RuntimeError, parse_uri, 'sqlite://memory?profile=unknown')
+        self.assertRaises(RuntimeError, parse_uri, 'sqlite://memory?unknown=1')
+        self.assertRaises(RuntimeError, parse_uri, 'sqlite://memory?journal=unknown')
+        self.assertRaises(RuntimeError, parse_uri, 'sqlite://memory?cache_size=big')
+
+    def test_manager_pragmas(self):
+
+        manager = SqliteCollectionManager(
+            'sqlite://tests/db/testdb.sqlite?profile=throughput&cache_size=-1000')
+        cursor = manager.cursor()
+        cursor.execute('PRAGMA journal_mode;')
+        self.assertEqual(cursor.fetchone()[0], 'wal')
+        cursor.execute('PRAGMA synchronous;')
+        self.assertEqual(cursor.fetchone()[0], 1)
+        cursor.execute('PRAGMA cache_size;')
+        self.assertEqual(cursor.fetchone()[0], -1000)
+        manager.close()
+
     def test_manager(self):
         
         URI = 'sqlite://tests/db/testdb.sqlite'
@@ -68,6 +105,67 @@ class KvliteSqliteCollectionManagerTests(unittest.TestCase):
 
         manager.close()
     
+    def test_schema_version(self):
+
+        manager = SqliteCollectionManager('sqlite://memory')
+        manager.create('v2', schema_version=2)
+        manager.create('v1')
+        self.assertEqual(manager.schema_version('v2'), 2)
+        self.assertEqual(manager.schema_version('v1'), 1)
+        self.assertEqual(manager.schema_version('unknown'), 1)
+        self.assertRaises(RuntimeError, manager.create, 'v3', schema_version=3)
+        SQL = 'SELECT sql FROM sqlite_master WHERE name = ?;'
+        self.assertIn('WITHOUT ROWID', manager.connection.execute(SQL, ('v2',)).fetchone()[0])
+        manager.remove('v2')
+        self.assertEqual(manager.schema_version('v2'), 1)
+        manager.close()
+
+    def test_collection_manager_schema_version(self):
+
+        manager = kvlite.CollectionManager('sqlite://memory')
+        manager.create('v1')
+        manager.create('v2', schema_version=2)
+        self.assertEqual(manager.schema_version('v1'), 1)
+        self.assertEqual(manager.schema_version('v2'), 2)
+        self.assertEqual(manager.migrate('v1'), 1)
+        self.assertEqual(manager.schema_version('v1'), 2)
+        manager.backend_manager.close()
+
+        collection = kvlite.open('sqlite://memory:v2', schema_version=2)
+        self.assertEqual(collection._rowid, 'k')
+        collection.close()
+
+    def test_migrate(self):
+
+        manager = SqliteCollectionManager('sqlite://memory')
+        manager.create('docs', schema_version=1)
+        collection = manager.collection_class(manager, 'docs')
+        keys = ['key_%03d' % i for i in range(100)]
+        collection.put_many((k, {'i': i}) for i, k in enumerate(reversed(keys)))
+        collection.enable_stats()
+        collection.create_index('i', 'int')
+        collection.commit()
+
+        self.assertEqual(manager.migrate('docs'), 1)
+        self.assertEqual(manager.schema_version('docs'), 2)
+        self.assertEqual(manager.migrate('docs'), 2)
+        self.assertRaises(RuntimeError, manager.migrate, 'unknown')
+
+        collection = manager.collection_class(manager, 'docs')
+        self.assertEqual(list(collection.keys(batch_size=7)), keys)
+        self.assertEqual(list(collection.keys(stream=True)), keys)
+        self.assertEqual(collection.get('key_000'), {'i': 99})
+        self.assertEqual([k for k, _ in collection.find('i', 5)], ['key_094'])
+        collection.put('key_100', {'i': 100})
+        collection.delete('key_000')
+        self.assertEqual(collection.count, 100)
+        self.assertEqual(collection.stats(), collection.stats(exact=True))
+
+        self.assertEqual(manager.migrate('docs', schema_version=1), 2)
+        collection = manager.collection_class(manager, 'docs')
+        self.assertEqual(sorted(collection.keys()), keys[1:] + ['key_100'])
+        manager.close()
+
     def test_incorrect_uri_wrong_collection_in_remove(self):
 
         URI = 'sqlite://memory'
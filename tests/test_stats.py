@@ -0,0 +1,117 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import unittest
+
+from kvlite import STATS_TABLE
+from kvlite import SqliteCollectionManager
+
+
+class KvliteStatsTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.manager = SqliteCollectionManager('sqlite://memory:test')
+        self.manager.create('test')
+        self.collection = self.manager.collection_class(self.manager, 'test', Raw)
+
+    def tearDown(self):
+
+        self.manager.close()
+
+    def assertStats(self, stats, documents, size, key_lengths):
+
+        self.assertEqual(stats['documents'], documents)
+        self.assertEqual(stats['bytes'], size)
+        for upper, amount in key_lengths.items():
+            self.assertEqual(stats['key_lengths'][upper], amount)
+        self.assertEqual(sum(stats['key_lengths'].values()), documents)
+
+    def test_computed_stats(self):
+
+        self.assertStats(self.collection.stats(), 0, 0, {})
+        self.assertEqual(self.collection.stats()['avg_bytes'], 0.0)
+        self.collection.put('a', 'x' * 10)
+        self.collection.put('b' * 20, 'x' * 30)
+        stats = self.collection.stats()
+        self.assertStats(stats, 2, 40, {8: 1, 32: 1})
+        self.assertEqual(stats['avg_bytes'], 20.0)
+        self.assertEqual(self.collection.estimated_count(), 2)
+
+    def test_maintained_stats(self):
+
+        self.collection.put('a', 'x' * 10)
+        self.collection.commit()
+        self.collection.enable_stats()
+        self.assertRaises(RuntimeError, self.collection.enable_stats)
+        self.assertStats(self.collection.stats(), 1, 10, {8: 1})
+
+        self.collection.put('b' * 20, '\x00' * 30)
+        self.collection.put('a', 'x' * 5)
+        self.collection.put_many([('c' * 100, 'y'), ('d', 'z' * 4)])
+        self.collection.delete('d')
+        stats = self.collection.stats()
+        self.assertStats(stats, 3, 36, {8: 1, 32: 1, 128: 1})
+        self.assertEqual(stats, self.collection.stats(exact=True))
+        self.assertEqual(self.collection.count, 3)
+        self.assertEqual(self.collection.estimated_count(), 3)
+        self.assertEqual(self.collection.estimated_count(exact=True), 3)
+
+        # statistics is updated in the transaction of writes
+        self.collection.commit()
+        self.collection.delete_many(['a', 'b' * 20])
+        self.assertEqual(self.collection.count, 1)
+        self.manager.connection.rollback()
+        self.assertEqual(self.collection.count, 3)
+
+        # another collection object sees enabled statistics
+        collection = self.manager.collection_class(self.manager, 'test', Raw)
+        self.assertTrue(collection._stats)
+
+        self.collection.disable_stats()
+        self.assertEqual(self.manager.stats('test'), None)
+        self.collection.put('e', 'e')
+        self.assertEqual(self.collection.count, 4)
+
+    def test_metadata_cache(self):
+
+        self.collection.enable_stats()
+        self.manager.collection_class(self.manager, 'test', Raw)
+        loaded = list()
+        load_tables = self.manager._load_tables
+        self.manager._load_tables = lambda sql: loaded.append(sql) or load_tables(sql)
+
+        collection = self.manager.collection_class(self.manager, 'test', Raw)
+        self.assertEqual(collection.count, 0)
+        self.assertEqual(collection.count, 0)
+        self.assertEqual(loaded, [])
+
+        # DDL of the manager drops the cache
+        self.manager.create('other')
+        self.assertEqual(sorted(self.manager.collections()), ['other', 'test'])
+        self.assertEqual(len(loaded), 1)
+
+    def test_remove_collection(self):
+
+        self.collection.enable_stats()
+        self.manager.remove('test')
+        self.assertEqual(self.manager.stats('test'), None)
+        self.assertIn(STATS_TABLE, self.manager.tables())
+        self.assertNotIn(STATS_TABLE, self.manager.collections())
+
+
+class Raw(object):
+
+    @staticmethod
+    def dumps(v):
+        return v
+
+    @staticmethod
+    def loads(v):
+        return v
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import time
+import unittest
+
+import kvlite
+
+from kvlite import ExpirySweeper
+from kvlite import CachedCollection
+from kvlite import SqliteCollectionManager
+
+
+class KvliteTTLTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.manager = SqliteCollectionManager('sqlite://memory:test')
+        self.manager.create('test')
+        self.collection = self.manager.collection_class(self.manager, 'test')
+        self.collection.enable_ttl()
+
+    def tearDown(self):
+
+        self.manager.close()
+
+    def expire(self, keys):
+        ''' move expiry time of documents to the past '''
+        self.collection._fetchall('UPDATE test SET e = ? WHERE k IN (%s);' % ','.join('?' * len(keys)),
+                                  [time.time() - 1] + list(keys))
+
+    def test_enable_ttl(self):
+
+        self.assertTrue(self.manager.ttl_enabled('test'))
+        self.assertRaises(RuntimeError, self.collection.enable_ttl)
+        self.manager.create('plain')
+        self.assertFalse(self.manager.ttl_enabled('plain'))
+        plain = self.manager.collection_class(self.manager, 'plain')
+        self.assertRaises(RuntimeError, plain.put, 'a', 1, ttl=10)
+        self.assertRaises(RuntimeError, plain.put_many, [('a', 1)], ttl=10)
+        self.assertTrue(self.manager.collection_class(self.manager, 'test')._ttl)
+
+    def test_expired_documents_are_missing(self):
+
+        self.collection.put('a', 1, ttl=3600)
+        self.collection.put('b', 2)
+        self.collection.put_many([('c', 3), ('d', 4)], ttl=3600)
+        self.assertEqual(self.collection.get('a'), 1)
+        self.expire(['a', 'c'])
+        self.assertEqual(self.collection.get('a'), None)
+        self.assertFalse(self.collection.exists('a'))
+        self.assertEqual(self.collection.exists_many(['a', 'b', 'c', 'd']), set(['b', 'd']))
+        self.assertEqual(self.collection.get_many(['a', 'b', 'c', 'd']), {'b': 2, 'd': 4})
+        self.assertEqual(list(self.collection.keys()), ['b', 'd'])
+        self.assertEqual(list(self.collection.keys(stream=True)), ['b', 'd'])
+        self.assertEqual(list(self.collection.scan(keys_only=True)), ['b', 'd'])
+
+        # put without ttl makes the document permanent
+        self.collection.put('a', 5)
+        self.expire(['d'])
+        self.collection.put_many([('d', 6)])
+        self.assertEqual(self.collection.get_many(['a', 'd']), {'a': 5, 'd': 6})
+        self.assertEqual(self.collection._fetchall('SELECT count(*) FROM test WHERE e IS NULL;')[0][0], 3)
+
+    def test_sweep(self):
+
+        self.collection.put_many([('key_%02d' % i, i) for i in range(30)], ttl=3600)
+        self.collection.put('permanent', 1)
+        self.collection.create_index('i')
+        self.expire(['key_%02d' % i for i in range(25)])
+        self.collection.put('key_00', {'i': 'new'})
+        self.assertEqual(self.collection.sweep(batch_size=10), 24)
+        self.assertEqual(self.collection.count, 7)
+        self.assertEqual(self.collection.sweep(), 0)
+        self.assertEqual(list(self.collection.find('i', 'new')), [('key_00', {'i': 'new'})])
+
+    def test_background_sweeper(self):
+
+        self.collection.put_many([('key_%02d' % i, i) for i in range(10)], ttl=3600)
+        sweeper = self.collection.sweep(background=True, batch_size=3, interval=0.01)
+        self.assertTrue(isinstance(sweeper, ExpirySweeper))
+        sweeper.start()
+        self.expire(['key_%02d' % i for i in range(10)])
+        deadline = time.time() + 5
+        while sweeper.deleted < 10 and time.time() < deadline:
+            time.sleep(0.01)
+        sweeper.stop()
+        self.assertEqual(sweeper.deleted, 10)
+        self.assertEqual(self.collection.count, 0)
+
+    def test_ttl_survives_migrate(self):
+
+        self.manager.create('old', schema_version=1)
+        collection = self.manager.collection_class(self.manager, 'old')
+        collection.enable_ttl()
+        collection.put('a', 1, ttl=-1)
+        collection.put('b', 2)
+        collection.commit()
+        self.manager.migrate('old')
+        collection = self.manager.collection_class(self.manager, 'old')
+        self.assertEqual(list(collection.keys()), ['b'])
+        self.assertEqual(collection.sweep(), 1)
+
+    def test_cached_collection(self):
+
+        self.assertRaises(RuntimeError, CachedCollection, self.collection)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,8 @@ if '' not in sys.path:
     sys.path.append('')
 sys.path.append('../')
 
+import os
+import time
 import kvlite
 import unittest
 
@@ -13,6 +15,50 @@ class KvliteUtilsTests(unittest.TestCase):
         uuids = kvlite.get_uuid(1000)
         self.assertEqual(len(set(uuids)), 1000)
 
+    def test_get_id(self):
+
+        ids = kvlite.get_ids(10000)
+        self.assertEqual(len(set(ids)), 10000)
+        self.assertEqual(sorted(ids), ids)
+        self.assertEqual(set(len(id) for id in ids), set([kvlite.ID_LENGTH]))
+        self.assertTrue(kvlite.get_id() > ids[-1])
+        self.assertTrue(abs(kvlite.id_time(kvlite.get_id()) - time.time()) < 1)
+
+    def test_id_generator_same_millisecond(self):
+
+        generator = kvlite.IdGenerator()
+        generator._last_time = int(time.time() * 1000) + 1000
+        ids = generator.many(100)
+        self.assertEqual(sorted(ids), ids)
+        self.assertEqual(len(set(id[:10] for id in ids)), 1)
+
+    def test_id_generator_fork(self):
+
+        generator = kvlite.IdGenerator()
+        # the same millisecond in the parent and the child
+        generator._last_time = int(time.time() * 1000) + 1000
+        generator.next()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.write(write_fd, generator.next())
+            os._exit(0)
+        os.close(write_fd)
+        os.waitpid(pid, 0)
+        child_id = os.read(read_fd, 100)
+        os.close(read_fd)
+        self.assertEqual(len(child_id), kvlite.ID_LENGTH)
+        self.assertNotEqual(child_id, generator.next())
+
+    def test_prefix_end(self):
+
+        self.assertEqual(kvlite.prefix_end('abc'), 'abd')
+        self.assertEqual(kvlite.prefix_end('ab\xff'), 'ac')
+        self.assertEqual(kvlite.prefix_end(u'ab'), 'ac')
+        self.assertEqual(kvlite.prefix_end('\xff\xff'), None)
+        self.assertEqual(kvlite.prefix_end(''), None)
+
     def test_sqlite_open(self):
         
         collection = kvlite.open('sqlite://testdb.sqlite:kvlite_test')
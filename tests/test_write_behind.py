@@ -0,0 +1,197 @@
+import sys
+if '' not in sys.path:
+    sys.path.append('')
+sys.path.append('..')
+
+import time
+import threading
+import weakref
+import unittest
+
+import kvlite
+
+from kvlite import SqliteCollectionManager
+from kvlite import WriteBehindCollection
+
+
+class FailingCollection(object):
+
+    ''' collection proxy which fails put_many() while `failing` is True '''
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.failing = False
+
+    def put_many(self, *args, **kwargs):
+        if self.failing:
+            raise RuntimeError('database is not available')
+        return self.collection.put_many(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+class KvliteWriteBehindTests(unittest.TestCase):
+
+    def setUp(self):
+
+        self.manager = SqliteCollectionManager('sqlite://memory:test')
+        self.manager.create('test')
+        self.backend = self.manager.collection_class(self.manager, 'test')
+        self.collection = WriteBehindCollection(self.backend, max_entries=100, flush_size=50,
+                                                flush_interval=60)
+
+    def tearDown(self):
+
+        self.collection.close()
+
+    def test_read_your_writes(self):
+
+        self.backend.put('stored', 0)
+        self.backend.put('deleted', 1)
+        self.backend.commit()
+        self.collection.put('a', 1)
+        self.collection.put('a', 2)
+        self.collection.delete('deleted')
+        self.assertEqual(self.collection.get('a'), 2)
+        self.assertEqual(self.collection.get('deleted', 'default'), 'default')
+        self.assertEqual(self.collection.get('stored'), 0)
+        self.assertTrue('a' in self.collection)
+        self.assertFalse(self.collection.exists('deleted'))
+        self.assertEqual(self.collection.get_many(['a', 'deleted', 'stored']), {'a': 2, 'stored': 0})
+        self.assertEqual(self.collection.exists_many(['a', 'deleted', 'stored']), set(['a', 'stored']))
+        self.assertEqual(self.backend.get('a'), None)
+        self.assertEqual(self.collection.pending(), 2)
+
+        self.assertEqual(self.collection.flush(), 2)
+        self.assertEqual(self.collection.pending(), 0)
+        self.assertEqual(self.backend.get_many(['a', 'deleted', 'stored']), {'a': 2, 'stored': 0})
+        self.assertEqual(self.collection.flush(), 0)
+
+    def test_background_flush(self):
+
+        self.collection.put_many(('key_%02d' % i, i) for i in range(60))
+        deadline = time.time() + 5
+        while self.collection.pending() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.collection.pending(), 0)
+        self.assertEqual(self.backend.count, 60)
+
+    def test_back_pressure(self):
+
+        backend = FailingCollection(self.backend)
+        collection = WriteBehindCollection(backend, max_entries=10, flush_interval=60, put_timeout=0.05)
+        backend.failing = True
+        collection.put_many(('key_%02d' % i, i) for i in range(10))
+        collection.put('key_00', 'coalesced')
+        self.assertRaises(RuntimeError, collection.put, 'key_10', 10)
+
+        # failed flush keeps changes in the buffer
+        self.assertRaises(RuntimeError, collection.flush)
+        self.assertEqual(collection.pending(), 10)
+        self.assertEqual(collection.get('key_00'), 'coalesced')
+
+        collection.put_timeout = None
+        thread = threading.Thread(target=collection.put, args=('key_10', 10))
+        thread.start()
+        time.sleep(0.05)
+        self.assertTrue(thread.is_alive())
+        backend.failing = False
+        collection.flush()
+        thread.join()
+        # the background thread, woken up by the waiting put, can flush key_10 too
+        self.assertTrue(collection.pending() <= 1)
+        collection.flush()
+        self.assertEqual(self.backend.count, 11)
+        collection.close()
+
+    def test_incorrect_keys(self):
+
+        self.assertRaises(RuntimeError, self.collection.put, 'k' * 300, 1)
+        self.assertEqual(self.collection.pending(), 0)
+
+    def test_unserializable_document(self):
+
+        self.assertRaises(TypeError, self.collection.put, 'bad', threading.Lock())
+        self.assertEqual(self.collection.pending(), 0)
+        self.collection.put('a', 1)
+        self.assertEqual(self.collection.flush(), 1)
+        self.assertEqual(self.backend.get('a'), 1)
+
+    def test_incorrect_document_does_not_stall_buffer(self):
+
+        self.assertRaises(RuntimeError, self.collection.put, 'ttl', 1, ttl=10)
+        self.backend.create_index('name')
+        self.assertRaises(RuntimeError, self.collection.put, 'long', {'name': 'n' * 300})
+        self.assertEqual(self.collection.pending(), 0)
+
+        # the index created after put() rejects the buffered document
+        self.collection.put('good1', {'name': 'a'})
+        self.collection.put('late', {'surname': 's' * 300})
+        self.backend.create_index('surname')
+        self.collection.put('good2', {'name': 'c'})
+        self.assertEqual(self.collection.flush(), 2)
+        self.assertEqual(self.backend.get_many(['good1', 'good2', 'late']),
+                         {'good1': {'name': 'a'}, 'good2': {'name': 'c'}})
+        self.assertEqual(self.collection.pending(), 1)
+        self.collection.delete('late')
+        self.assertEqual(self.collection.flush(), 1)
+        self.assertEqual(self.collection.pending(), 0)
+
+    def test_unserializable_document_of_wrapper(self):
+
+        backend = kvlite.ShardedCollection({'a': kvlite.open('sqlite://memory:sharded')})
+        collection = WriteBehindCollection(backend, flush_interval=60)
+        collection.put('bad', threading.Lock())
+        collection.put_many([('a', 1), ('b', 2)])
+        self.assertEqual(collection.flush(), 2)
+        self.assertEqual(backend.get_many(['a', 'b', 'bad']), {'a': 1, 'b': 2})
+
+        # the document which fails stays in the buffer until it's replaced
+        self.assertEqual(collection.pending(), 1)
+        self.assertRaises(TypeError, collection.flush)
+        self.assertEqual(collection.pending(), 1)
+        collection.put('bad', 3)
+        self.assertEqual(collection.flush(), 1)
+        self.assertEqual(backend.get('bad'), 3)
+        collection.close()
+
+    def test_pass_through_under_lock(self):
+
+        self.collection.put_many(('key_%02d' % i, i) for i in range(10))
+        self.collection.flush()
+        calls = list()
+        call = self.collection._call
+
+        def counting_call(func, *args, **kwargs):
+            calls.append(func)
+            return call(func, *args, **kwargs)
+
+        self.collection._call = counting_call
+        self.assertEqual(self.collection.count, 10)
+        self.assertEqual(len(calls), 1)
+        items = self.collection.items(batch_size=3)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(sorted(k for k, _ in items), ['key_%02d' % i for i in range(10)])
+        self.assertEqual(calls.count(next), 11)
+        self.assertEqual(len(list(self.collection)), 10)
+
+    def test_flush_at_exit(self):
+
+        collection = WriteBehindCollection(self.backend, flush_interval=60)
+        collection.put('a', 1)
+        kvlite._flush_at_exit(weakref.ref(collection))
+        self.assertEqual(collection.pending(), 0)
+        self.assertEqual(self.backend.get('a'), 1)
+        collection.close()
+
+    def test_close(self):
+
+        collection = WriteBehindCollection(kvlite.open('sqlite://memory:other'))
+        collection.put('a', 1)
+        collection.close()
+        self.assertRaises(RuntimeError, collection.put, 'b', 2)
+
+
+if __name__ == '__main__':
+    unittest.main()